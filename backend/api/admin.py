@@ -1,7 +1,12 @@
-from django.contrib import admin
-from .models import MenuItem, Topping, Order, OrderItem, UserProfile, Transaction
+from django.contrib import admin, messages
+from .models import MenuItem, Topping, Order, OrderItem, UserProfile, Transaction, StripeEvent, OrderEvent, GeocodedAddress, \
+    ArchivedOrder, ArchivedOrderItem
+from .events import record
+from .inventory import OutOfStock, reserve_order
+from . import search
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.db import transaction
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -12,17 +17,48 @@ class UserProfileInline(admin.StackedInline):
 class UserAdmin(BaseUserAdmin):
     inlines = (UserProfileInline,)
 
+    # Users own order history, so "deleting" one deactivates it (inactive users can't log in)
+    def delete_model(self, request, obj):
+        obj.is_active = False
+        obj.save(update_fields=['is_active'])
+
+    def delete_queryset(self, request, queryset):
+        queryset.update(is_active=False)
+
+# Catalog admins archive instead of deleting and can restore archived rows
+class ArchivableAdmin(admin.ModelAdmin):
+    actions = ['restore']
+
+    def delete_model(self, request, obj):
+        obj.archive()
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.archive()  # One row each, so the catalog signals fire
+
+    def restore(self, request, queryset):
+        for obj in queryset.filter(archived_at__isnull=False):
+            obj.archived_at = None
+            obj.save(update_fields=['archived_at'])
+    restore.short_description = "Restore selected archived rows"
+
 # Re-register UserAdmin
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 
 @admin.register(MenuItem)
-class MenuItemAdmin(admin.ModelAdmin):
-    list_display = ['name', 'price_small', 'price_large', 'category', 'image_tag', 'description']
-    list_filter = ['category']
+class MenuItemAdmin(ArchivableAdmin):
+    list_display = ['name', 'price_small', 'price_large', 'category', 'stock', 'archived_at', 'image_tag', 'description']
+    list_filter = ['category', 'archived_at']
     search_fields = ['name', 'description']
     readonly_fields = ['image_tag']
 
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index (api.search) rather than LIKE scans; archived rows match too
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=search.search_menu_ids(search_term, include_archived=True, using=queryset.db)), False
+
     def image_tag(self, obj):
         from django.utils.html import format_html
         if obj.image:
@@ -31,8 +67,9 @@ class MenuItemAdmin(admin.ModelAdmin):
     image_tag.short_description = 'Image Preview'
 
 @admin.register(Topping)
-class ToppingAdmin(admin.ModelAdmin):
-    list_display = ['name', 'price']
+class ToppingAdmin(ArchivableAdmin):
+    list_display = ['name', 'price', 'stock', 'archived_at']
+    list_filter = ['archived_at']
     search_fields = ['name']
 
 class OrderItemInline(admin.TabularInline):
@@ -50,12 +87,68 @@ class OrderAdmin(admin.ModelAdmin):
     actions = ['make_completed']
 
     def make_completed(self, request, queryset):
-        queryset.update(status='Completed')
+        completed, out_of_stock = [], []
+        with transaction.atomic():
+            for order in queryset.exclude(status='Completed').select_for_update():
+                # Lines whose reservation lapsed take stock again, as when completed through the API
+                try:
+                    reserve_order(order)
+                except OutOfStock:
+                    out_of_stock.append(order)
+                else:
+                    completed.append(order)
+            queryset.filter(id__in=[order.id for order in completed]).update(status='Completed')
+            for order in completed:
+                record(order, 'status_changed', previous=order.status, status='Completed')
+        if out_of_stock:
+            self.message_user(request, "Not completed, out of stock: " + ', '.join(f"#{order.id}" for order in out_of_stock),
+                              messages.WARNING)
     make_completed.short_description = "Mark selected orders as completed"
 
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    fields = ['item', 'size', 'quantity', 'toppings']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+# Read-only: rows get here through `manage.py archive_orders`
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'store', 'total_price', 'created_at', 'archived_at']
+    list_filter = ['store', 'created_at']
+    search_fields = ['id', 'user__username']
+    readonly_fields = ['user', 'store', 'status', 'total_price', 'created_at', 'updated_at', 'archived_at']
+    inlines = [ArchivedOrderItemInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ['user', 'amount', 'paid', 'timestamp', 'stripe_charge_id']
     list_filter = ['paid', 'timestamp']
     search_fields = ['user__username', 'stripe_charge_id']
     readonly_fields = ['stripe_charge_id', 'amount', 'user', 'timestamp']
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'type', 'received_at', 'processed_at']
+    list_filter = ['type', 'processed_at']
+    search_fields = ['event_id']
+    readonly_fields = ['event_id', 'type', 'payload', 'received_at', 'processed_at']
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ['order_id', 'store', 'kind', 'created_at']
+    list_filter = ['kind', 'store']
+    search_fields = ['order_id']
+    readonly_fields = ['order_id', 'store', 'kind', 'data', 'created_at']
+
+@admin.register(GeocodedAddress)
+class GeocodedAddressAdmin(admin.ModelAdmin):
+    list_display = ['address', 'latitude', 'longitude', 'geocoded_at']
+    search_fields = ['address']
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, DemandWatermark, Order, OrderItem, Transaction
+from .routers import order_databases
+
+ORDER_COLUMNS = ['id', 'user_id', 'store', 'status', 'total_price', 'created_at', 'updated_at']
+LINE_COLUMNS = ['id', 'order_id', 'item_id', 'size', 'quantity']
+
+
+def _archive_batch(alias, cutoff, batch_size):
+    """Move up to batch_size due orders on one database; returns how many were moved."""
+    watermark = DemandWatermark.objects.filter(database=alias).values_list('last_line_id', flat=True).first()
+    with transaction.atomic(using=alias):
+        due = Order.objects.using(alias).select_for_update().filter(status='Completed', created_at__lt=cutoff)
+        if watermark is not None:
+            # Demand forecasting reads lines from the hot table only, so once it is in use, orders
+            # with lines it hasn't counted yet stay put until `manage.py update_demand` has caught up
+            due = due.exclude(Exists(OrderItem.objects.using(alias).filter(order=OuterRef('pk'), id__gt=watermark)))
+        orders = list(due.order_by('id').values(*ORDER_COLUMNS)[:batch_size])
+        if not orders:
+            return 0
+        ids = [order['id'] for order in orders]
+        lines = list(OrderItem.objects.using(alias).filter(order_id__in=ids).values(*LINE_COLUMNS))
+        line_toppings = OrderItem.toppings.through.objects.using(alias).filter(orderitem__order_id__in=ids)
+        toppings = list(line_toppings.values_list('orderitem_id', 'topping_id'))
+
+        now = timezone.now()
+        ArchivedOrder.objects.using(alias).bulk_create([ArchivedOrder(archived_at=now, **order) for order in orders])
+        ArchivedOrderItem.objects.using(alias).bulk_create([ArchivedOrderItem(**line) for line in lines])
+        ArchivedOrderItem.toppings.through.objects.using(alias).bulk_create([
+            ArchivedOrderItem.toppings.through(archivedorderitem_id=line_id, topping_id=topping_id)
+            for line_id, topping_id in toppings
+        ])
+        Transaction.objects.using(alias).filter(order_id__in=ids).update(archived_order_id=F('order_id'), order=None)
+
+        # Raw deletes: these lines are being moved, not removed, so the OrderItem delete
+        # signals (stock release, item_removed events, total recompute) must not fire
+        line_toppings._raw_delete(alias)
+        OrderItem.objects.using(alias).filter(order_id__in=ids)._raw_delete(alias)
+        Order.objects.using(alias).filter(id__in=ids)._raw_delete(alias)
+        return len(ids)
+
+
+def archive_orders(days=None, batch_size=None):
+    """
+    Move Completed orders created more than `days` ago (ORDER_ARCHIVE_AFTER_DAYS),
+    with their lines, line toppings and transaction links, into the archive
+    tables of their own database. Each batch is one transaction, so a run can
+    be interrupted at any point. Once api.forecasting.update_demand has run on
+    a database, orders there with lines it hasn't counted yet are left for a
+    later run. Returns how many
+    orders were archived.
+    """
+    days = settings.ORDER_ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=days)
+    archived = 0
+    for alias in order_databases():
+        while True:
+            moved = _archive_batch(alias, cutoff, batch_size)
+            archived += moved
+            if moved < batch_size:
+                break
+    return archived
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import CatalogVersion, MenuItem, Topping
+from .serializers import MenuItemSerializer, ToppingSerializer
+
+
+def catalog_version():
+    """
+    Current catalog version, read from the database so every process agrees
+    on it. The row starts from the clock, which is above any version a
+    previous database could have left in a cache.
+    """
+    version = CatalogVersion.objects.values_list('version', flat=True).first()
+    if version is None:
+        version = CatalogVersion.objects.get_or_create(pk=1, defaults={'version': time.time_ns() // 1000})[0].version
+    return version
+
+
+def bump_catalog_version():
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        catalog_version()
+
+
+def cached_catalog(version):
+    """The serialized menu and toppings for a catalog version; built once per version."""
+    def build():
+        return {
+            'menu': MenuItemSerializer(MenuItem.objects.order_by('id'), many=True).data,
+            'toppings': ToppingSerializer(Topping.objects.order_by('id'), many=True).data,
+        }
+    return cache.get_or_set(f'catalog:{version}', build, settings.CATALOG_CACHE_SECONDS)
+
+
+def catalog_payload(version, sold_out):
+    """The cached catalog with is_available filled in from the live sold-out ids."""
+    cached = cached_catalog(version)
+    return {
+        key: [{**row, 'is_available': row['id'] not in unavailable} for row in cached[key]]
+        for key, unavailable in ((key, set(sold_out[key])) for key in ('menu', 'toppings'))
+    }
+
+
+def sold_out():
+    # Stock changes on every order without touching the catalog version, so it is read live
+    return {
+        'menu': list(MenuItem.objects.filter(stock=0).values_list('id', flat=True)),
+        'toppings': list(Topping.objects.filter(stock=0).values_list('id', flat=True)),
+    }
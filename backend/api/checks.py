@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.security, deploy=True)
+def check_stripe_webhook_secret(app_configs, **kwargs):
+    # Deployments that don't take webhooks may leave it unset; the endpoint then fails closed with a 503
+    if settings.STRIPE_WEBHOOK_SECRET:
+        return []
+    return [Warning(
+        'STRIPE_WEBHOOK_SECRET is not set, so the Stripe webhook endpoint rejects every event.',
+        hint='Set it to the signing secret of the webhook endpoint if Stripe is configured to call it.',
+        id='api.W001',
+    )]
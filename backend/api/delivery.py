@@ -0,0 +1,175 @@
+import csv
+import json
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import GeocodedAddress
+
+
+def normalize_address(address):
+    return re.sub(r'[\s,.]+', ' ', address).strip().lower()
+
+
+### Geocoding
+
+class LookupTableGeocoder:
+    """
+    Geocodes from a local CSV of `address,latitude,longitude` rows
+    (settings.GEOCODER_LOOKUP_FILE). Any class with a geocode(address)
+    method returning (latitude, longitude) or None can replace it through
+    settings.DELIVERY_GEOCODER.
+    """
+
+    def __init__(self, path=None):
+        self.table = {}
+        path = path or settings.GEOCODER_LOOKUP_FILE
+        if os.path.exists(path):
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    self.table[normalize_address(row['address'])] = (float(row['latitude']), float(row['longitude']))
+
+    def geocode(self, address):
+        return self.table.get(normalize_address(address))
+
+
+_geocoder = None
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = import_string(settings.DELIVERY_GEOCODER)()
+    return _geocoder
+
+
+@receiver(setting_changed)
+def reset_geocoder(setting, **kwargs):
+    global _geocoder
+    if setting in ('DELIVERY_GEOCODER', 'GEOCODER_LOOKUP_FILE'):
+        _geocoder = None
+
+
+def geocode(address):
+    """
+    (latitude, longitude) of an address, or None. Answers are cached in
+    GeocodedAddress; misses only for GEOCODER_MISS_TTL_SECONDS, so addresses
+    added to the geocoder later are found.
+    """
+    key = normalize_address(address)
+    cached = GeocodedAddress.objects.filter(address=key).first()
+    stale_miss = (cached is not None and cached.latitude is None
+                  and cached.geocoded_at < timezone.now() - timedelta(seconds=settings.GEOCODER_MISS_TTL_SECONDS))
+    if cached is None or stale_miss:
+        point = get_geocoder().geocode(key)
+        latitude, longitude = point if point else (None, None)
+        # geocoded_at is auto_now, so a repeated miss waits out a fresh TTL
+        cached, _ = GeocodedAddress.objects.update_or_create(address=key, defaults={'latitude': latitude, 'longitude': longitude})
+    if cached.latitude is None:
+        return None
+    return cached.latitude, cached.longitude
+
+
+### Zones
+
+def _ring_contains(ring, x, y):
+    # Ray casting: count edge crossings of a ray going right from the point
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def _polygon_contains(polygon, x, y):
+    return _ring_contains(polygon[0], x, y) and not any(_ring_contains(hole, x, y) for hole in polygon[1:])
+
+
+def _bbox(ring):
+    return min(p[0] for p in ring), min(p[1] for p in ring), max(p[0] for p in ring), max(p[1] for p in ring)
+
+
+class Zone:
+    def __init__(self, name, fee, eta_minutes, polygons):
+        self.name = name
+        self.fee = fee
+        self.eta_minutes = eta_minutes
+        self.polygons = polygons  # [[outer ring, *holes], ...] of (longitude, latitude) points
+
+    def contains(self, x, y):
+        return any(_polygon_contains(polygon, x, y) for polygon in self.polygons)
+
+
+class ZoneIndex:
+    """
+    Uniform grid over the bounding box of each zone polygon. Each cell lists
+    the (zone, polygon) pairs that may cover it, so a lookup tests a point
+    against one or two polygons instead of all of them, and the far-apart
+    parts of a MultiPolygon don't fill the cells between them. Zones listed
+    first win where zones overlap.
+    """
+
+    def __init__(self, zones, cell_size):
+        self.zones = zones
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        for zone in zones:
+            for polygon in zone.polygons:
+                min_x, min_y, max_x, max_y = _bbox(polygon[0])
+                for i in range(self.cell(min_x), self.cell(max_x) + 1):
+                    for j in range(self.cell(min_y), self.cell(max_y) + 1):
+                        self.cells[(i, j)].append((zone, polygon))
+
+    def cell(self, value):
+        return math.floor(value / self.cell_size)
+
+    def find(self, latitude, longitude):
+        for zone, polygon in self.cells.get((self.cell(longitude), self.cell(latitude)), ()):
+            if _polygon_contains(polygon, longitude, latitude):
+                return zone
+        return None
+
+
+def load_zones(path):
+    """Zones from a GeoJSON FeatureCollection of Polygon/MultiPolygon features with name, fee and eta_minutes properties."""
+    with open(path) as f:
+        features = json.load(f)['features']
+    zones = []
+    for feature in features:
+        geometry, properties = feature['geometry'], feature['properties']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        zones.append(Zone(
+            name=properties['name'],
+            fee=Decimal(str(properties['fee'])),
+            eta_minutes=int(properties['eta_minutes']),
+            polygons=[[[tuple(point) for point in ring] for ring in polygon] for polygon in polygons],
+        ))
+    return zones
+
+
+_index = {'key': None, 'index': None}
+_index_lock = threading.Lock()
+
+
+def get_zone_index():
+    """The index for settings.DELIVERY_ZONES_FILE, rebuilt only when the file changes."""
+    path = settings.DELIVERY_ZONES_FILE
+    key = (path, os.path.getmtime(path) if os.path.exists(path) else None)
+    with _index_lock:
+        if _index['key'] != key:
+            zones = load_zones(path) if key[1] is not None else []
+            _index.update(key=key, index=ZoneIndex(zones, settings.DELIVERY_GRID_CELL_DEGREES))
+        return _index['index']
+
@@ -0,0 +1,84 @@
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OrderEvent
+
+# Events recorded outside any transaction while a batched() block is open
+_pending = ContextVar('order_events_pending', default=None)
+
+# connection -> {savepoint ids: EventBuffer}. Values are weak: on_commit() holds the only
+# strong reference, so a buffer disappears from here as soon as a rollback discards it
+_buffers = weakref.WeakKeyDictionary()
+
+
+def write(events):
+    """Write events to the log in one INSERT, stamping when they were logged."""
+    logged_at = timezone.now()
+    for event in events:
+        event.logged_at = logged_at
+    OrderEvent.objects.bulk_create(events, batch_size=500)
+
+
+class EventBuffer:
+    """Events recorded at one transaction (savepoint) level; written in one INSERT on commit."""
+
+    def __init__(self):
+        self.events = []
+        self.flushed = False
+
+    def __call__(self):
+        self.flushed = True
+        write(self.events)
+
+
+def _current_buffer(connection, using):
+    # A buffer is reused only at the savepoint level it was registered at, so rolling
+    # a savepoint back drops its events (and its on_commit callback) too
+    buffers = _buffers.setdefault(connection, weakref.WeakValueDictionary())
+    level = tuple(connection.savepoint_ids)
+    buffer = buffers.get(level)
+    if buffer is None or buffer.flushed:
+        buffer = buffers[level] = EventBuffer()
+        transaction.on_commit(buffer, using=using)
+    return buffer
+
+
+@contextmanager
+def batched():
+    """
+    Collect the events recorded outside a transaction in this block and write
+    them in one INSERT when it exits. Used around each request by
+    OrderEventBatchMiddleware.
+    """
+    events = []
+    token = _pending.set(events)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+        if events:
+            write(events)
+
+
+def record(order, kind, **data):
+    """
+    Append an event for `order` to the log.
+
+    Inside a transaction the event is buffered and written with every other
+    event of that transaction after it commits; a rollback discards it along
+    with the change it describes. Outside one it is written when the enclosing
+    batched() block exits, or straight away when there is none.
+    """
+    event = OrderEvent(order_id=order.pk, store=order.store, kind=kind, data=data, created_at=timezone.now())
+    using = order._state.db or 'default'
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block:
+        _current_buffer(connection, using).events.append(event)
+    elif _pending.get() is not None:
+        _pending.get().append(event)
+    else:
+        write([event])
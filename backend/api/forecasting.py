@@ -0,0 +1,147 @@
+import time
+from datetime import timedelta
+from itertools import takewhile
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DemandCount, DemandWatermark, OrderItem
+from .routers import order_databases
+
+HOURS_PER_WEEK = 168
+
+# DemandCount.size as a small integer, for packing into bucket keys ('' for toppings)
+SIZES = ['', 'S', 'L']
+SIZE_CODES = {size: code for code, size in enumerate(SIZES)}
+
+
+def _sum_buckets(refs, sizes, hours, quantities):
+    """Total quantity per distinct (ref, size, hour), as four aligned arrays."""
+    keys = (refs << 34) | (sizes << 32) | hours
+    keys, inverse = np.unique(keys, return_inverse=True)
+    totals = np.bincount(inverse, weights=quantities).astype(np.int64)
+    return keys >> 34, (keys >> 32) & 0x3, keys & 0xFFFFFFFF, totals
+
+
+def _accumulate(kind, refs, sizes, hours, quantities):
+    if not len(refs):
+        return
+    refs, sizes, hours, totals = _sum_buckets(refs, sizes, hours, quantities)
+    existing = dict(
+        ((ref, size, hour), quantity)
+        for ref, size, hour, quantity in DemandCount.objects.filter(
+            kind=kind, ref_id__in=set(refs.tolist()), hour__gte=int(hours.min()), hour__lte=int(hours.max())
+        ).values_list('ref_id', 'size', 'hour', 'quantity')
+    )
+    # One upsert for new and existing buckets alike (bulk_update's CASE expressions are far slower)
+    DemandCount.objects.bulk_create(
+        [
+            DemandCount(kind=kind, ref_id=ref, size=SIZES[size], hour=hour,
+                        quantity=existing.get((ref, SIZES[size], hour), 0) + total)
+            for ref, size, hour, total in zip(refs.tolist(), sizes.tolist(), hours.tolist(), totals.tolist())
+        ],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['kind', 'ref_id', 'size', 'hour'],
+        update_fields=['quantity'],
+    )
+
+
+def _count_batch(alias, after, batch_size, settled):
+    """
+    Count up to batch_size lines with id > after into DemandCount, stopping at the
+    first line whose order changed after `settled`; returns (last id counted, lines counted).
+    """
+    rows = list(
+        OrderItem.objects.using(alias).filter(id__gt=after).order_by('id')
+        .values_list('id', 'item_id', 'size', 'quantity', 'order__created_at', 'order__updated_at')[:batch_size]
+    )
+    # Ids are handed out before commit, so a line of a transaction still in flight can show
+    # up later below ids already seen. Adding a line bumps its order's updated_at, so lines
+    # of orders untouched for FORECAST_LAG_SECONDS have every lower id committed before them
+    rows = list(takewhile(lambda row: row[5] <= settled, rows))
+    if not rows:
+        return after, 0
+    ids, items, sizes, quantities, created, _ = zip(*rows)
+    line_ids = np.array(ids, dtype=np.int64)
+    quantities = np.array(quantities, dtype=np.int64)
+    hours = np.array([moment.timestamp() for moment in created], dtype=np.int64) // 3600
+    # Small and large use different dough, so items are counted per size
+    sizes = np.array([SIZE_CODES[size] for size in sizes], dtype=np.int64)
+    _accumulate('item', np.array(items, dtype=np.int64), sizes, hours, quantities)
+
+    topping_rows = list(
+        OrderItem.toppings.through.objects.using(alias)
+        .filter(orderitem_id__gt=after, orderitem_id__lte=int(line_ids[-1]))
+        .values_list('orderitem_id', 'topping_id')
+    )
+    if topping_rows:
+        line_of_topping, toppings = (np.array(column, dtype=np.int64) for column in zip(*topping_rows))
+        # Each topping is used once per unit of its line, in the line's hour
+        position = np.searchsorted(line_ids, line_of_topping)
+        _accumulate('topping', toppings, np.zeros_like(toppings), hours[position], quantities[position])
+    return int(line_ids[-1]), len(rows)
+
+
+def update_demand(batch_size=None):
+    """
+    Count order lines added since the last run into hourly DemandCount
+    buckets, on every order database, and return how many were counted.
+
+    Progress is kept per database as the last counted line id, so each run
+    only reads new lines. Lines whose order changed in the last
+    FORECAST_LAG_SECONDS wait for a later run. Lines are counted as ordered:
+    later edits to a line already counted are not reflected.
+    """
+    batch_size = batch_size or settings.FORECAST_BATCH_SIZE
+    settled = timezone.now() - timedelta(seconds=settings.FORECAST_LAG_SECONDS)
+    counted = 0
+    for alias in order_databases():
+        while True:
+            with transaction.atomic():
+                watermark, _ = DemandWatermark.objects.select_for_update().get_or_create(database=alias)
+                watermark.last_line_id, lines = _count_batch(alias, watermark.last_line_id, batch_size, settled)
+                if not lines:
+                    break
+                counted += lines
+                watermark.save(update_fields=['last_line_id'])
+    return counted
+
+
+def forecast(kind, horizon=24, now=None):
+    """
+    Expected units per hour for the next `horizon` hours, as {(ref_id, size): array};
+    size is 'S' or 'L' for menu items and '' for toppings.
+
+    Each hour is the recent level (mean hourly demand over the last
+    FORECAST_WINDOW_WEEKS weeks) scaled by that hour-of-week's seasonal index
+    (its mean over FORECAST_HISTORY_WEEKS weeks, relative to the weekly mean).
+    """
+    weeks = settings.FORECAST_HISTORY_WEEKS
+    window = min(settings.FORECAST_WINDOW_WEEKS, weeks)
+    now_hour = int((now or time.time()) // 3600)
+    start = now_hour - weeks * HOURS_PER_WEEK
+
+    rows = list(DemandCount.objects.filter(kind=kind, hour__gte=start, hour__lt=now_hour)
+                .values_list('ref_id', 'size', 'hour', 'quantity'))
+    if not rows:
+        return {}
+    refs, sizes, hours, quantities = zip(*rows)
+    refs, hours, quantities = (np.array(column, dtype=np.int64) for column in (refs, hours, quantities))
+    sizes = np.array([SIZE_CODES[size] for size in sizes], dtype=np.int64)
+    # One series per (ref, size)
+    series_keys, series_index = np.unique((refs << 2) | sizes, return_inverse=True)
+    series = np.zeros((len(series_keys), weeks * HOURS_PER_WEEK))
+    series[series_index, hours - start] = quantities
+
+    # Column j of a week always falls on the same hour of week, since start is a whole number of weeks ago
+    profile = series.reshape(len(series_keys), weeks, HOURS_PER_WEEK).mean(axis=1)
+    weekly_mean = profile.mean(axis=1, keepdims=True)
+    seasonal = np.divide(profile, weekly_mean, out=np.zeros_like(profile), where=weekly_mean > 0)
+    level = series[:, -window * HOURS_PER_WEEK:].mean(axis=1, keepdims=True)
+
+    future = (np.arange(now_hour, now_hour + horizon) - start) % HOURS_PER_WEEK
+    predicted = level * seasonal[:, future]
+    return {(key >> 2, SIZES[key & 0x3]): values for key, values in zip(series_keys.tolist(), predicted)}
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+def _params(name):
+    return settings.PASSWORD_HASHER_PARAMS.get(name, {})
+
+
+### Hasher policy
+# Django's hashers with their cost taken from settings.PASSWORD_HASHER_PARAMS. The
+# algorithm names are unchanged, so existing hashes still verify, and a hash made
+# with other parameters is upgraded on the user's next successful login.
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = _params('pbkdf2').get('iterations', hashers.PBKDF2PasswordHasher.iterations)
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    work_factor = _params('scrypt').get('work_factor', hashers.ScryptPasswordHasher.work_factor)
+    block_size = _params('scrypt').get('block_size', hashers.ScryptPasswordHasher.block_size)
+    parallelism = _params('scrypt').get('parallelism', hashers.ScryptPasswordHasher.parallelism)
+    maxmem = _params('scrypt').get('maxmem', hashers.ScryptPasswordHasher.maxmem)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    # Needs the optional argon2-cffi package
+    time_cost = _params('argon2').get('time_cost', hashers.Argon2PasswordHasher.time_cost)
+    memory_cost = _params('argon2').get('memory_cost', hashers.Argon2PasswordHasher.memory_cost)
+    parallelism = _params('argon2').get('parallelism', hashers.Argon2PasswordHasher.parallelism)
+
+
+### Bounded hashing pool
+# hashlib's PBKDF2 and scrypt (and argon2-cffi) release the GIL, so a thread per core
+# hashes in parallel while the event loop keeps serving other requests.
+
+class HashingBusy(Exception):
+    pass
+
+
+_pool = {'executor': None, 'slots': None}
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    with _pool_lock:
+        if _pool['executor'] is None:
+            workers = settings.PASSWORD_HASHING_WORKERS or os.cpu_count() or 1
+            _pool['executor'] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+            # Running plus waiting jobs; beyond this, callers are turned away instead of queueing forever
+            _pool['slots'] = threading.BoundedSemaphore(workers + settings.PASSWORD_HASHING_QUEUE)
+        return _pool['executor'], _pool['slots']
+
+
+async def _run(func, *args):
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        slots.release()
+
+
+async def amake_password(password):
+    return await _run(hashers.make_password, password)
+
+
+async def acheck_user_password(user, password):
+    """
+    Async counterpart of user.check_password(): verifies in the pool and
+    re-hashes with the current policy when the stored hash is outdated.
+    """
+    encoded = user.password
+    if not await _run(hashers.check_password, password, encoded):
+        return False
+    preferred = hashers.get_hasher('default')
+    if hashers.identify_hasher(encoded).algorithm != preferred.algorithm or preferred.must_update(encoded):
+        user.password = await amake_password(password)
+        await user.asave(update_fields=['password'])
+    return True
@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import MenuItem, OrderItem, Topping
+from .routers import order_databases
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def _take(model, instance, quantity):
+    if instance.stock is None:
+        return  # Untracked, so there is nothing to contend on
+    # A single conditional UPDATE: the row lock is held only for this statement and stock can't go negative
+    taken = model.objects.filter(pk=instance.pk, stock__gte=quantity).update(stock=F('stock') - quantity)
+    if not taken:
+        raise OutOfStock(f"{instance.name} is sold out.")
+
+
+def _give_back(model, totals):
+    for pk, quantity in totals.items():
+        if quantity:
+            model.objects.filter(pk=pk, stock__isnull=False).update(stock=F('stock') + quantity)
+
+
+def reserve(item, quantity, toppings=()):
+    """Take `quantity` of the item and of each topping from stock, all or nothing."""
+    with transaction.atomic():
+        _take(MenuItem, item, quantity)
+        for topping in toppings:
+            _take(Topping, topping, quantity)
+
+
+def release(item_id, quantity, topping_ids=()):
+    with transaction.atomic():
+        _give_back(MenuItem, {item_id: quantity})
+        _give_back(Topping, {topping_id: quantity for topping_id in topping_ids})
+
+
+def reserve_order(order):
+    """
+    Take stock again for the lines of `order` whose reservation has expired
+    (release_expired_reservations), all or nothing, before it is paid for or
+    completed. Raises OutOfStock; returns how many lines were re-reserved.
+    """
+    alias = order._state.db or 'default'
+    lines = OrderItem.objects.using(alias)
+    with transaction.atomic(using=alias), transaction.atomic():
+        released = list(lines.select_for_update().filter(order_id=order.pk, reserved=False).values_list('id', 'item_id', 'quantity'))
+        if not released:
+            return 0
+        line_toppings = OrderItem.toppings.through.objects.using(alias).filter(orderitem_id__in=[row[0] for row in released])
+        toppings_of = {}
+        for line_id, topping_id in line_toppings.values_list('orderitem_id', 'topping_id'):
+            toppings_of.setdefault(line_id, []).append(topping_id)
+        # Stock is only kept on the default database, whatever the shard's catalog copy says
+        items = MenuItem.all_objects.using('default').in_bulk({row[1] for row in released})
+        toppings = Topping.all_objects.using('default').in_bulk({pk for pks in toppings_of.values() for pk in pks})
+        for line_id, item_id, quantity in released:
+            reserve(items[item_id], quantity, [toppings[pk] for pk in toppings_of.get(line_id, [])])
+        lines.filter(id__in=[row[0] for row in released]).update(reserved=True)
+    return len(released)
+
+
+def release_expired_reservations(ttl=None):
+    """
+    Return the stock held by Pending orders that have not changed for `ttl`
+    (default STOCK_RESERVATION_TTL_MINUTES), with one UPDATE per affected item
+    and topping on each order database. Returns the number of order lines released.
+    """
+    if ttl is None:
+        ttl = timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES)
+    cutoff = timezone.now() - ttl
+    return sum(_release_expired_on(alias, cutoff) for alias in order_databases())
+
+
+def _release_expired_on(alias, cutoff):
+    lines = OrderItem.objects.using(alias)
+    with transaction.atomic(using=alias), transaction.atomic():
+        line_ids = list(
+            lines.select_for_update()
+            .filter(reserved=True, order__status='Pending', order__updated_at__lt=cutoff)
+            .values_list('id', flat=True)
+        )
+        if not line_ids:
+            return 0
+        item_totals = lines.filter(id__in=line_ids).values('item').annotate(quantity=Sum('quantity'))
+        topping_totals = (
+            OrderItem.toppings.through.objects.using(alias).filter(orderitem_id__in=line_ids)
+            .values('topping').annotate(quantity=Sum('orderitem__quantity'))
+        )
+        # Stock itself is only kept on the default database
+        _give_back(MenuItem, {row['item']: row['quantity'] for row in item_totals})
+        _give_back(Topping, {row['topping']: row['quantity'] for row in topping_totals})
+        lines.filter(id__in=line_ids).update(reserved=False)
+    return len(line_ids)
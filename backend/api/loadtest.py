@@ -0,0 +1,88 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import RequestFactory
+
+### Load driver
+# Sends the same request many times straight into the WSGI or ASGI application, in
+# process, for the bench_async and bench_login commands. Both run_* functions return
+# (elapsed seconds, per-request latencies in seconds, number of non-200 responses).
+
+
+def run_wsgi(app, method, path, requests, threads, body=b'', content_type='application/json', headers=None):
+    """Send `requests` requests from `threads` threads, as a threaded WSGI server would."""
+    factory = RequestFactory()
+
+    def one_request():
+        environ = factory.generic(method, path, body, content_type=content_type, headers=headers).environ
+        result = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            result['status'] = int(status.split()[0])
+
+        start = time.perf_counter()
+        response = app(environ, start_response)
+        b''.join(response)
+        response.close()
+        return time.perf_counter() - start, result['status']
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda _: one_request(), range(requests)))
+    elapsed = time.perf_counter() - start
+    return elapsed, [r[0] for r in results], sum(1 for r in results if r[1] != 200)
+
+
+def run_asgi(app, method, path, requests, concurrency, body=b'', content_type='application/json', headers=None):
+    """Send `requests` requests on one event loop, at most `concurrency` at a time."""
+    raw_headers = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    raw_headers += [(b'host', b'testserver')]
+    if body:
+        raw_headers += [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+
+    async def one_request():
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '', 'headers': raw_headers,
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        received = asyncio.Event()
+        result = {}
+
+        async def receive():
+            if received.is_set():
+                await asyncio.Future()  # Never disconnect; cancelled once the response is sent
+            received.set()
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                result['status'] = message['status']
+
+        start = time.perf_counter()
+        await app(scope, receive, send)
+        return time.perf_counter() - start, result.get('status')
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                return await one_request()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(limited() for _ in range(requests)))
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(run_all())
+    return elapsed, [r[0] for r in results], sum(1 for r in results if r[1] != 200)
+
+
+def latency_percentiles(latencies):
+    """(p50, p99) of `latencies`, in milliseconds."""
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return statistics.median(latencies) * 1000, p99 * 1000
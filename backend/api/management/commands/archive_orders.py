@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.archival import archive_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Move Completed orders older than ORDER_ARCHIVE_AFTER_DAYS, with their lines, toppings and "
+        "transaction links, into the archive tables, in batched transactions. Meant to run on a "
+        "schedule, after update_demand so every archived line has been counted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive orders created more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, help='Orders moved per transaction.')
+
+    def handle(self, *args, **options):
+        archived = archive_orders(options['days'], options['batch_size'])
+        self.stdout.write(f"Archived {archived} order(s)")
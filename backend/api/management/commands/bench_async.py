@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.loadtest import latency_percentiles, run_asgi, run_wsgi
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent-request capacity of the WSGI entry point (backend/wsgi.py) "
+        "against the ASGI entry point (backend/asgi.py) on this machine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100],
+                            help='Concurrent connections to try.')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='WSGI worker threads (the thread pool a sync server would run).')
+        parser.add_argument('--resource', default='menuitems', choices=['menuitems', 'toppings', 'orders'])
+        parser.add_argument('--username', default='benchmark', help='A staff user, created for the run if missing.')
+
+    def handle(self, *args, **options):
+        # Imported here so the entry points are only loaded when benchmarking
+        from backend.asgi import application as asgi_app
+        from backend.wsgi import application as wsgi_app
+
+        # As staff, so the async orders view (which scopes other users to their own
+        # orders) serves the same rows as the DRF one
+        user, created = User.objects.get_or_create(username=options['username'], defaults={'is_staff': True})
+        if not user.is_staff:
+            raise CommandError(f"{user.username} is not a staff user")
+        try:
+            self.run(user, wsgi_app, asgi_app, options)
+        finally:
+            if created:
+                user.delete()
+
+    def run(self, user, wsgi_app, asgi_app, options):
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+        resource = options['resource']
+        requests = options['requests']
+
+        # Connections beyond the thread count queue up, as they would on a threaded WSGI server
+        scenarios = [
+            ('wsgi', f'/api/{resource}/', lambda path, c: run_wsgi(
+                wsgi_app, 'GET', path, requests, min(c, options['threads']), headers=headers)),
+            ('asgi-sync', f'/api/{resource}/', lambda path, c: run_asgi(asgi_app, 'GET', path, requests, c, headers=headers)),
+            ('asgi-async', f'/api/async/{resource}/', lambda path, c: run_asgi(
+                asgi_app, 'GET', path, requests, c, headers=headers)),
+        ]
+
+        self.stdout.write(f"{'scenario':<12}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name, path, run in scenarios:
+            for concurrency in options['concurrency']:
+                elapsed, latencies, errors = run(path, concurrency)
+                p50, p99 = latency_percentiles(latencies)
+                self.stdout.write(
+                    f"{name:<12}{concurrency:>6}{len(latencies) / elapsed:>10.1f}{p50:>10.2f}{p99:>10.2f}{errors:>8}"
+                )
@@ -0,0 +1,53 @@
+import json
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from api.loadtest import latency_percentiles, run_asgi, run_wsgi
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login throughput (logins per second, and per core) of the sync token "
+        "endpoint under WSGI against the async one, whose hashing runs in the bounded pool, under ASGI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Logins per scenario.')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads.')
+        parser.add_argument('--username', default='loginbench')
+        parser.add_argument('--password', default='loginbench-password')
+
+    # Every login comes from one address, so the per-IP login bucket would turn most of them
+    # into 429s; the benchmark measures hashing, not throttling
+    @override_settings(TOKEN_BUCKETS={})
+    def handle(self, *args, **options):
+        from backend.asgi import application as asgi_app
+        from backend.wsgi import application as wsgi_app
+
+        user, _ = User.objects.get_or_create(username=options['username'])
+        user.set_password(options['password'])  # Hashed with the current policy
+        user.is_active = True
+        user.save()
+        body = json.dumps({'username': options['username'], 'password': options['password']}).encode()
+        cores = os.cpu_count() or 1
+
+        requests = options['requests']
+        scenarios = [
+            ('wsgi', '/api/token/', lambda path, c: run_wsgi(
+                wsgi_app, 'POST', path, requests, min(c, options['threads']), body=body)),
+            ('asgi-async', '/api/async/token/', lambda path, c: run_asgi(asgi_app, 'POST', path, requests, c, body=body)),
+        ]
+        self.stdout.write(f"Hasher: {user.password.split('$')[0]}, {cores} core(s)")
+        self.stdout.write(f"{'scenario':<12}{'conc':>6}{'logins/s':>10}{'per core':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name, path, run in scenarios:
+            for concurrency in options['concurrency']:
+                elapsed, latencies, errors = run(path, concurrency)
+                p50, p99 = latency_percentiles(latencies)
+                rate = (len(latencies) - errors) / elapsed
+                self.stdout.write(
+                    f"{name:<12}{concurrency:>6}{rate:>10.1f}{rate / cores:>10.1f}{p50:>10.1f}{p99:>10.1f}{errors:>8}"
+                )
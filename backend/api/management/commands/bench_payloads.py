@@ -0,0 +1,82 @@
+import gzip
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.middleware import get_brotli
+from api.renderers import FastJSONRenderer, orjson
+
+ENDPOINTS = ['/api/menuitems/', '/api/toppings/', '/api/orders/', '/api/orderitems/', '/api/transactions/', '/api/bootstrap/', '/api/order-events/']
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure bytes on the wire (identity, gzip, brotli) and render CPU time (stock "
+        "JSONRenderer against the orjson-backed one) for API endpoints, as a staff user "
+        "on the current database. Run generate_dataset first for realistic sizes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*', default=ENDPOINTS)
+        parser.add_argument('--runs', type=int, default=20, help='Timed renders per endpoint and renderer.')
+        parser.add_argument('--username', default='payloadbench')
+
+    def handle(self, *args, **options):
+        # Everything the run writes, the staff user included, is rolled back at the end
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        user, _ = User.objects.get_or_create(username=options['username'], defaults={'is_staff': True})
+        client = APIClient()
+        client.force_authenticate(user)
+        brotli = get_brotli()
+        if orjson is None:
+            self.stderr.write("orjson is not installed: the fast renderer falls back to the stock one")
+        if brotli is None:
+            self.stderr.write("brotli is not installed: the br column is skipped")
+
+        self.stdout.write(f"{'endpoint':<24}{'bytes':>10}{'gzip':>10}{'br':>10}"
+                          f"{'stock ms':>10}{'fast ms':>10}{'speedup':>9}{'gzip ms':>9}{'br ms':>9}")
+        for path in options['endpoints']:
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"GET {path} returned {response.status_code}")
+            data = response.data
+            stock = self.cpu_ms(lambda: JSONRenderer().render(data), options['runs'])
+            fast = self.cpu_ms(lambda: FastJSONRenderer().render(data), options['runs'])
+            body = FastJSONRenderer().render(data)
+            if body != JSONRenderer().render(data):
+                self.stderr.write(f"{path}: renderers disagree")
+
+            gzipped = gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+            gzip_ms = self.cpu_ms(lambda: gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0),
+                                  options['runs'])
+            if brotli is not None:
+                br_size = len(brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY))
+                br_ms = self.cpu_ms(lambda: brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY),
+                                    options['runs'])
+                br_columns = f"{br_size:>10}", f"{br_ms:>9.2f}"
+            else:
+                br_columns = f"{'-':>10}", f"{'-':>9}"
+            self.stdout.write(
+                f"{path:<24}{len(body):>10}{len(gzipped):>10}{br_columns[0]}"
+                f"{stock:>10.2f}{fast:>10.2f}{stock / fast if fast else 0:>8.1f}x{gzip_ms:>9.2f}{br_columns[1]}"
+            )
+
+    def cpu_ms(self, func, runs):
+        """Median process CPU time of one call, in milliseconds."""
+        func()  # Warm up
+        samples = []
+        for _ in range(runs):
+            start = time.process_time()
+            func()
+            samples.append((time.process_time() - start) * 1000)
+        return statistics.median(samples)
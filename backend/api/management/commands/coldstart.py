@@ -0,0 +1,87 @@
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = """
+import io, json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+from backend.wsgi import application
+imported = time.perf_counter()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': %(path)r, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+    'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+    'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+}
+status = []
+body = application(environ, lambda s, h, e=None: status.append(s))
+b''.join(body)
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (done - start) * 1000,
+    'status': status[0],
+    'lazy_loaded': [name for name in %(lazy)r if name in sys.modules],
+}))
+"""
+
+# Heavy optional modules that should only load when a request needs them
+LAZY_MODULES = ['stripe', 'PIL', 'weasyprint', 'numpy']
+
+
+class Command(BaseCommand):
+    help = (
+        "Start a fresh worker, report per-module import time and time to first "
+        "response, and fail if startup exceeds the cold-start budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/menuitems/', help='URL of the first request.')
+        parser.add_argument('--top', type=int, default=15, help='Number of slowest modules to list.')
+        parser.add_argument('--budget-ms', type=float, default=settings.COLD_START_BUDGET_MS,
+                            help='Fail when time to first response exceeds this.')
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE % {'path': options['path'], 'lazy': LAZY_MODULES}],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+
+        modules, packages = self.parse_importtime(result.stderr)
+        self.stdout.write(f"{'module':<50}{'self ms':>10}{'cumulative ms':>15}")
+        for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[2], reverse=True)[:options['top']]:
+            self.stdout.write(f"{name:<50}{self_us / 1000:>10.1f}{cumulative_us / 1000:>15.1f}")
+        self.stdout.write('')
+        self.stdout.write(f"{'package':<50}{'self ms':>10}")
+        for package, self_us in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:options['top']]:
+            self.stdout.write(f"{package:<50}{self_us / 1000:>10.1f}")
+        self.stdout.write('')
+        self.stdout.write(f"Import time: {report['import_ms']:.1f} ms")
+        self.stdout.write(f"Time to first response: {report['first_response_ms']:.1f} ms ({report['status']})")
+        self.stdout.write(f"Lazy modules loaded at startup: {', '.join(report['lazy_loaded']) or 'none'}")
+
+        if report['first_response_ms'] > options['budget_ms']:
+            raise CommandError(
+                f"Time to first response {report['first_response_ms']:.1f} ms exceeds "
+                f"the {options['budget_ms']:.0f} ms budget"
+            )
+
+    def parse_importtime(self, stderr):
+        modules = []
+        packages = defaultdict(int)
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            modules.append((name, int(self_us), int(cumulative_us)))
+            packages[name.split('.')[0]] += int(self_us)
+        return modules, packages
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Return stock reserved by abandoned Pending orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, help='Idle time after which a reservation expires '
+                                                         '(defaults to STOCK_RESERVATION_TTL_MINUTES).')
+
+    def handle(self, *args, **options):
+        ttl = timedelta(minutes=options['minutes']) if options['minutes'] is not None else None
+        released = release_expired_reservations(ttl)
+        self.stdout.write(f"Released {released} order line(s)")
@@ -0,0 +1,227 @@
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+
+from api.models import MenuItem, Order, OrderItem, Topping, Transaction
+from api.routers import sync_catalog
+from api.search import rebuild_index
+
+DEFAULT_MENU = [
+    ('Margherita', 'Pizza', '9.99', '15.99'), ('Pepperoni', 'Pizza', '10.99', '16.99'),
+    ('Pacific Veggie', 'Pizza', '11.99', '17.99'), ('Spinach and Feta', 'Pizza', '11.99', '17.99'),
+    ('6 Cheese', 'Pizza', '12.49', '18.49'), ('Breadsticks', 'Breads', '5.99', None),
+    ('Parmesan Bread Bites', 'Breads', '6.49', None), ('Stuffed Cheesy Bread', 'Breads', '7.99', None),
+    ('Chocolate Lava Crunch Cake', 'Deserts', '5.49', None), ('Marbled Cookie Brownie', 'Deserts', '6.99', None),
+]
+DEFAULT_TOPPINGS = [
+    ('Extra Cheese', '1.50'), ('Pepperoni', '1.75'), ('Mushrooms', '1.25'), ('Onions', '1.00'),
+    ('Green Peppers', '1.00'), ('Olives', '1.25'), ('Sausage', '1.75'), ('Bacon', '2.00'),
+    ('Pineapple', '1.25'), ('Jalapenos', '1.00'), ('Spinach', '1.25'), ('Feta', '1.50'),
+]
+
+
+def parse_weights(value):
+    """Parse "1:50,2:30,3:20" into ([1, 2, 3], [50.0, 30.0, 20.0])."""
+    try:
+        pairs = [part.split(':') for part in value.split(',')]
+        return [int(k) for k, _ in pairs], [float(w) for _, w in pairs]
+    except ValueError:
+        raise CommandError(f"Invalid distribution {value!r}; expected value:weight pairs like 1:50,2:30")
+
+
+def generate_users(args):
+    """Rows for one chunk of users, generated from a per-chunk seed so the result never depends on --workers."""
+    seed, first_id, count, password, joined = args
+    rng = random.Random(f'{seed}-users-{first_id}')
+    return [
+        (first_id + i, f'user{first_id + i}', f'user{first_id + i}@example.com', password,
+         joined + timedelta(seconds=rng.randrange(365 * 86400)))
+        for i in range(count)
+    ]
+
+
+def generate_orders(args):
+    """Order, line, topping and payment rows for one chunk of orders."""
+    seed, first_id, count, (first_user, user_count), menu, toppings, options = args
+    rng = random.Random(f'{seed}-orders-{first_id}')
+    items_values, items_weights = options['items_per_order']
+    quantity_values, quantity_weights = options['quantity']
+    topping_counts, topping_count_weights = options['toppings_per_item']
+    hours, hour_weights = options['hours']
+    # Zipf-like popularity: the n-th topping is picked proportionally to 1 / n^skew
+    topping_weights = [1 / (rank + 1) ** options['topping_skew'] for rank in range(len(toppings))]
+    start = options['start']
+
+    orders, lines, payments = [], [], []
+    for order_id in range(first_id, first_id + count):
+        created_at = start + timedelta(days=rng.randrange(options['days']), hours=rng.choices(hours, hour_weights)[0],
+                                       minutes=rng.randrange(60), seconds=rng.randrange(60))
+        total = Decimal('0.00')
+        for _ in range(rng.choices(items_values, items_weights)[0]):
+            item_id, category, price_small, price_large = rng.choice(menu)
+            size = 'L' if price_large is not None and (price_small is None or rng.random() < 0.5) else 'S'
+            quantity = rng.choices(quantity_values, quantity_weights)[0]
+            chosen = []
+            if category == 'Pizza' and toppings:
+                picks = min(rng.choices(topping_counts, topping_count_weights)[0], len(toppings))
+                while len(chosen) < picks:
+                    topping = rng.choices(toppings, topping_weights)[0]
+                    if topping not in chosen:
+                        chosen.append(topping)
+            base_price = price_large if size == 'L' else price_small
+            total += (base_price + sum(price for _, price in chosen)) * quantity
+            lines.append((order_id, item_id, size, quantity, [topping_id for topping_id, _ in chosen]))
+        completed = rng.random() < options['completed_ratio']
+        user_id = rng.randrange(first_user, first_user + user_count)
+        orders.append((order_id, user_id, 'Completed' if completed else 'Pending', total, created_at))
+        if completed:
+            payments.append((order_id, total, created_at, rng.random() < options['paid_ratio']))
+    return orders, lines, payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible synthetic dataset of users, orders, order items, toppings "
+        "and transactions for benchmarking at realistic scale."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42, help='Same seed and options give the same data.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per generated chunk and bulk insert.')
+        parser.add_argument('--workers', type=int, default=1, help='Processes generating chunks in parallel.')
+        parser.add_argument('--days', type=int, default=90, help='Spread orders over this many past days.')
+        parser.add_argument('--items-per-order', default='1:45,2:30,3:15,4:7,6:3')
+        parser.add_argument('--quantity', default='1:80,2:15,3:5')
+        parser.add_argument('--toppings-per-item', default='0:35,1:30,2:20,3:10,4:5')
+        parser.add_argument('--topping-skew', type=float, default=1.1, help='Zipf exponent of topping popularity.')
+        parser.add_argument('--peak-hours', default='11:4,12:8,13:5,17:6,18:10,19:10,20:6,21:3',
+                            help='hour:weight pairs; other hours from 10 to 23 get weight 1.')
+        parser.add_argument('--completed-ratio', type=float, default=0.9)
+        parser.add_argument('--paid-ratio', type=float, default=0.97)
+
+    def handle(self, *args, **options):
+        peaks = dict(zip(*parse_weights(options['peak_hours'])))
+        hours = list(range(10, 24))
+        gen_options = {
+            'items_per_order': parse_weights(options['items_per_order']),
+            'quantity': parse_weights(options['quantity']),
+            'toppings_per_item': parse_weights(options['toppings_per_item']),
+            'topping_skew': options['topping_skew'],
+            'hours': (hours, [peaks.get(hour, 1.0) for hour in hours]),
+            'days': options['days'],
+            'start': timezone.make_aware(datetime(2024, 1, 1)),  # Fixed so runs are reproducible
+            'completed_ratio': options['completed_ratio'],
+            'paid_ratio': options['paid_ratio'],
+        }
+        batch = options['batch_size']
+
+        menu, toppings = self.catalog()
+        password = make_password(None)  # Unusable, and hashing millions of real passwords would dominate the run
+
+        first_user = (User.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        first_order = (Order.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        self.next_line_id = (OrderItem.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+        user_chunks = [
+            (options['seed'], start, min(batch, first_user + options['users'] - start), password,
+             gen_options['start'] - timedelta(days=365))
+            for start in range(first_user, first_user + options['users'], batch)
+        ]
+        # Users are passed as a range rather than a list, so each chunk pickles a few bytes of them
+        order_chunks = [
+            (options['seed'], start, min(batch, first_order + options['orders'] - start),
+             (first_user, options['users']), menu, toppings, gen_options)
+            for start in range(first_order, first_order + options['orders'], batch)
+        ]
+
+        # Child processes only generate rows; all writes happen here, so no connection is shared
+        connections.close_all()
+        pool = Pool(options['workers']) if options['workers'] > 1 else None
+        imap = pool.imap if pool else map
+        try:
+            for rows in imap(generate_users, user_chunks):
+                self.insert_users(rows, batch)
+            self.stdout.write(f"Created {options['users']} users")
+            created = 0
+            for orders, lines, payments in imap(generate_orders, order_chunks):
+                self.insert_orders(orders, lines, payments, batch)
+                created += len(orders)
+                self.stdout.write(f"Created {created}/{options['orders']} orders")
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        self.reset_sequences()
+
+    def catalog(self):
+        if not MenuItem.objects.exists():
+            MenuItem.objects.bulk_create([
+                MenuItem(name=name, category=category, price_small=Decimal(small),
+                         price_large=Decimal(large) if large else None)
+                for name, category, small, large in DEFAULT_MENU
+            ])
+            rebuild_index()  # bulk_create() skips the signals that index new items
+        if not Topping.objects.exists():
+            Topping.objects.bulk_create([Topping(name=name, price=Decimal(price)) for name, price in DEFAULT_TOPPINGS])
+        sync_catalog()  # Nor do they copy the catalog to the store shards
+        menu = list(MenuItem.objects.order_by('id').values_list('id', 'category', 'price_small', 'price_large'))
+        toppings = list(Topping.objects.order_by('id').values_list('id', 'price'))
+        return [row for row in menu if row[2] is not None or row[3] is not None], toppings
+
+    def reset_sequences(self):
+        # Rows were inserted with explicit ids, which don't advance Postgres sequences; without
+        # this the next ordinary insert would collide with a generated row (a no-op on SQLite)
+        connection = connections['default']
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Order, OrderItem])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+    @transaction.atomic
+    def insert_users(self, rows, batch):
+        User.objects.bulk_create([
+            User(id=user_id, username=username, email=email, password=password, date_joined=joined)
+            for user_id, username, email, password, joined in rows
+        ], batch_size=batch)
+
+    @transaction.atomic
+    def insert_orders(self, orders, lines, payments, batch):
+        # bulk_create skips the OrderItem signals, so totals come precomputed from the generator
+        Order.objects.bulk_create([
+            Order(id=order_id, user_id=user_id, status=status, total_price=total, created_at=created_at)
+            for order_id, user_id, status, total, created_at in orders
+        ], batch_size=batch)
+
+        order_items, topping_rows = [], []
+        for order_id, item_id, size, quantity, topping_ids in lines:
+            order_items.append(OrderItem(id=self.next_line_id, order_id=order_id, item_id=item_id, size=size, quantity=quantity))
+            topping_rows.extend(
+                OrderItem.toppings.through(orderitem_id=self.next_line_id, topping_id=topping_id)
+                for topping_id in topping_ids
+            )
+            self.next_line_id += 1
+        OrderItem.objects.bulk_create(order_items, batch_size=batch)
+        OrderItem.toppings.through.objects.bulk_create(topping_rows, batch_size=batch)
+
+        user_by_order = {order_id: user_id for order_id, user_id, *_ in orders}
+        Transaction.objects.bulk_create([
+            Transaction(user_id=user_by_order[order_id], order_id=order_id, amount=total, paid=paid,
+                        stripe_charge_id=f'pi_synthetic_{order_id}', description=f'Order #{order_id}')
+            for order_id, total, created_at, paid in payments
+        ], batch_size=batch)
+        # timestamp is auto_now_add, so it is backdated to the order time in one UPDATE
+        Transaction.objects.filter(order_id__gte=orders[0][0], order_id__lte=orders[-1][0]).update(
+            timestamp=Subquery(Order.objects.filter(id=OuterRef('order_id')).values('created_at'))
+        )
@@ -0,0 +1,182 @@
+import json
+import math
+import platform
+import statistics
+import time
+from decimal import Decimal
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.delivery import Zone, ZoneIndex
+from api.models import MenuItem, Order, OrderItem, Topping
+from api.serializers import MenuItemSerializer, OrderItemSerializer, OrderSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Run microbenchmarks of pricing, serializer and authentication hot paths at several "
+        "data sizes, or compare two result files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+        parser.add_argument('--compare', nargs=2, metavar=('BASE', 'CHANGED'),
+                            help='Compare two result files instead of running.')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--runs', type=int, default=10, help='Timed runs per benchmark.')
+        parser.add_argument('--min-time', type=float, default=0.05,
+                            help='Seconds each run should last; the loop count is calibrated to it.')
+        parser.add_argument('--filter', default='', help='Only run benchmarks whose name contains this.')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self.compare(*options['compare'])
+        if options['runs'] < 2:
+            raise CommandError("--runs must be at least 2 to estimate variance")
+
+        results = {
+            'metadata': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'date': timezone.now().isoformat(),
+            },
+            'benchmarks': {},
+        }
+        # Fixture rows live in a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                for name, func in self.benchmarks(options['sizes']):
+                    if options['filter'] not in name:
+                        continue
+                    result = self.measure(func, options['runs'], options['min_time'])
+                    results['benchmarks'][name] = result
+                    self.stdout.write(f"{name:<45}{self.format_time(statistics.mean(result['values']))} "
+                                      f"+- {self.format_time(statistics.stdev(result['values']))}")
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def benchmarks(self, sizes):
+        user = User.objects.create_user(username='microbench')
+        toppings = Topping.objects.bulk_create([Topping(name=f'Topping {i}', price=Decimal('1.25')) for i in range(max(sizes))])
+        menu = MenuItem.objects.bulk_create([
+            MenuItem(name=f'Pizza {i}', category='Pizza', price_small=Decimal('9.99'), price_large=Decimal('15.99'),
+                     description='A pizza with a reasonably long description. ' * 5)
+            for i in range(max(sizes))
+        ])
+
+        for size in sizes:
+            order = Order.objects.create(user=user)
+            line = OrderItem.objects.create(order=order, item=menu[0], size='L', quantity=2)
+            line.toppings.set(toppings[:size])
+            yield f'orderitem_get_total_price[toppings={size}]', line.get_total_price
+
+        for size in sizes:
+            order = Order.objects.create(user=user)
+            for item in menu[:size]:
+                line = OrderItem.objects.create(order=order, item=item, size='S', quantity=1)
+                line.toppings.set(toppings[:3])
+            yield f'order_update_total_price[items={size}]', order.update_total_price
+
+        for size in sizes:
+            items = menu[:size]
+            yield f'menuitem_serializer[items={size}]', lambda items=items: MenuItemSerializer(items, many=True).data
+
+        serialized_orders = Order.objects.bulk_create([Order(user=user) for _ in range(max(sizes))])
+        OrderItem.objects.bulk_create([OrderItem(order=order, item=menu[0], size='S') for order in serialized_orders])
+        for size in sizes:
+            orders = list(Order.objects.filter(id__in=[o.id for o in serialized_orders[:size]]).prefetch_related('items'))
+            yield f'order_serializer[orders={size}]', lambda orders=orders: OrderSerializer(orders, many=True).data
+
+        order = Order.objects.create(user=user)
+        for size in sizes:
+            data = {'order': order.id, 'item': menu[0].id, 'size': 'L', 'quantity': 2,
+                    'toppings': [t.id for t in toppings[:size]]}
+            yield f'orderitem_serializer_validation[toppings={size}]', lambda data=data: OrderItemSerializer(data=data).is_valid()
+
+        for size in sizes:
+            # A size x size grid of square zones, 0.01 degrees each, with lookups spread over all of them
+            zones = [
+                Zone(f'Zone {i}-{j}', Decimal('3.00'), 30, [[[(x, y), (x + 0.01, y), (x + 0.01, y + 0.01), (x, y + 0.01)]]])
+                for i in range(size) for j in range(size)
+                for x, y in [(i * 0.01, j * 0.01)]
+            ]
+            index = ZoneIndex(zones, 0.01)
+            points = [((k * 0.37) % size * 0.01, (k * 0.61) % size * 0.01) for k in range(100)]
+            yield f'delivery_zone_index_lookup[zones={size * size}]', \
+                lambda index=index, points=points: [index.find(lat, lng) for lat, lng in points]
+            yield f'delivery_zone_scan_lookup[zones={size * size}]', \
+                lambda zones=zones, points=points: [next((z for z in zones if z.contains(lng, lat)), None) for lat, lng in points]
+
+        request = RequestFactory().get('/api/menuitems/', HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        authenticator = JWTAuthentication()
+        yield 'jwt_authentication', lambda: authenticator.authenticate(request)
+
+    def measure(self, func, runs, min_time):
+        func()  # Warm up caches and lazy imports
+        loops = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+            loops *= 2 if elapsed == 0 else max(2, math.ceil(min_time / elapsed))
+        values = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            values.append((time.perf_counter() - start) / loops)
+        return {'loops': loops, 'values': values}
+
+    def compare(self, base_path, changed_path):
+        try:
+            with open(base_path) as f:
+                base = json.load(f)['benchmarks']
+            with open(changed_path) as f:
+                changed = json.load(f)['benchmarks']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read results: {e}")
+
+        self.stdout.write(f"{'benchmark':<45}{'base':>12}{'changed':>12}{'change':>10}  verdict")
+        for name in sorted(base.keys() & changed.keys()):
+            a, b = base[name]['values'], changed[name]['values']
+            mean_a, mean_b = statistics.mean(a), statistics.mean(b)
+            # Welch's t statistic; |t| > 2 is treated as a real difference
+            error = math.sqrt(statistics.variance(a) / len(a) + statistics.variance(b) / len(b))
+            significant = error == 0 and mean_a != mean_b or error and abs(mean_b - mean_a) / error > 2
+            if not significant:
+                verdict = 'not significant'
+            elif mean_b < mean_a:
+                verdict = f'{mean_a / mean_b:.2f}x faster'
+            else:
+                verdict = f'{mean_b / mean_a:.2f}x slower'
+            self.stdout.write(f"{name:<45}{self.format_time(mean_a):>12}{self.format_time(mean_b):>12}"
+                              f"{(mean_b - mean_a) / mean_a:>+10.1%}  {verdict}")
+        for name in sorted(base.keys() ^ changed.keys()):
+            self.stdout.write(f"{name:<45}only in {'base' if name in base else 'changed'}")
+
+    def format_time(self, seconds):
+        for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+            if seconds * scale >= 1:
+                return f"{seconds * scale:.2f} {unit}"
+        return f"{seconds * 1e9:.0f} ns"
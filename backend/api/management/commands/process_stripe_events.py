@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.webhooks import process_stripe_events
+
+
+class Command(BaseCommand):
+    help = "Apply received Stripe webhook events to transactions in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the inbox instead of exiting when it is empty.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep between polls when idle.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_stripe_events(options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(f"Processed {total} event(s)")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the menu search index from the menu item rows. Needed after rows are "
+        "loaded with bulk_create() or update(), which bypass the signals that maintain it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        count = rebuild_index(options['database'])
+        self.stdout.write(f"Indexed {count} menu item(s) on '{options['database']}'")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.routers import store_shards, sync_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the menu and toppings from the default database to every store shard. "
+        "Needed after catalog rows are loaded or changed with bulk_create() or update(), "
+        "which bypass the signals that replicate them."
+    )
+
+    def handle(self, *args, **options):
+        shards = store_shards()
+        count = sync_catalog(shards)
+        self.stdout.write(f"Copied {count} catalog row(s) to {len(shards)} store database(s)")
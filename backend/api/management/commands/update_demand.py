@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.forecasting import update_demand
+
+
+class Command(BaseCommand):
+    help = "Count order lines added since the last run into the hourly demand history used by the forecast."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Order lines read per step (defaults to FORECAST_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        counted = update_demand(options['batch_size'])
+        self.stdout.write(f"Counted {counted} order line(s)")
@@ -0,0 +1,224 @@
+import gzip
+import re
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .routers import _pinned, replica_alias
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaPinningMiddleware:
+    """
+    Keeps a client's reads on the primary for REPLICA_PIN_SECONDS after it
+    writes, so it never reads its own write from a stale replica.
+
+    The pin travels with the client as a short-lived signed cookie, so every
+    worker process honours it without shared state. It is set after a
+    successful unsafe request.
+    """
+    cookie_name = 'replica_pin'
+    salt = 'api.middleware.ReplicaPinningMiddleware'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def is_pinned(self, request):
+        return request.get_signed_cookie(
+            self.cookie_name, default=None, salt=self.salt, max_age=settings.REPLICA_PIN_SECONDS
+        ) is not None
+
+    def __call__(self, request):
+        if replica_alias() is None:
+            return self.get_response(request)
+
+        writing = request.method not in SAFE_METHODS
+        pinned_token = _pinned.set(writing or self.is_pinned(request))
+        try:
+            response = self.get_response(request)
+            if writing and response.status_code < 400:
+                response.set_signed_cookie(
+                    self.cookie_name, '1', salt=self.salt, max_age=settings.REPLICA_PIN_SECONDS,
+                    httponly=True, samesite='Lax',
+                )
+            return response
+        finally:
+            _pinned.reset(pinned_token)
+
+
+class LoadSheddingMiddleware:
+    """
+    Turns requests away with a 503 before doing any work when this process
+    already has LOAD_SHED_MAX_IN_FLIGHT requests in progress, or when a request
+    queued upstream for longer than LOAD_SHED_MAX_QUEUE_MS (measured from the
+    proxy's X-Request-Start header). Either limit is off when None.
+
+    Shedding early keeps latency bounded for the requests that are accepted,
+    rather than letting every request time out once the workers fall behind.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def queued_ms(self, request):
+        # nginx sends "t=<seconds>.<millis>"; other proxies send milliseconds or microseconds
+        try:
+            start = float(request.META.get('HTTP_X_REQUEST_START', '').removeprefix('t='))
+        except ValueError:
+            return None
+        while start > 1e11:
+            start /= 1000
+        return (time.time() - start) * 1000
+
+    def admit(self, request):
+        """Count the request in, or return the 503 that sheds it."""
+        max_queue_ms = settings.LOAD_SHED_MAX_QUEUE_MS
+        queued = self.queued_ms(request) if max_queue_ms is not None else None
+        with self.lock:
+            max_in_flight = settings.LOAD_SHED_MAX_IN_FLIGHT
+            if (queued is None or queued <= max_queue_ms) and (max_in_flight is None or self.in_flight < max_in_flight):
+                self.in_flight += 1
+                return None
+        response = JsonResponse({'detail': 'Server is busy, please retry.'}, status=503)
+        response['Retry-After'] = str(settings.LOAD_SHED_RETRY_AFTER)
+        return response
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        shed = self.admit(request)
+        if shed is not None:
+            return shed
+        try:
+            return self.get_response(request)
+        finally:
+            self.release()
+
+    async def __acall__(self, request):
+        shed = self.admit(request)
+        if shed is not None:
+            return shed
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release()
+
+
+def get_brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header, skipping codings refused with q=0."""
+    accepted = {}
+    for part in header.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted[coding] = q
+    return accepted
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses of at least COMPRESSION_MIN_SIZE bytes with brotli
+    (when the brotli package is installed) or gzip, whichever the client
+    prefers in Accept-Encoding (brotli on a tie). Only JSON is compressed,
+    and never when the result would be larger: HTML pages (the admin, the
+    browsable API) carry CSRF tokens, which compression would expose to
+    BREACH-style attacks.
+
+    Like Django's GZipMiddleware, it must come before anything that reads
+    or changes the response body. Streaming responses are left alone.
+    """
+    compressible = re.compile(r'^(application/json\b|[^;]*\+json\b)')
+
+    def compress(self, coding, content):
+        if coding == 'br':
+            return get_brotli().compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        return gzip.compress(content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+    def choose(self, request):
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        wildcard = accepted.get('*', 0)
+        candidates = [('gzip', accepted.get('gzip', wildcard))]
+        if get_brotli() is not None:
+            candidates.insert(0, ('br', accepted.get('br', wildcard)))
+        coding, q = max(candidates, key=lambda candidate: candidate[1])
+        return coding if q > 0 else None
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not self.compressible.match(response.get('Content-Type', '')):
+            return response
+        # The body varies with Accept-Encoding from here on, even when it goes out uncompressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        coding = self.choose(request)
+        if coding is None:
+            return response
+        compressed = self.compress(coding, response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        if response.has_header('ETag'):
+            # The representation changed, so a strong ETag no longer applies
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        return response
+
+
+class OrderEventBatchMiddleware:
+    """
+    Writes the order events a request records outside a transaction in one
+    INSERT when the request is done, instead of one INSERT per event.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        from .events import batched
+        with batched():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        from .events import batched
+        with batched():
+            return await self.get_response(request)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_alter_menuitem_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='api.order'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_order_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.PositiveBigIntegerField(db_index=True)),
+                ('store', models.CharField(max_length=30)),
+                ('kind', models.CharField(choices=[('created', 'Created'), ('item_added', 'Item added'), ('item_removed', 'Item removed'), ('status_changed', 'Status changed'), ('paid', 'Paid')], max_length=20)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_geocodedaddress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('database', models.CharField(max_length=100, unique=True)),
+                ('last_line_id', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DemandCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('item', 'Menu item'), ('topping', 'Topping')], max_length=10)),
+                ('ref_id', models.PositiveBigIntegerField()),
+                ('hour', models.IntegerField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'hour'], name='api_demandc_kind_a061bf_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'ref_id', 'hour'), name='unique_demand_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:05
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE api_menuitem_search USING fts5("
+            "name, category, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO api_menuitem_search (rowid, name, category, description) "
+            "SELECT id, name, category, COALESCE(description, '') FROM api_menuitem"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE api_menuitem_search (menuitem_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+        )
+        schema_editor.execute("CREATE INDEX api_menuitem_search_document ON api_menuitem_search USING GIN (document)")
+        schema_editor.execute(
+            "INSERT INTO api_menuitem_search (menuitem_id, document) SELECT id, "
+            "setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', category), 'B') "
+            "|| setweight(to_tsvector('simple', COALESCE(description, '')), 'C') FROM api_menuitem"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS api_menuitem_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_archive_catalog_protect_history'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
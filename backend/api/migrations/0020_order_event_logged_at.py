@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_archive_completed_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderevent',
+            name='logged_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
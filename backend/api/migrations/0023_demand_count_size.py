@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='demandcount',
+            name='unique_demand_bucket',
+        ),
+        migrations.AddField(
+            model_name='demandcount',
+            name='size',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddConstraint(
+            model_name='demandcount',
+            constraint=models.UniqueConstraint(fields=('kind', 'ref_id', 'size', 'hour'), name='unique_demand_bucket'),
+        ),
+    ]
@@ -1,8 +1,10 @@
+import copy
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
+from django.conf import settings
 
 ### User profile
 class UserProfile(models.Model):
@@ -13,8 +15,40 @@ class UserProfile(models.Model):
     def __str__(self) -> str:
         return self.user.username
 
+### Delivery
+# Persistent geocoding cache keyed by normalised address text; a miss is cached too (null coordinates)
+class GeocodedAddress(models.Model):
+    address = models.TextField(unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geocoded_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.address
+
 ### Menu and Orders
-class MenuItem(models.Model):
+class ActiveManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(archived_at__isnull=True)
+
+# Catalog rows are archived instead of deleted, so order history keeps the items it references.
+# `objects` hides archived rows; related lookups from old order lines go through `all_objects`.
+class ArchivableModel(models.Model):
+    archived_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = ActiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        abstract = True
+        default_manager_name = 'all_objects'
+
+    def archive(self):
+        # A single-row UPDATE; save() so the catalog signals (shard copies, cache version) still fire
+        self.archived_at = timezone.now()
+        self.save(update_fields=['archived_at'])
+
+class MenuItem(ArchivableModel):
     CATEGORY_CHOICES = [
         ('Pizza', 'Pizza'),
         ('Breads', 'Breads'),
@@ -26,24 +60,69 @@ class MenuItem(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='menu_items/', blank=True, null=True)  # Path relative to MEDIA_ROOT
+    stock = models.PositiveIntegerField(null=True, blank=True)  # None means stock is not tracked
+
+    @property
+    def is_available(self):
+        return self.stock is None or self.stock > 0
 
     def __str__(self):
         return f"{self.name} ({self.category})"
 
-class Topping(models.Model):
+class Topping(ArchivableModel):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=5, decimal_places=2)
+    stock = models.PositiveIntegerField(null=True, blank=True)  # None means stock is not tracked
+
+    @property
+    def is_available(self):
+        return self.stock is None or self.stock > 0
 
     def __str__(self):
         return self.name
 
+# Version of the menu and toppings as a whole, bumped on every catalog edit; one row.
+# Kept in the database so every worker agrees on it (see api.catalog)
+class CatalogVersion(models.Model):
+    version = models.PositiveBigIntegerField()
+
+def default_store():
+    return settings.DEFAULT_STORE
+
+class ShardedQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        # Without an explicit .using(), let the router place the row by its store
+        if self._db is None:
+            obj = self.model(**kwargs)
+            obj.save(force_insert=True)
+            return obj
+        return super().create(**kwargs)
+
+    def locate(self, pk):
+        # Ids are only unique within one database, so this looks on every store database
+        from .routers import order_databases
+        return [obj for alias in order_databases() for obj in self.using(alias).filter(pk=pk)]
+
+class OrderQuerySet(ShardedQuerySet):
+    def for_store(self, store):
+        # Hits only the database holding that store's orders
+        from .routers import shard_for_store
+        return self.using(shard_for_store(store)).filter(store=store)
+
 class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Orders may live on a per-store database while users stay on the default one, so no DB-level constraint
+    user = models.ForeignKey(User, on_delete=models.PROTECT, db_constraint=False)  # Users are deactivated, not deleted
+    store = models.CharField(max_length=30, default=default_store, db_index=True)
     status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Completed', 'Completed')], default='Pending')
     total_price = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]  # Finds completed orders due for archiving
+
     def update_total_price(self):
         total = 0
         items = self.items.all()
@@ -54,15 +133,22 @@ class Order(models.Model):
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
-    item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    item = models.ForeignKey(MenuItem, on_delete=models.PROTECT)  # Menu items are archived, not deleted
     size = models.CharField(max_length=10, choices=[('S', 'Small'), ('L', 'Large')])
     quantity = models.IntegerField(default=1)
     toppings = models.ManyToManyField(Topping, blank=True)
+    reserved = models.BooleanField(default=False)  # Holds stock for the item and toppings until released
+
+    objects = ShardedQuerySet.as_manager()
 
     def get_total_price(self):
-        base_price = self.item.price_large if self.size == 'L' else self.item.price_small
-        topping_price = sum(topping.price for topping in self.toppings.all())
-        return (base_price + topping_price) * self.quantity
+        return self.price_line(self.item, self.size, self.quantity, self.toppings.all())
+
+    @staticmethod
+    def price_line(item, size, quantity, toppings):
+        base_price = item.price_large if size == 'L' else item.price_small
+        topping_price = sum(topping.price for topping in toppings)
+        return (base_price + topping_price) * quantity
 
 # Signals to update order total whenever order items are modified or deleted
 @receiver(post_save, sender=OrderItem)
@@ -73,15 +159,180 @@ def update_order_total_on_change(sender, instance, **kwargs):
 def update_order_total_on_delete(sender, instance, **kwargs):
     instance.order.update_total_price()
 
+# Signals feeding the order event log
+@receiver(post_save, sender=Order)
+def record_order_created(sender, instance, created, **kwargs):
+    if created:
+        from .events import record
+        record(instance, 'created', user=instance.user_id, status=instance.status)
+
+@receiver(post_save, sender=OrderItem)
+def record_item_added(sender, instance, created, **kwargs):
+    if created:
+        from .events import record
+        record(instance.order, 'item_added', line=instance.id, item=instance.item_id,
+               size=instance.size, quantity=instance.quantity)
+
+@receiver(post_delete, sender=OrderItem)
+def record_item_removed(sender, instance, **kwargs):
+    from .events import record
+    record(instance.order, 'item_removed', line=instance.id, item=instance.item_id, quantity=instance.quantity)
+
+# The catalog is written to the default database and copied to every store shard,
+# so order lines on a shard can reference and join against it locally
+@receiver(post_save, sender=MenuItem)
+@receiver(post_save, sender=Topping)
+def replicate_catalog_on_save(sender, instance, using, **kwargs):
+    if using != 'default':
+        return
+    from .routers import store_shards
+    for alias in store_shards():
+        copy.copy(instance).save(using=alias)
+
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_delete, sender=Topping)
+def replicate_catalog_on_delete(sender, instance, using, **kwargs):
+    if using != 'default':
+        return
+    from .routers import store_shards
+    for alias in store_shards():
+        sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+# A catalog edit invalidates the cached catalog once it is committed (stock updates don't fire these)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_save, sender=Topping)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_delete, sender=Topping)
+def bump_catalog_version_on_change(sender, using, **kwargs):
+    if using == 'default':
+        from django.db import transaction
+        from .catalog import bump_catalog_version
+        transaction.on_commit(bump_catalog_version, using=using)
+
+# Keep the menu search index (api.search) in step with the rows, in the same transaction
+@receiver(post_save, sender=MenuItem)
+def index_menu_item_on_save(sender, instance, using, update_fields, **kwargs):
+    if update_fields is None or {'name', 'category', 'description'} & set(update_fields):
+        from .search import index_menu_item
+        index_menu_item(instance, using)
+
+@receiver(post_delete, sender=MenuItem)
+def unindex_menu_item_on_delete(sender, instance, using, **kwargs):
+    from .search import unindex_menu_item
+    unindex_menu_item(instance.pk, using)
+
+# Give reserved stock back when a line of an unfinished order is removed (toppings are still readable here)
+@receiver(pre_delete, sender=OrderItem)
+def release_stock_on_delete(sender, instance, **kwargs):
+    if instance.reserved and instance.order.status == 'Pending':
+        from .inventory import release
+        release(instance.item_id, instance.quantity, [topping.id for topping in instance.toppings.all()])
+
+### Forecasting
+# Units ordered per item (and size) or topping per hour, accumulated incrementally by api.forecasting
+class DemandCount(models.Model):
+    KIND_CHOICES = [('item', 'Menu item'), ('topping', 'Topping')]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    ref_id = models.PositiveBigIntegerField()  # MenuItem or Topping id
+    size = models.CharField(max_length=10, blank=True, default='')  # 'S' or 'L' for items; '' for toppings
+    hour = models.IntegerField()  # Hours since the Unix epoch, UTC
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kind', 'ref_id', 'size', 'hour'], name='unique_demand_bucket')]
+        indexes = [models.Index(fields=['kind', 'hour'])]
+
+# Last order line counted into DemandCount, per order database
+class DemandWatermark(models.Model):
+    database = models.CharField(max_length=100, unique=True)
+    last_line_id = models.PositiveBigIntegerField(default=0)
+
+### Order archive
+# Completed orders past ORDER_ARCHIVE_AFTER_DAYS are moved here by `manage.py
+# archive_orders` (see api.archival), keeping their ids, so the hot tables only hold
+# recent activity. They live on the same database as the orders they came from.
+
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # The original order's id
+    user = models.ForeignKey(User, on_delete=models.PROTECT, db_constraint=False, related_name='+')
+    store = models.CharField(max_length=30, db_index=True)
+    status = models.CharField(max_length=20)
+    total_price = models.DecimalField(max_digits=8, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'created_at'])]
+
+    def __str__(self):
+        return f"Archived order {self.id} ({self.store})"
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # The original line's id
+    order = models.ForeignKey(ArchivedOrder, related_name='items', on_delete=models.CASCADE)
+    item = models.ForeignKey(MenuItem, on_delete=models.PROTECT, related_name='+')
+    size = models.CharField(max_length=10, choices=[('S', 'Small'), ('L', 'Large')])
+    quantity = models.IntegerField(default=1)
+    toppings = models.ManyToManyField(Topping, blank=True, related_name='+')
+
+    objects = ShardedQuerySet.as_manager()
+
 ### Payments
 class Transaction(models.Model):
-    user = models.ForeignKey(User, related_name='transactions', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='transactions', on_delete=models.PROTECT, db_constraint=False)
+    order = models.ForeignKey(Order, related_name='transactions', null=True, blank=True, on_delete=models.SET_NULL)
+    # Set instead of `order` once the order has been archived
+    archived_order = models.ForeignKey(ArchivedOrder, related_name='transactions', null=True, blank=True, on_delete=models.SET_NULL)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     timestamp = models.DateTimeField(auto_now_add=True)
     stripe_charge_id = models.CharField(max_length=50)
     description = models.CharField(max_length=255, blank=True)
     paid = models.BooleanField(default=False)  # Default to False, set to True when payment is confirmed
+    # The webhook event `paid` was last set from, so older events arriving later are ignored
+    stripe_event_created = models.PositiveBigIntegerField(null=True, blank=True)
+    stripe_event_id = models.CharField(max_length=255, blank=True)
+
+    objects = ShardedQuerySet.as_manager()
 
     def __str__(self):
         paid_status = "Paid" if self.paid else "Not Paid"
         return f"{self.user.username} - ${self.amount} {paid_status} on {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+# Inbox of verified Stripe webhook events: appended on receipt, applied later in batches
+class StripeEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)  # Stripe redelivers events, so this deduplicates them
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.type} ({self.event_id})"
+
+# Append-only log of order lifecycle changes, written in batches by api.events.record
+class OrderEvent(models.Model):
+    KIND_CHOICES = [
+        ('created', 'Created'),
+        ('item_added', 'Item added'),
+        ('item_removed', 'Item removed'),
+        ('status_changed', 'Status changed'),
+        ('paid', 'Paid'),
+    ]
+    # A plain id rather than a foreign key: the log lives on the default database for
+    # orders on every store database, and outlives the orders it describes
+    order_id = models.PositiveBigIntegerField(db_index=True)
+    store = models.CharField(max_length=30)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    # When the event was written; readers hold back the newest ones (ORDER_EVENT_LOG_LAG_SECONDS)
+    logged_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']  # The id is the consumers' cursor
+
+    def __str__(self):
+        return f"Order {self.order_id} {self.kind} at {self.created_at.strftime('%Y-%m-%d %H:%M')}"
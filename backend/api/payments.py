@@ -0,0 +1,18 @@
+from django.conf import settings
+
+_stripe = None
+
+
+def get_stripe():
+    """
+    Import and configure the Stripe SDK on first use.
+
+    Keeping it out of module scope means workers that never take a payment
+    never pay for importing it.
+    """
+    global _stripe
+    if _stripe is None:
+        import stripe
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        _stripe = stripe
+    return _stripe
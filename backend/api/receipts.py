@@ -0,0 +1,111 @@
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.template.loader import render_to_string
+
+from .models import OrderItem, Transaction
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {'html': 'text/html; charset=utf-8', 'pdf': 'application/pdf'}
+
+_executor = None
+_executor_lock = threading.Lock()
+# Receipts submitted but not yet written, so a burst of requests queues each one once
+_queued = set()
+
+
+def receipt_path(transaction_id, using='default', ext='html'):
+    # Transaction ids are only unique per database, so each database has its own directory
+    return os.path.join(settings.RECEIPTS_DIR, using, f'{transaction_id}.{ext}')
+
+
+def pdf_available():
+    try:
+        import weasyprint  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def render_receipt(payment):
+    lines = []
+    if payment.order_id:
+        items = OrderItem.objects.using(payment._state.db).filter(order_id=payment.order_id) \
+            .select_related('item').prefetch_related('toppings').order_by('id')
+        for line in items:
+            toppings = list(line.toppings.all())
+            lines.append({
+                'item': line.item,
+                'size': line.get_size_display(),
+                'quantity': line.quantity,
+                'toppings': [topping.name for topping in toppings],
+                'price': OrderItem.price_line(line.item, line.size, line.quantity, toppings),
+            })
+    return render_to_string('api/receipt.html', {'payment': payment, 'order': payment.order, 'lines': lines})
+
+
+def _write(path, content):
+    # Written to a temporary file and renamed, so a download never sees half a receipt
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def generate_receipt(transaction_id, using='default'):
+    """Render the receipt of a transaction to the receipt cache, unless it is already there."""
+    html_path = receipt_path(transaction_id, using)
+    pdf_path = receipt_path(transaction_id, using, 'pdf')
+    # A receipt rendered before PDF support was installed still gets its PDF
+    pdf_wanted = pdf_available() and not os.path.exists(pdf_path)
+    if os.path.exists(html_path) and not pdf_wanted:
+        return html_path
+    payment = Transaction.objects.using(using).select_related('order').get(id=transaction_id)
+    html = render_receipt(payment)
+    if pdf_wanted:
+        from weasyprint import HTML
+        _write(pdf_path, HTML(string=html).write_pdf())
+    # The HTML file is written last: its presence means the receipt is complete
+    _write(html_path, html.encode('utf-8'))
+    return html_path
+
+
+def _work(transaction_id, using):
+    try:
+        generate_receipt(transaction_id, using)
+    except Exception:
+        logger.exception("Could not generate receipt for transaction %s on %s", transaction_id, using)
+    finally:
+        _queued.discard((transaction_id, using))
+        # Worker threads open their own connections; don't leak them
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.RECEIPT_WORKERS, thread_name_prefix='receipts')
+        return _executor
+
+
+def submit_receipt(transaction_id, using='default'):
+    key = (transaction_id, using)
+    with _executor_lock:
+        if key in _queued:
+            return
+        _queued.add(key)
+    get_executor().submit(_work, transaction_id, using)
+
+
+def queue_receipt(payment):
+    """Generate the receipt in the background once the transaction that created `payment` commits."""
+    using = payment._state.db
+    transaction.on_commit(lambda: submit_receipt(payment.id, using), using=using)
@@ -0,0 +1,89 @@
+import codecs
+import io
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # The stock DRF classes are used instead
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+class _StockOnly(TypeError):
+    pass
+
+
+def _same_repr(value):
+    # orjson and json.dumps write a float the same way only in this range; json
+    # switches to exponent notation ('1e+16', '1e-07') and rejects non-finite values
+    return value == 0 or 1e-4 <= abs(value) < 1e16
+
+
+def _needs_stock(data):
+    """Whether `data` holds a float only the stock renderer writes correctly."""
+    stack = [data]
+    pop, push = stack.pop, stack.extend
+    while stack:
+        value = pop()
+        kind = type(value)
+        if kind is dict:
+            push(value.values())
+        elif kind is list or kind is tuple:
+            push(value)
+        elif kind is float and not _same_repr(value):
+            return True
+    return False
+
+
+def _default(obj):
+    # Everything orjson leaves to us goes through DRF's encoder, so it comes out the same
+    value = _encoder.default(obj)
+    if isinstance(value, float) and not _same_repr(value):
+        raise _StockOnly  # e.g. Decimal('1e20'), which the encoder turns into a float
+    return value
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson, producing the same bytes as DRF's compact
+    output. Datetimes, Decimals and dataclasses are passed through to DRF's
+    encoder. Pretty-printing (`; indent=`, the browsable API), anything orjson
+    rejects (such as integers over 64 bits) and floats orjson writes differently
+    (NaN and infinities, which the stock renderer refuses, and values json
+    writes in exponent notation) all use the stock renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+                or _needs_stock(data)):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_default, option=(
+                orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+            ))
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer, so the output stays a strict JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser backed by orjson for UTF-8 bodies; errors are reported by the stock parser."""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None or codecs.lookup((parser_context or {}).get('encoding') or 'utf-8').name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # Rejected input (or integers over 64 bits): let json decide, with its error message
+            return super().parse(io.BytesIO(body), media_type, parser_context)
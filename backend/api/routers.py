@@ -0,0 +1,221 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Max
+
+# Models whose reads may be served by the replica: the catalog and order history
+REPLICA_READ_MODELS = {'menuitem', 'topping', 'order', 'orderitem', 'archivedorder', 'archivedorderitem'}
+
+# True while the current request (or context) must read from the primary
+_pinned = ContextVar('replica_pinned', default=False)
+
+# Cached result of the last replica lag check
+_replica_health = {'checked_at': None, 'healthy': True}
+
+
+def pin_to_primary():
+    """Send every read in the current context to the primary (read-your-writes)."""
+    return _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def replica_alias():
+    alias = getattr(settings, 'REPLICA_DATABASE_ALIAS', None)
+    if alias and alias in connections.settings:
+        return alias
+    return None
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind the primary, measured from the newest
+    Order.updated_at on each side (every order write bumps it).
+    """
+    from .models import Order
+
+    primary = Order.objects.using('default').aggregate(latest=Max('updated_at'))['latest']
+    replica = Order.objects.using(alias).aggregate(latest=Max('updated_at'))['latest']
+    if primary is None:
+        return 0
+    if replica is None:
+        return float('inf')
+    return max(0, (primary - replica).total_seconds())
+
+
+def replica_is_healthy(alias):
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5)
+    now = time.monotonic()
+    checked_at = _replica_health['checked_at']
+    if checked_at is not None and now - checked_at < interval:
+        return _replica_health['healthy']
+
+    try:
+        healthy = replica_lag(alias) <= getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 10)
+    except DatabaseError:
+        # An unreachable replica is treated like a lagging one
+        healthy = False
+    _replica_health.update(checked_at=now, healthy=healthy)
+    return healthy
+
+
+class ReplicaRouter:
+    """
+    Routes catalog and order-history reads to the replica named by
+    settings.REPLICA_DATABASE_ALIAS. Everything else, every write, and every
+    read pinned after a write goes to the primary ("default").
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = replica_alias()
+        if alias is None:
+            return None
+        if model._meta.app_label != 'api' or model._meta.model_name not in REPLICA_READ_MODELS:
+            return 'default'
+        if is_pinned() or not replica_is_healthy(alias):
+            return 'default'
+        return alias
+
+    def db_for_write(self, model, **hints):
+        if replica_alias() is None:
+            return None
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        alias = replica_alias()
+        if alias is None:
+            return None
+        # The replica is a copy of the primary, so objects from either may be related
+        if {obj1._state.db, obj2._state.db} <= {'default', alias}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+# Order data that lives on the store's database (including the toppings through-table)
+SHARDED_MODELS = {'order', 'orderitem', 'orderitem_toppings', 'transaction',
+                  'archivedorder', 'archivedorderitem', 'archivedorderitem_toppings'}
+
+
+def shard_for_store(store):
+    return settings.STORE_DATABASES.get(store, 'default')
+
+
+def order_databases():
+    """Every database alias holding order data, default first."""
+    return ['default'] + sorted(set(settings.STORE_DATABASES.values()) - {'default'})
+
+
+def store_shards():
+    """Store databases other than default; these hold a copy of the catalog."""
+    return order_databases()[1:]
+
+
+def sync_catalog(aliases=None, batch_size=1000):
+    """
+    Copy every menu item and topping from the default database to the store
+    shards, overwriting their copies. The save/delete signals keep shards in
+    step row by row; bulk_create() and update() bypass them, so run this
+    (`manage.py sync_catalog`) after loading or editing the catalog that way.
+    Returns how many rows were copied.
+    """
+    from .models import MenuItem, Topping
+
+    copied = 0
+    for alias in aliases or store_shards():
+        for model in (MenuItem, Topping):
+            fields = [field.attname for field in model._meta.concrete_fields if not field.primary_key]
+            source = model._base_manager.using('default').order_by('pk')
+            last_pk = 0
+            while True:
+                rows = list(source.filter(pk__gt=last_pk)[:batch_size])
+                if not rows:
+                    break
+                model._base_manager.using(alias).bulk_create(
+                    rows, update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=fields,
+                )
+                copied += len(rows)
+                last_pk = rows[-1].pk
+    return copied
+
+
+def fan_out(func, aliases=None):
+    """Call func(alias) for every order database in parallel and return the results in alias order."""
+    aliases = aliases or order_databases()
+    if len(aliases) == 1:
+        return [func(aliases[0])]
+
+    def run(alias):
+        try:
+            return func(alias)
+        finally:
+            # Worker threads open their own connections; don't leak them
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        return list(pool.map(run, aliases))
+
+
+class StoreShardRouter:
+    """
+    Places each store's orders, order lines and transactions on the database
+    mapped to it in settings.STORE_DATABASES. Users and the catalog are read
+    from and written to the default database; shards hold a catalog copy so
+    order lines can join against toppings locally.
+
+    Queries without an instance to route by fall through to the next router,
+    so per-store reads should use Order.objects.for_store().
+    """
+
+    def shard_from_hints(self, hints):
+        from .models import ArchivedOrder, Order
+
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if isinstance(instance, (Order, ArchivedOrder)) and instance.store:
+            return shard_for_store(instance.store)
+        if instance._meta.app_label == 'api' and instance._meta.model_name in SHARDED_MODELS:
+            # A line or transaction follows its order, even before it has been saved anywhere
+            order_field = instance._meta.get_field('order') if hasattr(instance, 'order_id') else None
+            if order_field and order_field.is_cached(instance) and instance.order is not None:
+                return shard_for_store(instance.order.store)
+            return instance._state.db
+        return None
+
+    def route(self, model, hints):
+        if len(order_databases()) == 1:
+            return None
+        shard = self.shard_from_hints(hints)
+        if model._meta.app_label == 'api' and model._meta.model_name in SHARDED_MODELS:
+            return shard
+        if shard and shard != 'default':
+            # Topping reads from an order line join the through-table, which is on the shard
+            if model._meta.app_label == 'api' and model._meta.model_name == 'topping':
+                return shard
+            return 'default'
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if len(order_databases()) == 1:
+            return None
+        # Orders reference users and catalog rows on other databases by id
+        if {obj1._meta.app_label, obj2._meta.app_label} <= {'api', 'auth'}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
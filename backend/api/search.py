@@ -0,0 +1,109 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import MenuItem
+
+TABLE = 'api_menuitem_search'
+# Postgres text search configuration: no stemming, like FTS5's unicode61 tokenizer
+TS_CONFIG = 'simple'
+
+# Weights of name, category and description in the ranking
+NAME_WEIGHT, CATEGORY_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 5.0, 1.0
+
+
+### Menu search index
+# A full-text index over MenuItem name, category and description: an FTS5 table on
+# SQLite, a tsvector table with a GIN index on Postgres (created by migration 0018).
+# It is kept in sync by the MenuItem signals; bulk_create() and update() bypass them,
+# so run `manage.py rebuild_search_index` after loading rows that way.
+
+def _vendor(using):
+    return connections[using].vendor
+
+
+def index_menu_item(item, using='default'):
+    with connections[using].cursor() as cursor:
+        if _vendor(using) == 'sqlite':
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [item.pk])
+            cursor.execute(f'INSERT INTO {TABLE} (rowid, name, category, description) VALUES (%s, %s, %s, %s)',
+                           [item.pk, item.name, item.category, item.description or ''])
+        elif _vendor(using) == 'postgresql':
+            cursor.execute(
+                f"INSERT INTO {TABLE} (menuitem_id, document) VALUES (%s, "
+                f"setweight(to_tsvector('{TS_CONFIG}', %s), 'A') || setweight(to_tsvector('{TS_CONFIG}', %s), 'B') "
+                f"|| setweight(to_tsvector('{TS_CONFIG}', %s), 'C')) "
+                f"ON CONFLICT (menuitem_id) DO UPDATE SET document = EXCLUDED.document",
+                [item.pk, item.name, item.category, item.description or ''],
+            )
+
+
+def unindex_menu_item(pk, using='default'):
+    if _vendor(using) in ('sqlite', 'postgresql'):
+        column = 'rowid' if _vendor(using) == 'sqlite' else 'menuitem_id'
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE} WHERE {column} = %s', [pk])
+
+
+def rebuild_index(using='default'):
+    """Re-index every menu item, archived ones included; returns how many were indexed."""
+    vendor = _vendor(using)
+    with connections[using].cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {TABLE}')
+            cursor.execute(f"INSERT INTO {TABLE} (rowid, name, category, description) "
+                           f"SELECT id, name, category, COALESCE(description, '') FROM api_menuitem")
+        elif vendor == 'postgresql':
+            cursor.execute(f'TRUNCATE {TABLE}')
+            cursor.execute(
+                f"INSERT INTO {TABLE} (menuitem_id, document) SELECT id, "
+                f"setweight(to_tsvector('{TS_CONFIG}', name), 'A') || setweight(to_tsvector('{TS_CONFIG}', category), 'B') "
+                f"|| setweight(to_tsvector('{TS_CONFIG}', COALESCE(description, '')), 'C') FROM api_menuitem"
+            )
+        else:
+            return 0
+    return MenuItem.all_objects.using(using).count()
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search_menu_ids(query, limit=None, include_archived=False, using='default'):
+    """
+    Ids of the menu items matching every word of `query` as a prefix
+    ("marg basil" finds "Margherita ... basil"), best match first.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    vendor = _vendor(using)
+    archived = '' if include_archived else ' AND item.archived_at IS NULL'
+    if vendor == 'sqlite':
+        sql = (f'SELECT item.id FROM {TABLE} JOIN api_menuitem item ON item.id = {TABLE}.rowid '
+               f'WHERE {TABLE} MATCH %s{archived} '
+               f'ORDER BY bm25({TABLE}, {NAME_WEIGHT}, {CATEGORY_WEIGHT}, {DESCRIPTION_WEIGHT}), item.id')
+        params = [' '.join(f'"{term}"*' for term in terms)]
+    elif vendor == 'postgresql':
+        # ts_rank weights are listed D, C, B, A
+        weights = f'{{0, {DESCRIPTION_WEIGHT / NAME_WEIGHT}, {CATEGORY_WEIGHT / NAME_WEIGHT}, 1}}'
+        sql = (f"SELECT item.id FROM {TABLE} JOIN api_menuitem item ON item.id = {TABLE}.menuitem_id, "
+               f"to_tsquery('{TS_CONFIG}', %s) AS query WHERE document @@ query{archived} "
+               f"ORDER BY ts_rank('{weights}'::float4[], document, query) DESC, item.id")
+        params = [' & '.join(f'{term}:*' for term in terms)]
+    else:
+        # No full-text index on this backend: an unranked scan
+        queryset = MenuItem.all_objects.using(using)
+        if not include_archived:
+            queryset = queryset.filter(archived_at__isnull=True)
+        for term in terms:
+            queryset = queryset.filter(Q(name__icontains=term) | Q(category__icontains=term) | Q(description__icontains=term))
+        return list(queryset.order_by('name', 'id').values_list('id', flat=True)[:limit])
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
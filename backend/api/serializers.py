@@ -1,6 +1,13 @@
 from rest_framework import serializers
-from .models import MenuItem, Order, OrderItem, Topping, Transaction
+from rest_framework.exceptions import APIException
+from .models import MenuItem, Order, OrderItem, Topping, Transaction, OrderEvent, ArchivedOrder, ArchivedOrderItem
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Prefetch
+from .inventory import OutOfStock, release, reserve, reserve_order
+from .events import record
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -14,21 +21,107 @@ class UserSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(**validated_data) # ** is used to make dict key: value as , seperated value
         return user
 
+
+### Sparse fieldsets
+# ?fields=a,b trims a serializer's output to those fields, and ?expand=rel replaces a
+# related id (or list of ids) with the object, using the serializer in Meta.expandable;
+# rel.sub expands inside the expanded object too. sparse_queryset() then narrows the
+# view's queryset to the columns those fields read and prefetches what they traverse.
+
+def parse_field_list(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        expandable = getattr(self.Meta, 'expandable', {})
+        nested = {}
+        for path in expand:
+            name, _, rest = path.partition('.')
+            nested.setdefault(name, [])
+            if rest:
+                nested[name].append(rest)
+        unknown = sorted(nested.keys() - expandable.keys())
+        if unknown:
+            raise serializers.ValidationError({'expand': f"Cannot expand: {', '.join(unknown)}."})
+        for name, sub_expand in nested.items():
+            many = isinstance(self.fields[name], serializers.ManyRelatedField)
+            self.fields[name] = expandable[name](many=many, read_only=True, expand=sub_expand)
+
+        if fields is not None:
+            unknown = sorted(set(fields) - self.fields.keys())
+            if unknown:
+                raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}."})
+            for name in self.fields.keys() - set(fields):
+                self.fields.pop(name)
+
+
+def sparse_queryset(queryset, serializer, extra_columns=()):
+    """
+    `queryset` with only() the columns `serializer` reads, and a Prefetch,
+    narrowed the same way, for each relation it lists or expands. Left as it
+    is when a field's source can't be traced to a column.
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    opts = queryset.model._meta
+    columns = {opts.pk.attname, *extra_columns}
+    prefetches = []
+    method_columns = getattr(serializer.Meta, 'method_columns', {})
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        # Method fields and model properties name the columns they read in Meta.method_columns
+        if name in method_columns:
+            columns.update(method_columns[name])
+            continue
+        if field.source == '*':
+            return queryset
+        try:
+            model_field = opts.get_field(field.source.split('.')[0])
+        except FieldDoesNotExist:
+            return queryset
+        expanded = isinstance(field, serializers.BaseSerializer)
+        if model_field.concrete and not model_field.many_to_many:
+            columns.add(model_field.attname)
+            if model_field.is_relation and expanded:
+                related = model_field.related_model._default_manager.all()
+                prefetches.append(Prefetch(model_field.name, queryset=sparse_queryset(related, field)))
+        elif model_field.many_to_many or model_field.one_to_many:
+            # The related rows need their foreign key back to us to be matched up
+            link = [model_field.field.attname] if model_field.one_to_many else []
+            related = model_field.related_model._default_manager.all()
+            related = sparse_queryset(related, field, link) if expanded else related.only(*link)
+            prefetches.append(Prefetch(field.source, queryset=related))
+        else:
+            return queryset
+    return queryset.only(*columns).prefetch_related(*prefetches)
+
+
+# Who placed an order or paid, as shown when it is expanded (no email)
+class UserSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
 # Serializer for a topping
-class ToppingSerializer(serializers.ModelSerializer):
+class ToppingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Topping
-        fields = ['id', 'name', 'price']
+        fields = ['id', 'name', 'price', 'is_available']
+        method_columns = {'is_available': ['stock']}
 
 # Serializer for an item on the menu
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     price_small = serializers.SerializerMethodField()
     price_large = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()  # Add this field to return the image URL
 
     class Meta:
         model = MenuItem
-        fields = ['id', 'name', 'price_small', 'price_large', 'category', 'image_url', 'description']  # Replace 'image' with 'image_url'
+        fields = ['id', 'name', 'price_small', 'price_large', 'category', 'image_url', 'description', 'is_available']  # Replace 'image' with 'image_url'
+        method_columns = {'price_small': ['price_small'], 'price_large': ['price_large'], 'image_url': ['image'],
+                          'is_available': ['stock']}
 
     def get_price_small(self, obj):
         if obj.price_small is not None:  # Ensure price is not None
@@ -48,45 +141,169 @@ class MenuItemSerializer(serializers.ModelSerializer):
 
 
 # Serializer for item of an order
-class OrderItemSerializer(serializers.ModelSerializer):
+class StoreOrderField(serializers.PrimaryKeyRelatedField):
+    """
+    An order id, looked up on the database of the request's store (`?store=` or
+    "store" in the body), or on every store database when none is given.
+    """
+    default_error_messages = {
+        'ambiguous': 'Order {pk_value} exists at several stores; pass ?store= to pick one.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not str(data).isdigit():
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        request = self.context.get('request')
+        store = request and (request.query_params.get('store') or request.data.get('store'))
+        queryset = self.get_queryset()
+        orders = list(queryset.for_store(store).filter(pk=data)) if store else queryset.locate(data)
+        if not orders:
+            self.fail('does_not_exist', pk_value=data)
+        if len(orders) > 1:
+            self.fail('ambiguous', pk_value=data)
+        return orders[0]
+
+class StockConflict(APIException):
+    """Stock held for an order ran out while its reservation had lapsed."""
+    status_code = 409
+    default_detail = 'Part of this order is no longer in stock.'
+    default_code = 'out_of_stock'
+
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    order = StoreOrderField(queryset=Order.objects.all())
+    # Declared so archived items and toppings can't be ordered (the default manager includes them)
+    item = serializers.PrimaryKeyRelatedField(queryset=MenuItem.objects.all())
+    toppings = serializers.PrimaryKeyRelatedField(queryset=Topping.objects.all(), many=True, required=False)
+
     class Meta:
         model = OrderItem
         fields = ['order', 'item', 'size', 'quantity', 'toppings']
+        expandable = {'item': MenuItemSerializer, 'toppings': ToppingSerializer}
 
     def create(self, validated_data):
-        order_item = OrderItem.objects.create(**validated_data)
+        toppings = validated_data.pop('toppings', [])
+        with transaction.atomic():
+            self.reserve(validated_data['item'], validated_data.get('quantity', 1), toppings)
+            order_item = OrderItem.objects.create(reserved=True, **validated_data)
+            if toppings:
+                order_item.toppings.set(toppings)
+                order_item.order.update_total_price()
         return order_item
 
     def update(self, instance, validated_data):
-        instance.quantity = validated_data.get('quantity', instance.quantity)
-        instance.size = validated_data.get('size', instance.size)
-        instance.save()
-        instance.toppings.set(validated_data.get('toppings', instance.toppings.all()))
+        toppings = validated_data.get('toppings', list(instance.toppings.all()))
+        quantity = validated_data.get('quantity', instance.quantity)
+        with transaction.atomic():
+            if instance.reserved:
+                # Swap the old reservation for the new one; a shortfall rolls both back
+                release(instance.item_id, instance.quantity, [topping.id for topping in instance.toppings.all()])
+                self.reserve(instance.item, quantity, toppings)
+            else:
+                # The reservation expired, so the line takes its stock afresh
+                try:
+                    reserve(instance.item, quantity, toppings)
+                except OutOfStock as e:
+                    raise StockConflict(str(e))
+                instance.reserved = True
+            instance.quantity = quantity
+            instance.size = validated_data.get('size', instance.size)
+            instance.save()
+            instance.toppings.set(toppings)
         return instance
 
-class OrderSerializer(serializers.ModelSerializer):
+    def reserve(self, item, quantity, toppings):
+        try:
+            reserve(item, quantity, toppings)
+        except OutOfStock as e:
+            raise serializers.ValidationError({'stock': str(e)})
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['user', 'status', 'total_price', 'items']
+        fields = ['user', 'store', 'status', 'total_price', 'items']
+        expandable = {'user': UserSummarySerializer, 'items': OrderItemSerializer}
         extra_kwargs = {
             'user': {'read_only': True},
             'items': {'read_only': True}
         }
 
+    def validate_store(self, value):
+        if value not in settings.STORE_DATABASES:
+            raise serializers.ValidationError(f"Unknown store '{value}'.")
+        return value
+
     def create(self, validated_data):
         # Assign the currently authenticated user automatically
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
     def update(self, instance, validated_data):
+        previous_status = instance.status
         instance.status = validated_data.get('status', instance.status)
         instance.total_price = validated_data.get('total_price', instance.total_price)
-        instance.save()
+        # The event is buffered and written in the same commit as the change
+        with transaction.atomic(using=instance._state.db):
+            if instance.status == 'Completed' and previous_status != 'Completed':
+                try:
+                    reserve_order(instance)
+                except OutOfStock as e:
+                    raise StockConflict(str(e))
+            instance.save()
+            if instance.status != previous_status:
+                record(instance, 'status_changed', previous=previous_status, status=instance.status)
         return instance
 
+# Archived orders read back in the same shape as live ones
+class ArchivedOrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ['order', 'item', 'size', 'quantity', 'toppings']
+        read_only_fields = fields
+        expandable = {'item': MenuItemSerializer, 'toppings': ToppingSerializer}
+
+class ArchivedOrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedOrder
+        fields = ['user', 'store', 'status', 'total_price', 'items']
+        read_only_fields = fields
+        expandable = {'user': UserSummarySerializer, 'items': ArchivedOrderItemSerializer}
+
 # Serializer for payments
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
-        fields = ['id', 'user', 'amount', 'timestamp', 'stripe_charge_id', 'description', 'paid']
-        read_only_fields = ['user', 'timestamp', 'stripe_charge_id', 'paid']
+        fields = ['id', 'user', 'order', 'archived_order', 'amount', 'timestamp', 'stripe_charge_id', 'description', 'paid']
+        expandable = {'user': UserSummarySerializer, 'order': OrderSerializer, 'archived_order': ArchivedOrderSerializer}
+        read_only_fields = ['user', 'order', 'archived_order', 'timestamp', 'stripe_charge_id', 'paid']
+
+class OrderEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderEvent
+        fields = ['id', 'order_id', 'store', 'kind', 'data', 'created_at']
+
+# Serializers for one-call checkout
+class CheckoutItemSerializer(serializers.Serializer):
+    item = serializers.PrimaryKeyRelatedField(queryset=MenuItem.objects.all())
+    size = serializers.ChoiceField(choices=['S', 'L'])
+    quantity = serializers.IntegerField(min_value=1, default=1)
+    toppings = serializers.PrimaryKeyRelatedField(queryset=Topping.objects.all(), many=True, required=False)
+
+    def validate(self, data):
+        price = data['item'].price_large if data['size'] == 'L' else data['item'].price_small
+        if price is None:
+            raise serializers.ValidationError(f"{data['item'].name} is not available in this size.")
+        toppings = data.get('toppings', [])
+        if len({topping.pk for topping in toppings}) != len(toppings):
+            raise serializers.ValidationError({'toppings': 'Each topping can only be added once per item.'})
+        return data
+
+class CheckoutSerializer(serializers.Serializer):
+    items = CheckoutItemSerializer(many=True, allow_empty=False)
+    token = serializers.CharField(write_only=True)  # Payment method obtained with Stripe.js
+    return_url = serializers.CharField(write_only=True, required=False)
+    description = serializers.CharField(required=False, allow_blank=True)
+    store = serializers.ChoiceField(choices=[], required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['store'].choices = list(settings.STORE_DATABASES)
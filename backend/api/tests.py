@@ -1,11 +1,54 @@
 from django.urls import reverse
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
 from rest_framework import status
 from django.contrib.auth.models import User
-from .models import MenuItem, Order, OrderItem, Topping
+from .models import MenuItem, Order, OrderItem, Topping, Transaction, StripeEvent, OrderEvent, UserProfile, GeocodedAddress, DemandCount, \
+    DemandWatermark, ArchivedOrder, ArchivedOrderItem, CatalogVersion
+from .admin import OrderAdmin, UserAdmin
+from .webhooks import process_stripe_events
+from .events import batched
+from .inventory import OutOfStock, release_expired_reservations, reserve
 from decimal import Decimal
 from unittest.mock import patch
+from datetime import timedelta
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib import admin
+from django.contrib.auth import hashers as auth_hashers
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import ProtectedError
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.http import JsonResponse
+from . import catalog, delivery, forecasting, receipts, routers, search
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from io import StringIO
 import stripe
+from rest_framework_simplejwt.tokens import RefreshToken
+from .middleware import LoadSheddingMiddleware
+from .throttling import TokenBucketStore
+from .renderers import FastJSONParser, FastJSONRenderer
+
+# Bucket state outlives each test's rollback (and reused user ids would share buckets),
+# so throttles are off except where ThrottlingTests turns them on
+_no_throttles = override_settings(TOKEN_BUCKETS={})
+
+def setUpModule():
+    _no_throttles.enable()
+
+def tearDownModule():
+    _no_throttles.disable()
 
 ##### TESTS FOR MENU ITEMS #####
 
@@ -338,3 +381,1476 @@ class StripeChargeTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('error', response.data)
         self.assertIn('declined', response.data['error'])
+
+
+class AsyncReadEndpointTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='asyncuser', password='asyncpassword')
+        self.other = User.objects.create_user(username='otheruser', password='otherpassword')
+        self.pizza = MenuItem.objects.create(name='Async Pizza', price_small=Decimal('8.00'), price_large=Decimal('12.00'), category='Pizza')
+        self.topping = Topping.objects.create(name='Olives', price=Decimal('1.50'))
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, item=self.pizza, size='S', quantity=1)
+        Order.objects.create(user=self.other)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def get(self, url):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_menu_items_match_sync_endpoint(self):
+        response = self.get(reverse('async-menuitem-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(response.json(), self.client.get(reverse('menuitem-list')).json())
+
+    def test_topping_detail(self):
+        response = self.get(reverse('async-topping-detail', args=[self.topping.id]))
+        self.assertEqual(response.json(), {'id': self.topping.id, 'name': 'Olives', 'price': '1.50', 'is_available': True})
+
+    def test_orders_are_scoped_to_user(self):
+        response = self.get(reverse('async-order-list'))
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(response.json()[0]['total_price'], '8.00')
+        self.assertEqual(len(response.json()[0]['items']), 1)
+
+    def test_missing_object_returns_404(self):
+        response = self.get(reverse('async-menuitem-detail', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unauthenticated_access(self):
+        response = self.client.get(reverse('async-menuitem-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(reverse('async-menuitem-list'), HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TemporaryDatabasesMixin:
+    """
+    Adds migrated, file-backed database aliases for the duration of a test class.
+    They are declared here rather than in `databases` because the aliases don't
+    exist when the test runner collects databases.
+    """
+    extra_databases = ()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database_dir = tempfile.TemporaryDirectory()
+        for alias in cls.extra_databases:
+            connections.settings[alias] = connections.configure_settings({
+                'default': connections.settings['default'],
+                alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.database_dir.name, f'{alias}.sqlite3')},
+            })[alias]
+            call_command('migrate', database=alias, verbosity=0)
+        cls.databases = {'default', *cls.extra_databases}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.extra_databases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.database_dir.cleanup()
+
+
+class ReplicaRoutingTests(TemporaryDatabasesMixin, TransactionTestCase):
+    """
+    Runs against two database files: the test primary and a temporary replica
+    that is only written to explicitly, so every read shows where it was routed.
+    """
+    extra_databases = ['replica']
+
+    def setUp(self):
+        routers._replica_health['checked_at'] = None
+        self.user = User.objects.create_user(username='replicauser', password='replicapassword')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        MenuItem.objects.using('replica').create(name='Replica Pizza', price_small=Decimal('9.00'), category='Pizza')
+
+    def menu_names(self):
+        response = self.client.get(reverse('menuitem-list'), HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        return [item['name'] for item in response.json()]
+
+    def test_catalog_reads_go_to_replica(self):
+        self.assertEqual(self.menu_names(), ['Replica Pizza'])
+
+    def test_reads_pinned_to_primary_after_write(self):
+        # Written through the API, the order (and this client's next reads) stay on the primary
+        response = self.client.post(reverse('order-list'), {'status': 'Pending'}, format='json',
+                                    HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.menu_names(), [])
+        # Once the order has replicated, other clients keep reading from the replica
+        User.objects.using('replica').create(id=self.user.id, username=self.user.username)
+        Order.objects.using('replica').create(id=Order.objects.using('default').get().id, user_id=self.user.id)
+        other = User.objects.create_user(username='otherclient', password='otherpassword')
+        self.token = str(RefreshToken.for_user(other).access_token)
+        self.client.cookies.clear()
+        self.assertEqual(self.menu_names(), ['Replica Pizza'])
+
+    def test_pin_expires_and_rejects_forged_cookies(self):
+        self.client.post(reverse('order-list'), {'status': 'Pending'}, format='json', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(self.menu_names(), [])
+        User.objects.using('replica').create(id=self.user.id, username=self.user.username)
+        Order.objects.using('replica').create(id=Order.objects.using('default').get().id, user_id=self.user.id)
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            time.sleep(1)
+            self.assertEqual(self.menu_names(), ['Replica Pizza'])
+        self.client.cookies['replica_pin'] = '1'
+        self.assertEqual(self.menu_names(), ['Replica Pizza'])
+
+    def test_failed_writes_and_writes_outside_requests_do_not_pin(self):
+        response = self.client.post(reverse('order-list'), {'store': 'nowhere'}, format='json', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.menu_names(), ['Replica Pizza'])
+        MenuItem.objects.create(name='Primary Pizza', price_small=Decimal('9.00'), category='Pizza')
+        self.assertFalse(routers.is_pinned())
+
+    @override_settings(REPLICA_MAX_LAG_SECONDS=60, REPLICA_LAG_CHECK_INTERVAL=0)
+    def test_lagging_replica_falls_back_to_primary(self):
+        User.objects.using('replica').create(id=self.user.id, username=self.user.username)
+        Order.objects.using('replica').create(user_id=self.user.id, updated_at=timezone.now())
+        self.assertEqual(self.menu_names(), ['Replica Pizza'])
+        # The primary has seen a much newer order write than the replica
+        Order.objects.create(user=self.user)
+        Order.objects.using('replica').update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.menu_names(), [])
+
+    def test_writes_go_to_primary(self):
+        router = routers.ReplicaRouter()
+        self.assertEqual(router.db_for_write(MenuItem), 'default')
+        self.assertEqual(router.db_for_read(User), 'default')
+
+
+class ColdStartTests(SimpleTestCase):
+    def test_startup_without_heavy_modules(self):
+        # Timing depends on the machine, so the budget itself is only checked by the next test
+        out = StringIO()
+        call_command('coldstart', '--budget-ms', 'inf', stdout=out)
+        self.assertIn('Time to first response', out.getvalue())
+        self.assertIn('Lazy modules loaded at startup: none', out.getvalue())
+
+    @unittest.skipUnless(os.environ.get('COLDSTART_BUDGET_TEST'), 'set COLDSTART_BUDGET_TEST=1 to check the budget')
+    def test_startup_within_budget(self):
+        call_command('coldstart', stdout=StringIO())
+
+    def test_budget_regression_fails(self):
+        with self.assertRaisesMessage(CommandError, 'budget'):
+            call_command('coldstart', '--budget-ms', '0', stdout=StringIO())
+
+
+class CheckoutTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='checkoutuser', password='checkoutpassword')
+        self.client.force_authenticate(user=self.user)
+        self.pizza = MenuItem.objects.create(name='Pepperoni', price_small=Decimal('9.00'), price_large=Decimal('14.00'), category='Pizza')
+        self.bread = MenuItem.objects.create(name='Breadsticks', price_small=Decimal('4.00'), category='Breads')
+        self.cheese = Topping.objects.create(name='Extra Cheese', price=Decimal('1.50'))
+        self.url = reverse('checkout')
+        self.payload = {
+            'token': 'pm_card_visa',
+            'items': [
+                {'item': self.pizza.id, 'size': 'L', 'quantity': 2, 'toppings': [self.cheese.id]},
+                {'item': self.bread.id, 'size': 'S'},
+            ],
+        }
+
+    @patch('stripe.PaymentIntent.create')
+    def test_checkout_prices_server_side_and_links_transaction(self, mock_create):
+        mock_create.return_value = MockCharge(id='pi_123', paid=True, amount=3500, currency='usd',
+                                              description='', status='succeeded')
+        response = self.client.post(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(id=response.data['order_id'])
+        self.assertEqual(order.total_price, Decimal('35.00'))  # (14 + 1.50) * 2 + 4
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(mock_create.call_args.kwargs['amount'], 3500)
+        transaction = order.transactions.get()
+        self.assertTrue(transaction.paid)
+        self.assertEqual(transaction.amount, Decimal('35.00'))
+        self.assertEqual(response.data['transaction']['order'], order.id)
+
+    @patch('stripe.PaymentIntent.create')
+    def test_payment_failure_rolls_back(self, mock_create):
+        mock_create.side_effect = stripe.error.CardError("Your card was declined.", "payment_method", "card_declined")
+        response = self.client.post(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('declined', response.data['error'])
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(OrderItem.objects.count(), 0)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    @patch('stripe.PaymentIntent.create')
+    def test_unpaid_intent_rolls_back(self, mock_create):
+        mock_create.return_value = MockCharge(id='pi_456', paid=False, amount=3500, currency='usd',
+                                              description='', status='requires_payment_method')
+        response = self.client.post(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_duplicate_toppings_are_rejected(self):
+        self.payload['items'][0]['toppings'] = [self.cheese.id, self.cheese.id]
+        response = self.client.post(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_unavailable_size_is_rejected(self):
+        self.payload['items'] = [{'item': self.bread.id, 'size': 'L'}]
+        response = self.client.post(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 0)
+
+
+def signed_stripe_event(event, secret, timestamp=None):
+    """Build a webhook body and Stripe-Signature header the way Stripe signs them."""
+    payload = json.dumps(event)
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return payload, f't={timestamp},v1={signature}'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='webhookuser', password='webhookpassword')
+        self.pending = Transaction.objects.create(user=self.user, amount=Decimal('20.00'), stripe_charge_id='pi_3ds')
+        self.paid = Transaction.objects.create(user=self.user, amount=Decimal('15.00'), stripe_charge_id='pi_refund', paid=True)
+        self.url = reverse('stripe-webhook')
+
+    def deliver(self, event_id, event_type, obj, created=1700000000, secret='whsec_test'):
+        event = {'id': event_id, 'type': event_type, 'created': created, 'data': {'object': obj}}
+        payload, signature = signed_stripe_event(event, secret)
+        return self.client.post(self.url, payload, content_type='application/json', HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_events_are_stored_then_applied_in_batch(self):
+        self.assertEqual(self.deliver('evt_1', 'payment_intent.succeeded', {'object': 'payment_intent', 'id': 'pi_3ds'}).status_code, 200)
+        self.deliver('evt_2', 'charge.refunded', {'object': 'charge', 'payment_intent': 'pi_refund', 'refunded': True})
+        # Nothing is applied until the worker runs
+        self.pending.refresh_from_db()
+        self.assertFalse(self.pending.paid)
+
+        self.assertEqual(process_stripe_events(), 2)
+        self.pending.refresh_from_db()
+        self.paid.refresh_from_db()
+        self.assertTrue(self.pending.paid)
+        self.assertFalse(self.paid.paid)
+        self.assertEqual(process_stripe_events(), 0)
+
+    def test_duplicate_deliveries_are_deduplicated(self):
+        for _ in range(3):
+            self.deliver('evt_dup', 'payment_intent.succeeded', {'object': 'payment_intent', 'id': 'pi_3ds'})
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_latest_event_wins_within_a_batch(self):
+        self.deliver('evt_late', 'payment_intent.payment_failed', {'object': 'payment_intent', 'id': 'pi_3ds'}, created=1700000100)
+        self.deliver('evt_early', 'payment_intent.succeeded', {'object': 'payment_intent', 'id': 'pi_3ds'}, created=1700000000)
+        process_stripe_events()
+        self.pending.refresh_from_db()
+        self.assertFalse(self.pending.paid)
+
+    def test_older_event_in_a_later_batch_is_ignored(self):
+        self.deliver('evt_new', 'payment_intent.payment_failed', {'object': 'payment_intent', 'id': 'pi_3ds'}, created=1700000100)
+        process_stripe_events()
+        self.deliver('evt_old', 'payment_intent.succeeded', {'object': 'payment_intent', 'id': 'pi_3ds'}, created=1700000000)
+        self.assertEqual(process_stripe_events(), 1)
+        self.pending.refresh_from_db()
+        self.assertEqual((self.pending.paid, self.pending.stripe_event_id), (False, 'evt_new'))
+        self.deliver('evt_newer', 'payment_intent.succeeded', {'object': 'payment_intent', 'id': 'pi_3ds'}, created=1700000200)
+        process_stripe_events()
+        self.pending.refresh_from_db()
+        self.assertEqual((self.pending.paid, self.pending.stripe_event_created), (True, 1700000200))
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='')
+    def test_unconfigured_secret_fails_closed(self):
+        response = self.deliver('evt_open', 'payment_intent.succeeded', {'object': 'payment_intent', 'id': 'pi_3ds'}, secret='')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(StripeEvent.objects.count(), 0)
+
+    def test_missing_secret_is_a_deploy_warning(self):
+        from django.core import checks
+        self.assertNotIn('api.W001', [message.id for message in checks.run_checks(include_deployment_checks=True)])
+        with override_settings(STRIPE_WEBHOOK_SECRET=''):
+            self.assertIn('api.W001', [message.id for message in checks.run_checks(include_deployment_checks=True)])
+            self.assertNotIn('api.W001', [message.id for message in checks.run_checks()])
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.deliver('evt_bad', 'payment_intent.succeeded', {'object': 'payment_intent', 'id': 'pi_3ds'}, secret='whsec_wrong')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(StripeEvent.objects.count(), 0)
+
+
+class GenerateDatasetTests(TransactionTestCase):
+    def snapshot(self):
+        return (
+            list(Order.objects.order_by('id').values_list('status', 'total_price', 'created_at')),
+            list(OrderItem.objects.order_by('id').values_list('item__name', 'size', 'quantity')),
+            list(OrderItem.toppings.through.objects.order_by('id').values_list('topping__name', flat=True)),
+            list(Transaction.objects.order_by('id').values_list('amount', 'paid', 'timestamp')),
+        )
+
+    def generate(self, workers):
+        call_command('generate_dataset', '--users', '20', '--orders', '60', '--batch-size', '25',
+                     '--seed', '7', '--workers', str(workers), stdout=StringIO())
+
+    def test_seeded_runs_are_reproducible(self):
+        self.generate(workers=1)
+        first = self.snapshot()
+        # Users and orders are protected while history references them
+        Transaction.objects.all().delete()
+        Order.objects.all().delete()
+        User.objects.all().delete()
+        self.generate(workers=2)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_generated_totals_match_model_pricing(self):
+        self.generate(workers=1)
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertEqual(User.objects.count(), 20)
+        for order in Order.objects.prefetch_related('items__item', 'items__toppings'):
+            self.assertEqual(order.total_price, sum(item.get_total_price() for item in order.items.all()))
+        for transaction in Transaction.objects.select_related('order'):
+            self.assertEqual(transaction.amount, transaction.order.total_price)
+            self.assertEqual(transaction.timestamp, transaction.order.created_at)
+
+
+class MicrobenchTests(TransactionTestCase):
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ('base.json', 'changed.json')]
+            for path in paths:
+                call_command('microbench', '--sizes', '1', '2', '--runs', '2', '--min-time', '0',
+                             '--output', path, stdout=StringIO())
+            with open(paths[0]) as f:
+                results = json.load(f)
+            self.assertIn('order_update_total_price[items=2]', results['benchmarks'])
+            self.assertIn('jwt_authentication', results['benchmarks'])
+            out = StringIO()
+            call_command('microbench', '--compare', *paths, stdout=out)
+            self.assertIn('menuitem_serializer[items=1]', out.getvalue())
+        # Fixture rows are rolled back
+        self.assertFalse(User.objects.exists())
+
+
+class InventoryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='stockuser', password='stockpassword')
+        self.client.force_authenticate(user=self.user)
+        self.pizza = MenuItem.objects.create(name='Friday Special', price_small=Decimal('9.00'), price_large=Decimal('14.00'),
+                                             category='Pizza', stock=3)
+        self.truffle = Topping.objects.create(name='Truffle', price=Decimal('3.00'), stock=2)
+        self.order = Order.objects.create(user=self.user)
+
+    def add_line(self, quantity, toppings=()):
+        data = {'order': self.order.id, 'item': self.pizza.id, 'size': 'L', 'quantity': quantity, 'toppings': list(toppings)}
+        return self.client.post(reverse('orderitem-list'), data, format='json')
+
+    def test_reservation_decrements_stock_and_prices_toppings(self):
+        response = self.add_line(2, [self.truffle.id])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.pizza.refresh_from_db()
+        self.truffle.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((self.pizza.stock, self.truffle.stock), (1, 0))
+        self.assertEqual(self.order.total_price, Decimal('34.00'))
+
+    def test_oversell_is_rejected_without_partial_reservation(self):
+        response = self.add_line(2, [self.truffle.id])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # One pizza left but no truffle: neither may be taken
+        response = self.add_line(1, [self.truffle.id])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.stock, 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_deleting_line_releases_stock(self):
+        self.add_line(2, [self.truffle.id])
+        self.client.delete(reverse('orderitem-detail', args=[OrderItem.objects.get().id]))
+        self.pizza.refresh_from_db()
+        self.truffle.refresh_from_db()
+        self.assertEqual((self.pizza.stock, self.truffle.stock), (3, 2))
+
+    def test_abandoned_reservations_expire_in_bulk(self):
+        self.add_line(1, [self.truffle.id])
+        self.add_line(1)
+        Order.objects.filter(id=self.order.id).update(updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(release_expired_reservations(timedelta(minutes=30)), 2)
+        self.pizza.refresh_from_db()
+        self.truffle.refresh_from_db()
+        self.assertEqual((self.pizza.stock, self.truffle.stock), (3, 2))
+        self.assertEqual(release_expired_reservations(timedelta(minutes=30)), 0)
+
+    def expire(self):
+        Order.objects.filter(id=self.order.id).update(updated_at=timezone.now() - timedelta(hours=2))
+        release_expired_reservations(timedelta(minutes=30))
+
+    def test_completing_an_expired_order_reserves_again(self):
+        self.add_line(2, [self.truffle.id])
+        self.expire()
+        response = self.client.patch(reverse('order-detail', args=[self.order.id]), {'status': 'Completed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.pizza.refresh_from_db()
+        self.truffle.refresh_from_db()
+        self.assertEqual((self.pizza.stock, self.truffle.stock), (1, 0))
+        self.assertTrue(OrderItem.objects.get().reserved)
+
+    def test_stock_sold_meanwhile_is_a_conflict(self):
+        self.add_line(2, [self.truffle.id])
+        self.expire()
+        Topping.objects.filter(id=self.truffle.id).update(stock=1)
+        response = self.client.patch(reverse('order-detail', args=[self.order.id]), {'status': 'Completed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.order.refresh_from_db()
+        self.pizza.refresh_from_db()
+        self.assertEqual((self.order.status, self.pizza.stock), ('Pending', 3))
+        response = self.client.patch(reverse('orderitem-detail', args=[OrderItem.objects.get().id]), {'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @patch('api.receipts.submit_receipt')
+    @patch('stripe.PaymentIntent.create')
+    def test_charging_an_order_reserves_expired_lines_first(self, mock_create, submit_receipt):
+        mock_create.return_value = MockCharge(id='pi_stock', paid=True, amount=3400, currency='usd', description='', status='succeeded')
+        self.add_line(2, [self.truffle.id])
+        self.expire()
+        charge = {'token': 'pm_card_visa', 'amount': '34.00', 'return_url': 'https://example.com', 'order': self.order.id}
+        MenuItem.objects.filter(id=self.pizza.id).update(stock=1)
+        self.assertEqual(self.client.post(reverse('stripe-charge'), charge, format='json').status_code, status.HTTP_409_CONFLICT)
+        mock_create.assert_not_called()
+
+        MenuItem.objects.filter(id=self.pizza.id).update(stock=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('stripe-charge'), charge, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['order'], self.order.id)
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.stock, 1)
+        self.assertEqual(OrderEvent.objects.filter(order_id=self.order.id, kind='paid').get().data,
+                         {'transaction': response.data['id'], 'amount': '34.00'})
+
+    @patch('stripe.PaymentIntent.create')
+    def test_charging_an_order_takes_its_total(self, mock_create):
+        self.add_line(2, [self.truffle.id])
+        for order, amount in ((self.order.id, '5.00'), ('abc', '34.00'), (self.order.id + 1, '34.00')):
+            charge = {'token': 'pm_card_visa', 'amount': amount, 'return_url': 'https://example.com', 'order': order}
+            response = self.client.post(reverse('stripe-charge'), charge, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        mock_create.assert_not_called()
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_admin_completion_reserves_expired_lines(self):
+        self.add_line(2, [self.truffle.id])
+        self.expire()
+        short = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=short, item=self.pizza, size='L', quantity=1)
+        Order.objects.filter(id=short.id).update(updated_at=timezone.now() - timedelta(hours=2))
+        release_expired_reservations(timedelta(minutes=30))
+        Topping.objects.filter(id=self.truffle.id).update(stock=2)
+        MenuItem.objects.filter(id=self.pizza.id).update(stock=2)
+
+        with patch.object(OrderAdmin, 'message_user') as message_user:
+            OrderAdmin(Order, admin.site).make_completed(None, Order.objects.order_by('id'))
+        self.assertEqual(dict(Order.objects.values_list('id', 'status')), {self.order.id: 'Completed', short.id: 'Pending'})
+        self.assertIn(f'#{short.id}', message_user.call_args.args[1])
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.stock, 0)
+
+    def test_sold_out_items_are_flagged_in_catalog(self):
+        MenuItem.objects.filter(id=self.pizza.id).update(stock=0)
+        response = self.client.get(reverse('menuitem-list'))
+        self.assertFalse(response.data[0]['is_available'])
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+    def test_concurrent_reservations_never_oversell(self):
+        pizza = MenuItem.objects.create(name='Rush Pizza', price_small=Decimal('9.00'), category='Pizza', stock=10)
+        outcomes = []
+
+        def buy():
+            try:
+                while True:
+                    try:
+                        reserve(MenuItem.objects.get(id=pizza.id), 1)
+                        outcomes.append('reserved')
+                        return
+                    except OutOfStock:
+                        outcomes.append('sold out')
+                        return
+                    except OperationalError:
+                        continue  # SQLite reports lock contention instead of waiting; try again
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy) for _ in range(25)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        pizza.refresh_from_db()
+        self.assertEqual(pizza.stock, 0)
+        self.assertEqual(outcomes.count('reserved'), 10)
+        self.assertEqual(outcomes.count('sold out'), 15)
+
+
+@override_settings(STORE_DATABASES={'main': 'default', 'north': 'north'})
+class StoreShardingTests(TemporaryDatabasesMixin, APITransactionTestCase):
+    extra_databases = ['north']
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sharduser', password='shardpassword')
+        self.staff = User.objects.create_superuser(username='shardstaff', password='shardpassword')
+        self.client.force_authenticate(user=self.user)
+        self.pizza = MenuItem.objects.create(name='North Pizza', price_small=Decimal('8.00'), price_large=Decimal('12.00'), category='Pizza')
+        self.olives = Topping.objects.create(name='Olives', price=Decimal('1.00'))
+
+    def test_catalog_is_replicated_to_shards(self):
+        self.assertEqual(MenuItem.objects.using('north').get(id=self.pizza.id).name, 'North Pizza')
+        self.pizza.name = 'Renamed Pizza'
+        self.pizza.save()
+        self.assertEqual(MenuItem.objects.using('north').get(id=self.pizza.id).name, 'Renamed Pizza')
+
+    def test_orders_are_placed_on_their_store_shard(self):
+        response = self.client.post(reverse('order-list'), {'store': 'north'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Order.objects.using('default').exists())
+        order = Order.objects.for_store('north').get()
+
+        line = OrderItem.objects.create(order=order, item=self.pizza, size='L', quantity=2)
+        line.toppings.add(self.olives)
+        order.update_total_price()
+        self.assertEqual(line._state.db, 'north')
+        self.assertEqual(Order.objects.for_store('north').get().total_price, Decimal('26.00'))
+        self.assertEqual(order.user, self.user)
+
+    def test_sharded_orders_are_found_without_store(self):
+        order = Order.objects.create(user=self.user, store='north')
+        response = self.client.post(reverse('orderitem-list'), {'order': order.id, 'item': self.pizza.id, 'size': 'S'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(OrderItem.objects.using('north').get().order_id, order.id)
+        self.assertEqual(self.client.get(reverse('order-detail', args=[order.id])).data['total_price'], '8.00')
+
+        # The same id on two databases needs ?store= to tell them apart
+        Order.objects.create(id=order.id, user=self.user, store='main')
+        self.assertEqual(self.client.get(reverse('order-detail', args=[order.id])).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('order-detail', args=['abc'])).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('order-detail', args=[order.id]), {'store': 'north'})
+        self.assertEqual(response.data['store'], 'north')
+        response = self.client.post(reverse('orderitem-list') + '?store=main', {'order': order.id, 'item': self.pizza.id, 'size': 'S'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(OrderItem.objects.using('default').get().order.store, 'main')
+
+    def test_bulk_catalog_changes_are_synced_to_shards(self):
+        MenuItem.objects.bulk_create([MenuItem(name='Bulk Pizza', price_small=Decimal('7.00'), category='Pizza')])
+        Topping.objects.filter(id=self.olives.id).update(price=Decimal('1.25'))
+        self.assertFalse(MenuItem.objects.using('north').filter(name='Bulk Pizza').exists())
+        call_command('sync_catalog', stdout=StringIO())
+        self.assertTrue(MenuItem.objects.using('north').filter(name='Bulk Pizza').exists())
+        self.assertEqual(Topping.objects.using('north').get(id=self.olives.id).price, Decimal('1.25'))
+
+    def test_unknown_store_is_rejected(self):
+        response = self.client.post(reverse('order-list'), {'store': 'nowhere'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_kitchen_queue_and_report_fan_out(self):
+        Order.objects.create(user=self.user, store='main', total_price=Decimal('10.00'))
+        Order.objects.create(user=self.user, store='north', total_price=Decimal('20.00'))
+        Order.objects.create(user=self.user, store='north', total_price=Decimal('5.00'), status='Completed')
+        self.client.force_authenticate(user=self.staff)
+
+        response = self.client.get(reverse('store-orders', args=['north']))
+        self.assertEqual([order['total_price'] for order in response.data], ['20.00'])
+
+        report = self.client.get(reverse('store-report')).data
+        self.assertEqual(report['main'], {'orders': 1, 'revenue': '10.00', 'by_status': {'Pending': 1}})
+        self.assertEqual(report['north'], {'orders': 2, 'revenue': '25.00', 'by_status': {'Pending': 1, 'Completed': 1}})
+
+    @patch('api.receipts.submit_receipt')
+    @patch('stripe.PaymentIntent.create')
+    def test_checkout_on_shard_links_and_rolls_back(self, mock_create, submit_receipt):
+        payload = {'token': 'pm_card_visa', 'store': 'north', 'items': [{'item': self.pizza.id, 'size': 'S'}]}
+        mock_create.side_effect = stripe.error.CardError("Your card was declined.", "payment_method", "card_declined")
+        self.assertEqual(self.client.post(reverse('checkout'), payload, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.using('north').exists())
+
+        mock_create.side_effect = None
+        mock_create.return_value = MockCharge(id='pi_north', paid=True, amount=800, currency='usd', description='', status='succeeded')
+        self.assertEqual(self.client.post(reverse('checkout'), payload, format='json').status_code, status.HTTP_201_CREATED)
+        transaction = Transaction.objects.using('north').get()
+        self.assertEqual(transaction.order.items.get().item, self.pizza)
+        self.assertFalse(Transaction.objects.using('default').exists())
+        submit_receipt.assert_called_once_with(transaction.id, 'north')
+
+
+class OrderEventTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='eventuser', password='eventpassword')
+        self.admin = User.objects.create_superuser(username='eventadmin', password='eventadminpassword')
+        self.client.force_authenticate(user=self.user)
+        self.pizza = MenuItem.objects.create(name='Hawaiian', price_small=Decimal('9.00'), price_large=Decimal('14.00'), category='Pizza')
+
+    def kinds(self, order_id):
+        return list(OrderEvent.objects.filter(order_id=order_id).values_list('kind', flat=True))
+
+    def test_lifecycle_is_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('order-list'), {}, format='json')
+        order_id = Order.objects.get().id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('orderitem-list'), {'order': order_id, 'item': self.pizza.id, 'size': 'S'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('order-detail', args=[order_id]), {'status': 'Completed'}, format='json')
+        self.assertEqual(self.kinds(order_id), ['created', 'item_added', 'status_changed'])
+        event = OrderEvent.objects.get(kind='status_changed')
+        self.assertEqual(event.data, {'previous': 'Pending', 'status': 'Completed'})
+
+    def test_events_are_written_in_one_insert_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks, transaction.atomic():
+            order = Order.objects.create(user=self.user)
+            for _ in range(3):
+                OrderItem.objects.create(order=order, item=self.pizza, size='L')
+            self.assertEqual(OrderEvent.objects.count(), 0)
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        self.assertEqual(len([q for q in queries if 'INSERT INTO "api_orderevent"' in q['sql']]), 1)
+        self.assertEqual(self.kinds(order.id), ['created', 'item_added', 'item_added', 'item_added'])
+
+    def test_rolled_back_changes_leave_no_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user)
+            try:
+                with transaction.atomic():
+                    OrderItem.objects.create(order=order, item=self.pizza, size='L')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(self.kinds(order.id), ['created'])
+
+    def test_admin_completion_is_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user)
+            done = Order.objects.create(user=self.user, status='Completed')
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderAdmin(Order, admin.site).make_completed(None, Order.objects.all())
+        self.assertEqual(self.kinds(order.id), ['created', 'status_changed'])
+        self.assertEqual(self.kinds(done.id), ['created'])
+
+    @patch('api.receipts.submit_receipt')
+    @patch('stripe.PaymentIntent.create')
+    def test_checkout_logs_lines_and_payment(self, mock_create, submit_receipt):
+        mock_create.return_value = MockCharge(id='pi_789', paid=True, amount=900, currency='usd',
+                                              description='', status='succeeded')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('checkout'), {'token': 'pm_card_visa', 'items': [{'item': self.pizza.id, 'size': 'S'}]}, format='json')
+        self.assertEqual(self.kinds(response.data['order_id']), ['created', 'item_added', 'paid'])
+
+    def test_flushed_buffer_is_not_reused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                OrderItem.objects.create(order=order, item=self.pizza, size='S')
+        self.assertEqual(self.kinds(order.id), ['created', 'item_added'])
+
+    @override_settings(ORDER_EVENT_LOG_LAG_SECONDS=60)
+    def test_log_holds_back_recent_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            settled = Order.objects.create(user=self.user)
+            recent = Order.objects.create(user=self.user)
+        OrderEvent.objects.filter(order_id=settled.id).update(logged_at=timezone.now() - timedelta(minutes=5))
+        self.client.force_authenticate(user=self.admin)
+        first = self.client.get(reverse('order-events')).data
+        self.assertEqual([event['order_id'] for event in first['events']], [settled.id])
+        OrderEvent.objects.filter(order_id=recent.id).update(logged_at=timezone.now() - timedelta(minutes=5))
+        second = self.client.get(reverse('order-events'), {'after': first['cursor']}).data
+        self.assertEqual([event['order_id'] for event in second['events']], [recent.id])
+
+    @override_settings(ORDER_EVENT_LOG_LAG_SECONDS=0)
+    def test_log_is_read_by_cursor(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                Order.objects.create(user=self.user)
+        self.assertEqual(self.client.get(reverse('order-events')).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.admin)
+        first = self.client.get(reverse('order-events'), {'limit': 2}).data
+        self.assertEqual(len(first['events']), 2)
+        second = self.client.get(reverse('order-events'), {'after': first['cursor']}).data
+        self.assertEqual(len(second['events']), 1)
+        third = self.client.get(reverse('order-events'), {'after': second['cursor']}).data
+        self.assertEqual((third['events'], third['cursor']), ([], second['cursor']))
+
+    def test_webhook_payment_is_logged_once(self):
+        order = Order.objects.create(user=self.user)
+        Transaction.objects.create(user=self.user, order=order, amount=Decimal('9.00'), stripe_charge_id='pi_later')
+        for event_id in ('evt_a', 'evt_b'):
+            StripeEvent.objects.create(event_id=event_id, type='payment_intent.succeeded',
+                                       payload={'data': {'object': {'object': 'payment_intent', 'id': 'pi_later'}}})
+            with self.captureOnCommitCallbacks(execute=True):
+                process_stripe_events()
+        self.assertEqual(list(OrderEvent.objects.filter(kind='paid').values_list('order_id', flat=True)), [order.id])
+
+
+class OrderEventBatchTests(TransactionTestCase):
+    def test_events_outside_a_transaction_are_batched(self):
+        user = User.objects.create_user(username='batchuser', password='batchpassword')
+        pizza = MenuItem.objects.create(name='Batch Pizza', price_small=Decimal('9.00'), category='Pizza')
+        with CaptureQueriesContext(connection) as queries, batched():
+            order = Order.objects.create(user=user)
+            for _ in range(2):
+                OrderItem.objects.create(order=order, item=pizza, size='S')
+            self.assertEqual(OrderEvent.objects.count(), 0)
+        self.assertEqual(len([q for q in queries if 'INSERT INTO "api_orderevent"' in q['sql']]), 1)
+        self.assertEqual(list(OrderEvent.objects.filter(order_id=order.id).values_list('kind', flat=True)), ['created', 'item_added', 'item_added'])
+        self.assertEqual(str(OrderEvent.objects.first()), f"Order {order.id} created at {order.created_at.strftime('%Y-%m-%d %H:%M')}")
+
+
+class ReceiptTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='receiptuser', password='receiptpassword')
+        self.client.force_authenticate(user=self.user)
+        self.receipts_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.receipts_dir.cleanup)
+        settings_override = override_settings(RECEIPTS_DIR=self.receipts_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        pizza = MenuItem.objects.create(name='Quattro Formaggi', price_small=Decimal('10.00'), price_large=Decimal('15.00'), category='Pizza')
+        olives = Topping.objects.create(name='Olives', price=Decimal('1.25'))
+        self.order = Order.objects.create(user=self.user)
+        line = OrderItem.objects.create(order=self.order, item=pizza, size='L', quantity=2)
+        line.toppings.set([olives])
+        self.payment = Transaction.objects.create(user=self.user, order=self.order, amount=Decimal('32.50'),
+                                                  stripe_charge_id='pi_receipt', paid=True)
+        self.url = reverse('transaction-receipt', args=[self.payment.id, 'html'])
+
+    def test_receipt_lists_lines_toppings_and_total(self):
+        with open(receipts.generate_receipt(self.payment.id)) as f:
+            html = f.read()
+        self.assertIn('Quattro Formaggi', html)
+        self.assertIn('Olives', html)
+        self.assertIn('$32.50', html)
+
+    @patch('stripe.PaymentIntent.create')
+    def test_checkout_queues_receipt_after_commit(self, mock_create):
+        mock_create.return_value = MockCharge(id='pi_queued', paid=True, amount=1000, currency='usd',
+                                              description='', status='succeeded')
+        with patch('api.receipts.submit_receipt') as submit:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(reverse('checkout'), {
+                    'token': 'pm_card_visa', 'items': [{'item': MenuItem.objects.get().id, 'size': 'S'}],
+                }, format='json')
+            submit.assert_not_called()  # Nothing is rendered while the request is in flight
+            for callback in callbacks:
+                callback()
+        submit.assert_called_once_with(response.data['transaction']['id'], 'default')
+
+    def test_download_serves_cached_file_without_rendering(self):
+        with patch('api.receipts.submit_receipt') as submit:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        submit.assert_called_once_with(self.payment.id, 'default')
+
+        receipts.generate_receipt(self.payment.id)
+        with patch('api.receipts.render_receipt') as render:
+            response = self.client.get(self.url)
+            body = b''.join(response.streaming_content)
+        render.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'Quattro Formaggi', body)
+
+    def test_missing_pdf_is_queued_even_when_html_exists(self):
+        with patch('api.receipts.pdf_available', return_value=False):
+            receipts.generate_receipt(self.payment.id)  # HTML only
+        with patch('api.receipts.pdf_available', return_value=True), patch('api.receipts.submit_receipt') as submit:
+            response = self.client.get(reverse('transaction-receipt', args=[self.payment.id, 'pdf']))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        submit.assert_called_once_with(self.payment.id, 'default')
+
+    def test_other_users_cannot_download(self):
+        receipts.generate_receipt(self.payment.id)
+        self.client.force_authenticate(user=User.objects.create_user(username='snoop', password='snooppassword'))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+class DeliveryZoneTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='deliveryuser', password='deliverypassword')
+        self.client.force_authenticate(user=self.user)
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        zones = {'type': 'FeatureCollection', 'features': [
+            # Downtown has a park in the middle that isn't served
+            {'type': 'Feature', 'properties': {'name': 'Downtown', 'fee': 2.5, 'eta_minutes': 25},
+             'geometry': {'type': 'Polygon', 'coordinates': [square(-79.40, 43.64, 0.02), square(-79.395, 43.645, 0.005)]}},
+            {'type': 'Feature', 'properties': {'name': 'Suburbs', 'fee': 5, 'eta_minutes': 45},
+             'geometry': {'type': 'MultiPolygon', 'coordinates': [[square(-79.50, 43.60, 0.05)], [square(-79.30, 43.70, 0.05)]]}},
+        ]}
+        with open(os.path.join(data_dir.name, 'zones.geojson'), 'w') as f:
+            json.dump(zones, f)
+        with open(os.path.join(data_dir.name, 'addresses.csv'), 'w') as f:
+            f.write('address,latitude,longitude\n'
+                    '"1 King St, Toronto",43.65,-79.39\n'
+                    '2 Park Ave,43.6475,-79.3925\n'
+                    '3 Lake Rd,43.62,-79.48\n'
+                    '4 Far Away Ln,44.5,-80.5\n')
+        settings_override = override_settings(
+            DELIVERY_ZONES_FILE=os.path.join(data_dir.name, 'zones.geojson'),
+            GEOCODER_LOOKUP_FILE=os.path.join(data_dir.name, 'addresses.csv'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.url = reverse('delivery-quote')
+
+    def test_quote_for_profile_address(self):
+        UserProfile.objects.create(user=self.user, address='1 King St.,  Toronto')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['zone'], response.data['fee'], response.data['eta_minutes']), ('Downtown', '2.50', 25))
+        self.assertEqual(self.client.get(self.url, {'address': '3 Lake Rd'}).data['zone'], 'Suburbs')
+
+    def test_unserved_and_unknown_addresses(self):
+        self.assertEqual(self.client.get(self.url, {'address': '2 Park Ave'}).status_code, status.HTTP_404_NOT_FOUND)  # In the hole
+        self.assertEqual(self.client.get(self.url, {'address': '4 Far Away Ln'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(self.url, {'address': 'Nowhere'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_geocoding_is_cached_including_misses(self):
+        with patch.object(delivery.LookupTableGeocoder, 'geocode', autospec=True, side_effect=[(43.65, -79.39), None]) as lookup:
+            for _ in range(2):
+                self.assertEqual(delivery.geocode('5 Queen St'), (43.65, -79.39))
+                self.assertIsNone(delivery.geocode('6 Nowhere'))
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(GeocodedAddress.objects.count(), 2)
+
+    def test_cached_misses_expire(self):
+        with patch.object(delivery.LookupTableGeocoder, 'geocode', autospec=True, side_effect=[None, (43.65, -79.39)]) as lookup:
+            self.assertIsNone(delivery.geocode('7 New St'))
+            self.assertIsNone(delivery.geocode('7 New St'))
+            GeocodedAddress.objects.update(geocoded_at=timezone.now() - timedelta(days=2))
+            self.assertEqual(delivery.geocode('7 New St'), (43.65, -79.39))
+            self.assertEqual(delivery.geocode('7 New St'), (43.65, -79.39))
+        self.assertEqual(lookup.call_count, 2)
+
+    def test_index_agrees_with_scanning_every_zone(self):
+        index = delivery.get_zone_index()
+        rng = random.Random(7)
+        for _ in range(2000):
+            latitude, longitude = rng.uniform(43.55, 43.80), rng.uniform(-79.55, -79.20)
+            expected = next((zone for zone in index.zones if zone.contains(longitude, latitude)), None)
+            self.assertIs(index.find(latitude, longitude), expected)
+
+    def test_multipolygon_parts_are_indexed_separately(self):
+        index = delivery.get_zone_index()
+        suburbs = next(zone for zone in index.zones if zone.name == 'Suburbs')
+        # The cells between the two suburb squares (around downtown) don't list them
+        self.assertNotIn(suburbs, [zone for zone, _ in index.cells[(index.cell(-79.39), index.cell(43.65))]])
+        self.assertIs(index.find(43.72, -79.28), suburbs)
+
+
+class BootstrapTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='bootuser', password='bootpassword')
+        self.client.force_authenticate(user=self.user)
+        self.pizza = MenuItem.objects.create(name='Margherita', price_small=Decimal('9.00'), price_large=Decimal('14.00'), category='Pizza', stock=5)
+        self.basil = Topping.objects.create(name='Basil', price=Decimal('0.50'))
+        Order.objects.create(user=self.user, status='Completed')
+        self.order = Order.objects.create(user=self.user)
+        for _ in range(3):
+            OrderItem.objects.create(order=self.order, item=self.pizza, size='S').toppings.set([self.basil])
+        self.url = reverse('bootstrap')
+
+    def test_returns_catalog_and_open_order_with_bounded_queries(self):
+        data = self.client.get(self.url).data
+        self.assertEqual([item['name'] for item in data['menu']], ['Margherita'])
+        self.assertEqual([topping['name'] for topping in data['toppings']], ['Basil'])
+        self.assertEqual(data['order']['id'], self.order.id)
+        self.assertEqual(len(data['order']['lines']), 3)
+        self.assertEqual(data['order']['lines'][0]['toppings'], [self.basil.id])
+
+        # Warm catalog cache: the version, two sold-out lookups, the order, its lines and their toppings
+        with self.assertNumQueries(6):
+            self.client.get(self.url)
+
+    def test_unchanged_catalog_is_not_resent(self):
+        version = self.client.get(self.url).data['catalog_version']
+        data = self.client.get(self.url, {'catalog_version': version}).data
+        self.assertNotIn('menu', data)
+        self.assertEqual(data['catalog_version'], version)
+
+    def test_catalog_edit_bumps_version_after_commit(self):
+        version = self.client.get(self.url).data['catalog_version']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pizza.name = 'Margherita DOP'
+            self.pizza.save()
+        data = self.client.get(self.url, {'catalog_version': version}).data
+        self.assertNotEqual(data['catalog_version'], version)
+        self.assertEqual(data['menu'][0]['name'], 'Margherita DOP')
+
+    def test_stock_changes_show_without_invalidating_catalog(self):
+        version = self.client.get(self.url).data['catalog_version']
+        MenuItem.objects.filter(id=self.pizza.id).update(stock=0)
+        data = self.client.get(self.url).data
+        self.assertEqual(data['catalog_version'], version)
+        self.assertEqual(data['sold_out'], {'menu': [self.pizza.id], 'toppings': []})
+        self.assertFalse(data['menu'][0]['is_available'])
+        self.assertTrue(data['toppings'][0]['is_available'])
+
+    def test_version_is_shared_through_the_database(self):
+        version = self.client.get(self.url).data['catalog_version']
+        # Another worker's cache knows nothing about this one's
+        cache.clear()
+        self.assertEqual(self.client.get(self.url).data['catalog_version'], version)
+        catalog.bump_catalog_version()
+        self.assertEqual(CatalogVersion.objects.get().version, version + 1)
+
+
+@override_settings(FORECAST_LAG_SECONDS=0)
+class DemandForecastTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='forecastuser', password='forecastpassword')
+        self.pizza = MenuItem.objects.create(name='Diavola', price_small=Decimal('9.00'), price_large=Decimal('14.00'), category='Pizza')
+        self.salami = Topping.objects.create(name='Salami', price=Decimal('1.50'))
+
+    def add_line(self, created_at, quantity, toppings=(), size='L'):
+        order = Order.objects.create(user=self.user, created_at=created_at)
+        line = OrderItem.objects.create(order=order, item=self.pizza, size=size, quantity=quantity)
+        line.toppings.set(toppings)
+
+    def test_demand_is_counted_incrementally(self):
+        noon = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.add_line(noon, 2, [self.salami])
+        self.add_line(noon + timedelta(minutes=30), 1)
+        self.assertEqual(forecasting.update_demand(), 2)
+        self.assertEqual(forecasting.update_demand(), 0)
+        self.add_line(noon + timedelta(minutes=45), 3, [self.salami])
+        self.assertEqual(forecasting.update_demand(batch_size=1), 1)
+
+        hour = int(noon.timestamp()) // 3600
+        self.assertEqual(DemandCount.objects.get(kind='item', ref_id=self.pizza.id, size='L', hour=hour).quantity, 6)
+        self.assertEqual(DemandCount.objects.get(kind='topping', ref_id=self.salami.id, hour=hour).quantity, 5)
+
+    @override_settings(FORECAST_LAG_SECONDS=60)
+    def test_lines_of_recently_changed_orders_wait(self):
+        self.add_line(timezone.now(), 1)
+        self.add_line(timezone.now(), 2)
+        first = Order.objects.order_by('id').first()
+        Order.objects.filter(id=first.id).update(updated_at=timezone.now() - timedelta(minutes=5))
+        # The second line's order is still settling, so the watermark stops before it
+        self.assertEqual(forecasting.update_demand(), 1)
+        self.assertEqual(DemandWatermark.objects.get().last_line_id, first.items.get().id)
+        Order.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(forecasting.update_demand(), 1)
+
+    def test_forecast_follows_hour_of_week_seasonality(self):
+        now_hour = int(time.time()) // 3600
+        # Ten pizzas three hours from now on the same weekday in each of the last eight weeks
+        DemandCount.objects.bulk_create([
+            DemandCount(kind='item', ref_id=self.pizza.id, size='S', hour=now_hour + 3 - 168 * week, quantity=10)
+            for week in range(1, 9)
+        ])
+        predicted = forecasting.forecast('item', horizon=6, now=now_hour * 3600)[self.pizza.id, 'S']
+        self.assertEqual([round(value, 6) for value in predicted.tolist()], [0, 0, 0, 10, 0, 0])
+
+    def test_sizes_are_counted_and_forecast_separately(self):
+        noon = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=7)
+        self.add_line(noon, 2, [self.salami], size='S')
+        self.add_line(noon, 3, [self.salami], size='L')
+        forecasting.update_demand()
+        hour = int(noon.timestamp()) // 3600
+        counts = DemandCount.objects.filter(hour=hour).values_list('kind', 'size', 'quantity')
+        self.assertEqual(sorted(counts), [('item', 'L', 3), ('item', 'S', 2), ('topping', '', 5)])
+        predicted = forecasting.forecast('item', now=hour * 3600 + 7 * 24 * 3600)
+        self.assertEqual(sorted(predicted), [(self.pizza.id, 'L'), (self.pizza.id, 'S')])
+        self.assertAlmostEqual(predicted[self.pizza.id, 'L'].sum() / predicted[self.pizza.id, 'S'].sum(), 1.5)
+
+    def test_endpoint_is_staff_only(self):
+        self.add_line(timezone.now() - timedelta(days=7), 4, [self.salami])
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(reverse('demand-forecast')).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=User.objects.create_superuser(username='chef', password='chefpassword'))
+        forecasting.update_demand()
+        with patch('api.forecasting.update_demand') as update_demand:
+            data = self.client.get(reverse('demand-forecast'), {'horizon': 48}).data
+        update_demand.assert_not_called()
+        self.assertEqual(len(data['hours']), 48)
+        self.assertEqual([(row['name'], row['size']) for row in data['items']], [('Diavola', 'L')])
+        self.assertEqual([row['name'] for row in data['toppings']], ['Salami'])
+        self.assertAlmostEqual(sum(data['items'][0]['forecast']), data['items'][0]['total'], places=1)
+
+
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='archiveadmin', password='archiveadminpassword')
+        self.customer = User.objects.create_user(username='regular', password='regularpassword')
+        self.pizza = MenuItem.objects.create(name='Seasonal Special', price_small=Decimal('9.00'), price_large=Decimal('14.00'), category='Pizza')
+        self.truffle = Topping.objects.create(name='Truffle', price=Decimal('3.00'))
+        self.order = Order.objects.create(user=self.customer, status='Completed')
+        OrderItem.objects.create(order=self.order, item=self.pizza, size='L').toppings.set([self.truffle])
+        self.client.force_authenticate(user=self.admin)
+
+    def test_deleting_catalog_rows_archives_them_and_keeps_history(self):
+        self.assertEqual(self.client.delete(reverse('menuitem-detail', args=[self.pizza.id])).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.delete(reverse('topping-detail', args=[self.truffle.id])).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(MenuItem.objects.exists())
+        self.assertFalse(Topping.objects.exists())
+        self.assertEqual(self.client.get(reverse('menuitem-list')).data, [])
+
+        line = OrderItem.objects.get()
+        self.assertEqual(line.item, self.pizza)
+        self.assertEqual(list(line.toppings.all()), [self.truffle])
+        self.assertEqual(line.get_total_price(), Decimal('17.00'))
+
+    def test_archived_items_cannot_be_ordered(self):
+        self.pizza.archive()
+        order = Order.objects.create(user=self.customer)
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post(reverse('orderitem-list'), {'order': order.id, 'item': self.pizza.id, 'size': 'S'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('item', response.data)
+
+    def test_history_is_protected_from_hard_deletes(self):
+        with self.assertRaises(ProtectedError):
+            MenuItem.all_objects.filter(id=self.pizza.id).delete()
+        with self.assertRaises(ProtectedError):
+            self.customer.delete()
+
+    def test_admin_deactivates_users_instead_of_deleting(self):
+        UserAdmin(User, admin.site).delete_queryset(None, User.objects.filter(id=self.customer.id))
+        self.customer.refresh_from_db()
+        self.assertFalse(self.customer.is_active)
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+
+
+class AsyncAuthTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='loginuser', password='loginpassword')
+
+    def test_register_hashes_with_policy_hasher(self):
+        response = self.client.post(reverse('async-register'), {'username': 'newbie', 'password': 'newbiepassword',
+                                                                 'email': 'newbie@EXAMPLE.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('password', response.json())
+        user = User.objects.get(username='newbie')
+        self.assertEqual(user.email, 'newbie@example.com')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+        self.assertTrue(user.check_password('newbiepassword'))
+        response = self.client.post(reverse('async-register'), {'username': 'newbie', 'password': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_token_issued_for_valid_credentials_only(self):
+        response = self.client.post(reverse('async-get-token'), {'username': 'loginuser', 'password': 'loginpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = response.json()['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get(reverse('menuitem-list')).status_code, status.HTTP_200_OK)
+        self.client.credentials()
+
+        for username, password in (('loginuser', 'wrong'), ('nobody', 'loginpassword')):
+            response = self.client.post(reverse('async-get-token'), {'username': username, 'password': password}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        response = self.client.post(reverse('async-get-token'), {'username': 'loginuser', 'password': 'loginpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.post(reverse('async-get-token'), {}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        weak = auth_hashers.PBKDF2PasswordHasher().encode('loginpassword', 'somesalt', iterations=1000)
+        User.objects.filter(id=self.user.id).update(password=weak)
+        self.client.post(reverse('async-get-token'), {'username': 'loginuser', 'password': 'loginpassword'}, format='json')
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.password, weak)
+        self.assertFalse(auth_hashers.get_hasher('default').must_update(self.user.password))
+
+    def test_saturated_pool_sheds_load(self):
+        full = threading.BoundedSemaphore(1)
+        full.acquire()
+        with patch('api.hashers._get_pool', return_value=(None, full)):
+            response = self.client.post(reverse('async-get-token'), {'username': 'loginuser', 'password': 'loginpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'throttle.sqlite3')
+        overrides = override_settings(THROTTLE_DB=self.db_path, TOKEN_BUCKETS={
+            'register': {'rate': '1/hour', 'burst': 2},
+            'login': {'rate': '1/hour', 'burst': 1},
+            'order-writes': {'rate': '1/hour', 'burst': 2},
+        })
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username='throttled', password='throttledpassword')
+        self.other = User.objects.create_user(username='unthrottled', password='unthrottledpassword')
+
+    def test_bucket_refills_at_rate_up_to_burst(self):
+        store = TokenBucketStore(self.db_path)
+        self.assertEqual([store.take('k', 1, 2, now=100) for _ in range(3)], [0, 0, 1])
+        self.assertEqual(store.take('k', 1, 2, now=101), 0)
+        self.assertEqual(store.take('k', 1, 2, now=1000), 0)
+        self.assertEqual(store.take('k', 1, 2, now=1000), 0)
+        self.assertEqual(store.take('k', 1, 2, now=1000), 1)
+        # A separate connection (as in another process) sees the same bucket
+        self.assertEqual(TokenBucketStore(self.db_path).take('k', 1, 2, now=1000.5), 0.5)
+
+    def test_order_writes_are_throttled_per_user(self):
+        self.client.force_authenticate(self.user)
+        statuses = [self.client.post(reverse('order-list'), {'user': self.user.id, 'status': 'Pending'}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [status.HTTP_201_CREATED, status.HTTP_201_CREATED, status.HTTP_429_TOO_MANY_REQUESTS])
+        response = self.client.post(reverse('order-list'), {'user': self.user.id, 'status': 'Pending'})
+        self.assertGreater(int(response['Retry-After']), 3000)
+        # Reads are not metered, and other users have their own bucket
+        self.assertEqual(self.client.get(reverse('order-list')).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(self.other)
+        response = self.client.post(reverse('order-list'), {'user': self.other.id, 'status': 'Pending'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_anonymous_clients_are_throttled_per_ip(self):
+        def register(username, ip):
+            return self.client.post(reverse('register'), {'username': username, 'password': 'somepassword'},
+                                    REMOTE_ADDR=ip).status_code
+        self.assertEqual(register('first', '10.0.0.1'), status.HTTP_201_CREATED)
+        self.assertEqual(register('second', '10.0.0.1'), status.HTTP_201_CREATED)
+        self.assertEqual(register('third', '10.0.0.1'), status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(register('fourth', '10.0.0.2'), status.HTTP_201_CREATED)
+
+    def test_sync_and_async_login_share_buckets(self):
+        credentials = {'username': 'throttled', 'password': 'throttledpassword'}
+        self.assertEqual(self.client.post(reverse('get_token'), credentials, format='json').status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('async-get-token'), credentials, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        response = self.client.post(reverse('get_token'), credentials, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class LoadSheddingTests(SimpleTestCase):
+    def test_sheds_over_in_flight_limit(self):
+        seen = []
+
+        def view(request):
+            # Re-enter the middleware while this request is still in flight
+            seen.append(middleware(request).status_code if not seen else None)
+            return JsonResponse({})
+
+        middleware = LoadSheddingMiddleware(view)
+        request = RequestFactory().get('/api/menuitems/')
+        with override_settings(LOAD_SHED_MAX_IN_FLIGHT=1):
+            self.assertEqual(middleware(request).status_code, 200)
+            self.assertEqual(seen[0], 503)
+            self.assertEqual(middleware(request).status_code, 200)
+        self.assertEqual(middleware.in_flight, 0)
+
+    def test_sheds_requests_that_queued_too_long(self):
+        middleware = LoadSheddingMiddleware(lambda request: JsonResponse({}))
+        factory = RequestFactory()
+        with override_settings(LOAD_SHED_MAX_QUEUE_MS=500):
+            for header in (f't={time.time() - 2:.3f}', str(int((time.time() - 2) * 1e6))):
+                response = middleware(factory.get('/', HTTP_X_REQUEST_START=header))
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response['Retry-After'], '1')
+            fresh = str(int(time.time() * 1000))
+            self.assertEqual(middleware(factory.get('/', HTTP_X_REQUEST_START=fresh)).status_code, 200)
+            self.assertEqual(middleware(factory.get('/')).status_code, 200)
+
+
+class JSONRenderingTests(SimpleTestCase):
+    def test_fast_renderer_matches_stock_output(self):
+        from rest_framework.exceptions import ErrorDetail
+        from rest_framework.renderers import JSONRenderer
+        from django.utils.translation import gettext_lazy
+        data = {
+            'price': Decimal('10.50'), 'when': timezone.now(), 'naive': timezone.now().replace(tzinfo=None),
+            'day': timezone.now().date(), 'error': ErrorDetail('bad', code='invalid'), 'lazy': gettext_lazy('Pending'),
+            'text': 'café    ', 1: [None, True, 1.5], 'huge': 2 ** 70, 'nested': {'list': (1, 2)},
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_fast_renderer_matches_stock_floats(self):
+        from rest_framework.renderers import JSONRenderer
+        for value in (1e16, 1e-7, -2.5e20, 1.5e-05, 0.0, 0.0001, 123.456, Decimal('1e20')):
+            data = {'nested': [{'value': value}]}
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        for value in (float('nan'), float('inf'), -float('inf')):
+            with self.assertRaises(ValueError):
+                JSONRenderer().render({'value': value})
+            with self.assertRaises(ValueError):
+                FastJSONRenderer().render({'value': value})
+
+    def test_fast_parser_matches_stock_parser(self):
+        from rest_framework.exceptions import ParseError
+        from rest_framework.parsers import JSONParser
+        from io import BytesIO
+        for body in (b'{"a": [1, 2.5, "\\u00e9"], "b": null}', ('{"big": %d}' % 2 ** 70).encode()):
+            self.assertEqual(FastJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        for body in (b'{"a": ', b'{"a": NaN}', b''):
+            with self.assertRaises(ParseError) as fast:
+                FastJSONParser().parse(BytesIO(body))
+            with self.assertRaises(ParseError) as stock:
+                JSONParser().parse(BytesIO(body))
+            self.assertEqual(str(fast.exception), str(stock.exception))
+
+
+class CompressionTests(APITestCase):
+    def setUp(self):
+        MenuItem.objects.bulk_create([
+            MenuItem(name=f'Pizza {i}', category='Pizza', price_small=Decimal('9.99'), price_large=Decimal('15.99'),
+                     description='Tomato, mozzarella and basil. ' * 4)
+            for i in range(20)
+        ])
+        self.admin = User.objects.create_superuser('compressadmin', 'admin@example.com', 'password')
+        self.client.force_authenticate(self.admin)
+
+    def test_large_json_is_gzipped_when_accepted(self):
+        plain = self.client.get(reverse('menuitem-list'))
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get(reverse('menuitem-list'), HTTP_ACCEPT_ENCODING='br;q=0.5, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        response = self.client.get(reverse('menuitem-list'), HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(reverse('topping-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_html_is_not_compressed(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:index'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertGreater(len(response.content), 1024)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_brotli_is_preferred_when_available(self):
+        class FakeBrotli:
+            @staticmethod
+            def compress(content, quality):
+                return b'br:' + gzip.compress(content)
+
+        with patch('api.middleware.get_brotli', return_value=FakeBrotli):
+            response = self.client.get(reverse('menuitem-list'), HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertTrue(response.content.startswith(b'br:'))
+            response = self.client.get(reverse('menuitem-list'), HTTP_ACCEPT_ENCODING='gzip, br;q=0.1')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sparse', password='sparsepassword')
+        self.other = User.objects.create_user(username='notsparse', password='notsparsepassword')
+        self.pizza = MenuItem.objects.create(name='Margherita', category='Pizza', price_small=Decimal('9.00'),
+                                             price_large=Decimal('14.00'), description='Tomato and mozzarella. ' * 20)
+        self.toppings = [Topping.objects.create(name=name, price=Decimal('1.00')) for name in ('Basil', 'Olives')]
+        for _ in range(3):
+            self.add_order(self.user)
+        self.payment = Transaction.objects.create(user=self.user, order=Order.objects.first(), amount=Decimal('30.00'),
+                                                  stripe_charge_id='ch_sparse', paid=True)
+        Transaction.objects.create(user=self.other, amount=Decimal('5.00'), stripe_charge_id='ch_other')
+        self.client.force_authenticate(self.user)
+
+    def add_order(self, user):
+        order = Order.objects.create(user=user)
+        line = OrderItem.objects.create(order=order, item=self.pizza, size='L', quantity=2)
+        line.toppings.set(self.toppings)
+        return order
+
+    def test_fields_trims_output_and_selected_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('menuitem-list'), {'fields': 'id,name,price_small'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [{'id': self.pizza.id, 'name': 'Margherita', 'price_small': '$9.00'}])
+        menu_query = next(query['sql'] for query in queries.captured_queries if 'api_menuitem' in query['sql'])
+        self.assertNotIn('description', menu_query)
+        self.assertNotIn('price_large', menu_query)
+
+        response = self.client.get(reverse('topping-detail', args=[self.toppings[0].id]), {'fields': 'name'})
+        self.assertEqual(response.json(), {'name': 'Basil'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('menuitem-list'), {'fields': 'name,is_available'})
+        self.assertEqual(response.json(), [{'name': 'Margherita', 'is_available': True}])
+        menu_query = next(query['sql'] for query in queries.captured_queries if 'api_menuitem' in query['sql'])
+        self.assertIn('stock', menu_query)
+        self.assertNotIn('description', menu_query)
+        response = self.client.get(reverse('menuitem-list'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', response.json())
+
+    def test_expand_nests_related_objects_without_extra_queries_per_row(self):
+        def fetch():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('order-list'), {'expand': 'user,items.item,items.toppings',
+                                                                   'fields': 'user,status,items'})
+            return response, len(queries)
+
+        response, query_count = fetch()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        order = response.json()[0]
+        self.assertEqual(order['user'], {'id': self.user.id, 'username': 'sparse'})
+        self.assertEqual(order['items'][0]['item']['name'], 'Margherita')
+        self.assertEqual([t['name'] for t in order['items'][0]['toppings']], ['Basil', 'Olives'])
+        for _ in range(5):
+            self.add_order(self.other)
+        response, more_orders_query_count = fetch()
+        self.assertEqual(len(response.json()), 8)
+        self.assertEqual(more_orders_query_count, query_count)
+
+        self.assertEqual(self.client.get(reverse('order-list'), {'expand': 'store'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        # Without expand, relations are still listed as ids
+        response = self.client.get(reverse('order-list'), {'fields': 'items'})
+        self.assertEqual(response.json()[0], {'items': [OrderItem.objects.order_by('id').first().id]})
+
+    def test_transactions_are_listed_for_their_owner(self):
+        response = self.client.get(reverse('transaction-list'), {'expand': 'order', 'fields': 'id,amount,order'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 1)
+        payment = response.json()[0]
+        self.assertEqual(payment['id'], self.payment.id)
+        self.assertEqual(payment['order']['status'], 'Pending')
+        self.assertEqual(self.client.get(reverse('transaction-detail', args=[self.payment.id + 1])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+
+class MenuSearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searcher', password='searchpassword')
+        self.client.force_authenticate(self.user)
+        self.margherita = MenuItem.objects.create(name='Margherita', category='Pizza', price_small=Decimal('9.00'),
+                                                  description='Tomato, mozzarella and fresh basil')
+        self.pesto = MenuItem.objects.create(name='Pesto Bread', category='Breads', price_small=Decimal('5.00'),
+                                             description='Garlic bread with basil pesto')
+        self.tiramisu = MenuItem.objects.create(name='Tiramisù', category='Deserts', price_small=Decimal('6.00'),
+                                                description='Coffee and mascarpone')
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('menuitem-search'), {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.json()]
+
+    def test_prefix_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search('marg'), ['Margherita'])
+        self.assertEqual(self.search('BAS'), ['Margherita', 'Pesto Bread'])
+        self.assertEqual(self.search('pesto basil'), ['Pesto Bread'])
+        self.assertEqual(self.search('bread'), ['Pesto Bread'])
+        self.assertEqual(self.search('tiramisu'), ['Tiramisù'])
+        self.assertEqual(self.search('"bread*) -'), ['Pesto Bread'])  # Query syntax is not passed through
+        self.assertEqual(self.search('basil', limit=1, fields='name'), ['Margherita'])
+        self.assertEqual(self.client.get(reverse('menuitem-search'), {'q': ' '}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_edits_archiving_and_deletes(self):
+        self.margherita.name = 'Marinara'
+        self.margherita.description = 'Tomato, garlic and oregano'
+        self.margherita.save()
+        self.assertEqual(self.search('marg'), [])
+        self.assertEqual(self.search('oreg'), ['Marinara'])
+
+        self.pesto.archive()
+        self.assertEqual(self.search('pesto'), [])
+        self.assertEqual(search.search_menu_ids('pesto', include_archived=True), [self.pesto.id])
+        self.tiramisu.delete()
+        self.assertEqual(search.search_menu_ids('tiramisu', include_archived=True), [])
+
+        MenuItem.all_objects.filter(id=self.pesto.id).update(name='Focaccia')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search.search_menu_ids('focac', include_archived=True), [self.pesto.id])
+
+    def test_admin_search_uses_index(self):
+        from .admin import MenuItemAdmin
+        model_admin = MenuItemAdmin(MenuItem, admin.site)
+        queryset, may_have_duplicates = model_admin.get_search_results(None, MenuItem.all_objects.all(), 'basil mozz')
+        self.assertEqual(list(queryset), [self.margherita])
+        self.assertFalse(may_have_duplicates)
+
+
+class OrderArchivalTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='archiver', password='archiverpassword')
+        self.client.force_authenticate(self.user)
+        self.pizza = MenuItem.objects.create(name='Margherita', category='Pizza', price_small=Decimal('9.00'),
+                                             price_large=Decimal('14.00'), stock=10)
+        self.basil = Topping.objects.create(name='Basil', price=Decimal('1.00'))
+        self.old = [self.add_order('Completed', days_ago=120 + i) for i in range(2)]
+        self.recent = self.add_order('Completed', days_ago=5)
+        self.old_pending = self.add_order('Pending', days_ago=200)
+        self.payment = Transaction.objects.create(user=self.user, order=self.old[0], amount=Decimal('15.00'),
+                                                  stripe_charge_id='ch_archived', paid=True)
+
+    def add_order(self, status, days_ago):
+        order = Order.objects.create(user=self.user, status=status)
+        line = OrderItem.objects.create(order=order, item=self.pizza, size='L', quantity=1)
+        line.toppings.set([self.basil])
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        order.refresh_from_db()
+        return order
+
+    def archive(self, count_demand=True, **options):
+        if count_demand:
+            with override_settings(FORECAST_LAG_SECONDS=0):
+                forecasting.update_demand()
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_orders', stdout=out, **options)
+        return out.getvalue()
+
+    def test_moves_only_old_completed_orders_in_batches(self):
+        line_ids = list(OrderItem.objects.filter(order__in=self.old).values_list('id', flat=True))
+        stock = MenuItem.objects.get(id=self.pizza.id).stock
+        self.assertIn('Archived 2 order(s)', self.archive(batch_size=1))
+
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {self.recent.id, self.old_pending.id})
+        self.assertFalse(OrderItem.objects.filter(id__in=line_ids).exists())
+        archived = ArchivedOrder.objects.get(id=self.old[0].id)
+        self.assertEqual((archived.user, archived.status, archived.total_price, archived.created_at),
+                         (self.user, 'Completed', self.old[0].total_price, self.old[0].created_at))
+        self.assertEqual(sorted(ArchivedOrderItem.objects.values_list('id', flat=True)), sorted(line_ids))
+        self.assertEqual([t.name for t in archived.items.get().toppings.all()], ['Basil'])
+
+        self.payment.refresh_from_db()
+        self.assertIsNone(self.payment.order_id)
+        self.assertEqual(self.payment.archived_order_id, self.old[0].id)
+        # Moving lines is not removing them: no stock released, no events
+        self.assertEqual(MenuItem.objects.get(id=self.pizza.id).stock, stock)
+        self.assertFalse(OrderEvent.objects.filter(kind='item_removed').exists())
+        self.assertIn('Archived 0 order(s)', self.archive())
+
+    def test_lines_not_yet_counted_for_demand_are_not_archived(self):
+        watermark = DemandWatermark.objects.create(database='default', last_line_id=0)
+        self.assertIn('Archived 0 order(s)', self.archive(count_demand=False))
+        watermark.last_line_id = self.old[0].items.get().id
+        watermark.save()
+        self.assertIn('Archived 1 order(s)', self.archive(count_demand=False))
+        self.assertEqual(ArchivedOrder.objects.get().id, self.old[0].id)
+
+    def test_archives_everything_due_without_forecasting(self):
+        self.assertIn('Archived 2 order(s)', self.archive(count_demand=False))
+
+    def test_archived_orders_are_read_through_the_order_api(self):
+        self.archive()
+        response = self.client.get(reverse('order-detail', args=[self.old[0].id]), {'expand': 'items.toppings'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], 'Completed')
+        self.assertEqual(response.json()['items'][0]['toppings'], [{'id': self.basil.id, 'name': 'Basil',
+                                                                    'price': '1.00', 'is_available': True}])
+        self.assertEqual(self.client.get(reverse('order-detail', args=[999999])).status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(reverse('order-history'), {'fields': 'status,total_price'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([order['status'] for order in response.json()], ['Completed', 'Completed', 'Completed', 'Pending'])
+        self.assertEqual(len(self.client.get(reverse('order-history'), {'limit': 2}).json()), 2)
+
+        response = self.client.get(reverse('transaction-detail', args=[self.payment.id]), {'expand': 'archived_order'})
+        self.assertEqual(response.json()['archived_order']['total_price'], str(self.old[0].total_price))
@@ -0,0 +1,113 @@
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+RATE_PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(rate):
+    """'10/min' -> tokens per second, like DRF's rate strings."""
+    count, period = rate.split('/')
+    return int(count) / RATE_PERIODS[period]
+
+
+class TokenBucketStore:
+    """
+    Token buckets kept in a SQLite file, so every worker process on the host
+    draws from the same buckets. Each take is one short IMMEDIATE transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, rate, capacity, now=None):
+        """Take a token from the bucket; returns 0 when granted, else the seconds until one is available."""
+        now = time.time() if now is None else now
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(0, now - row[1]) * rate)
+            if tokens >= 1:
+                tokens, wait = tokens - 1, 0
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute(
+                'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                (key, tokens, now),
+            )
+            if random.random() < 0.001:
+                # A bucket idle this long has refilled, which is the same as having no row
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - 86400,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    with _stores_lock:
+        if settings.THROTTLE_DB not in _stores:
+            _stores[settings.THROTTLE_DB] = TokenBucketStore(settings.THROTTLE_DB)
+        return _stores[settings.THROTTLE_DB]
+
+
+def take_token(scope, ident):
+    """Seconds the client must wait before a request in `scope` is allowed (0: go ahead)."""
+    bucket = settings.TOKEN_BUCKETS.get(scope)
+    if bucket is None:
+        return 0
+    rate = parse_rate(bucket['rate'])
+    return get_store().take(f'{scope}:{ident}', rate, bucket.get('burst', 1))
+
+
+def ip_ident(request):
+    # BaseThrottle.get_ident only reads request.META, honouring NUM_PROXIES for X-Forwarded-For
+    return f'ip:{BaseThrottle().get_ident(request)}'
+
+
+def client_ident(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return ip_ident(request)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttles views by their `throttle_scope`, with per-scope limits in
+    settings.TOKEN_BUCKETS; each user (or each IP, for anonymous clients)
+    has its own bucket. Only unsafe methods are metered: reads on these
+    endpoints are cheap.
+    """
+
+    def allow_request(self, request, view):
+        self.wait_seconds = 0
+        if request.method in SAFE_METHODS:
+            return True
+        self.wait_seconds = take_token(getattr(view, 'throttle_scope', None), client_ident(request))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
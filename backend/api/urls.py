@@ -1,8 +1,10 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import MenuItemViewSet, ToppingViewSet, \
-                OrderViewSet, OrderItemViewSet, \
-                StripeChargeView, MenuItemDetailView
+                OrderViewSet, OrderItemViewSet, TransactionViewSet, \
+                StripeChargeView, ReceiptView, BootstrapView, DemandForecastView, DeliveryQuoteView, MenuItemDetailView, CheckoutView, StripeWebhookView, \
+                StoreOrdersView, StoreReportView, OrderEventLogView, \
+                async_menu_items, async_toppings, async_orders
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
@@ -10,6 +12,7 @@ router.register(r'menuitems', MenuItemViewSet)
 router.register(r'toppings', ToppingViewSet)
 router.register(r'orders', OrderViewSet)
 router.register(r'orderitems', OrderItemViewSet)
+router.register(r'transactions', TransactionViewSet, basename='transaction')
 
 # The URLs for the viewsets will be automatically created
 urlpatterns = router.urls  # This includes all the routes registered in the router
@@ -17,5 +20,24 @@ urlpatterns = router.urls  # This includes all the routes registered in the rout
 # Add custom views to the urlpatterns
 urlpatterns += [
     path("charge/", StripeChargeView.as_view(), name='stripe-charge'),
+    path("transactions/<int:pk>/receipt.<str:ext>", ReceiptView.as_view(), name='transaction-receipt'),
+    path("bootstrap/", BootstrapView.as_view(), name='bootstrap'),
+    path("forecast/", DemandForecastView.as_view(), name='demand-forecast'),
+    path("delivery/quote/", DeliveryQuoteView.as_view(), name='delivery-quote'),
+    path("checkout/", CheckoutView.as_view(), name='checkout'),
+    path("stripe/webhook/", StripeWebhookView.as_view(), name='stripe-webhook'),
+    path('order-events/', OrderEventLogView.as_view(), name='order-events'),
+    path('stores/report/', StoreReportView.as_view(), name='store-report'),
+    path('stores/<str:store>/orders/', StoreOrdersView.as_view(), name='store-orders'),
     path('menuitems/<int:pk>/', MenuItemDetailView.as_view(), name='menuitem-detail'),
 ]
+
+# Native async read endpoints (served without a worker thread under ASGI)
+urlpatterns += [
+    path('async/menuitems/', async_menu_items, name='async-menuitem-list'),
+    path('async/menuitems/<int:pk>/', async_menu_items, name='async-menuitem-detail'),
+    path('async/toppings/', async_toppings, name='async-topping-list'),
+    path('async/toppings/<int:pk>/', async_toppings, name='async-topping-detail'),
+    path('async/orders/', async_orders, name='async-order-list'),
+    path('async/orders/<int:pk>/', async_orders, name='async-order-detail'),
+]
@@ -1,20 +1,45 @@
 from rest_framework import viewsets, generics, status
-from .models import MenuItem, Order, OrderItem, Topping, Transaction
-from .serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer, ToppingSerializer, UserSerializer, TransactionSerializer
+from rest_framework.decorators import action
+from .models import MenuItem, Order, OrderItem, Topping, Transaction, StripeEvent, OrderEvent, UserProfile, ArchivedOrder
+from .serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer, ToppingSerializer, UserSerializer, TransactionSerializer, \
+    CheckoutSerializer, OrderEventSerializer, ArchivedOrderSerializer, parse_field_list, sparse_queryset
 from django.contrib.auth.models import User
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser, SAFE_METHODS
+from rest_framework.exceptions import PermissionDenied, APIException, ValidationError
 from django.conf import settings
-import stripe
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from django.db import transaction as db_transaction
+from django.http import FileResponse, HttpResponse, Http404
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
+from .authentication import AsyncJWTAuthentication
+from .hashers import HashingBusy, acheck_user_password, amake_password
+from .throttling import TokenBucketThrottle, ip_ident, take_token
+from .renderers import FastJSONRenderer
+from .payments import get_stripe
+from .inventory import OutOfStock, reserve, reserve_order
+from .events import record
+from . import catalog, delivery, receipts, search
+from .routers import fan_out, order_databases, shard_for_store
+from django.db.models import Count, Sum
+from decimal import Decimal
+from functools import wraps
+from itertools import takewhile
+import json
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
 
 class UserCreate(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'register'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -24,7 +49,51 @@ class UserCreate(generics.CreateAPIView):
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class MenuItemViewSet(viewsets.ModelViewSet):
+# Login, with the same token bucket as the async login endpoint
+class ThrottledTokenObtainPairView(TokenObtainPairView):
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'login'
+
+# ?fields= and ?expand= on reads, selecting and prefetching only what they need
+class SparseFieldsetMixin:
+    def sparse_kwargs(self):
+        if self.request.method not in SAFE_METHODS:
+            return {}
+        return {
+            'fields': parse_field_list(self.request.query_params.get('fields')) or None,
+            'expand': parse_field_list(self.request.query_params.get('expand')),
+        }
+
+    def get_serializer(self, *args, **kwargs):
+        return super().get_serializer(*args, **{**self.sparse_kwargs(), **kwargs})
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in SAFE_METHODS:
+            queryset = sparse_queryset(queryset, self.get_serializer())
+        return queryset
+
+# Detail routes over sharded rows: ?store= picks the database, otherwise every store
+# database is searched, since ids are only unique within one
+class StoreLookupMixin:
+    def locate(self, queryset):
+        if self.request.query_params.get('store') or len(order_databases()) == 1:
+            return generics.get_object_or_404(queryset, pk=self.kwargs['pk'])
+        if not str(self.kwargs['pk']).isdigit():
+            raise Http404
+        found = queryset.locate(self.kwargs['pk'])
+        if not found:
+            raise Http404
+        if len(found) > 1:
+            raise ValidationError({'store': 'This id exists at several stores; pass ?store= to pick one.'})
+        return found[0]
+
+    def get_object(self):
+        obj = self.locate(self.filter_queryset(self.get_queryset()))
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+class MenuItemViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
 
@@ -34,12 +103,30 @@ class MenuItemViewSet(viewsets.ModelViewSet):
         # Ensure authentication for non-admin users for 'list' and 'retrieve' actions
         return [IsAuthenticated()]
 
-class MenuItemDetailView(generics.RetrieveAPIView):
+    def perform_destroy(self, instance):
+        # Archived rather than deleted: past order lines still reference it
+        instance.archive()
+
+    # Ranked full-text search over name, category and description, by word prefix: ?q=marg&limit=20
+    @action(detail=False)
+    def search(self, request):
+        query = request.query_params.get('q', '')
+        if not search.search_terms(query):
+            return Response({'error': 'q is required'}, status=400)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=400)
+        ids = search.search_menu_ids(query, limit)
+        items = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        return Response(self.get_serializer([items[pk] for pk in ids if pk in items], many=True).data)
+
+class MenuItemDetailView(SparseFieldsetMixin, generics.RetrieveAPIView):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
     permission_classes = [IsAuthenticated]  # Add this line to ensure authentication
 
-class ToppingViewSet(viewsets.ModelViewSet):
+class ToppingViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Topping.objects.all()
     serializer_class = ToppingSerializer
 
@@ -51,14 +138,125 @@ class ToppingViewSet(viewsets.ModelViewSet):
             return [IsAdminUser()]  # Admin-only actions for creating, updating, and destroying
         return []
 
-class OrderViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        instance.archive()
+
+class OrderViewSet(StoreLookupMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'order-writes'
+
+    def get_queryset(self):
+        # ?store= reads that store's database only
+        store = self.request.query_params.get('store')
+        if store:
+            return Order.objects.for_store(store)
+        return super().get_queryset()
+
+    def archived_queryset(self):
+        store = self.request.query_params.get('store')
+        return ArchivedOrder.objects.for_store(store) if store else ArchivedOrder.objects.all()
+
+    def archived_serializer(self, *args, **kwargs):
+        return ArchivedOrderSerializer(*args, context=self.get_serializer_context(), **self.sparse_kwargs(), **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Completed orders move to the archive after a while (api.archival), keeping their id
+            queryset = sparse_queryset(self.archived_queryset(), self.archived_serializer())
+            return Response(self.archived_serializer(self.locate(queryset)).data)
+
+    # The user's own orders, archived ones included, newest first: ?limit= (default 50, at most 500)
+    @action(detail=False)
+    def history(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=400)
+        live = sparse_queryset(self.get_queryset(), self.get_serializer(), ['created_at'])
+        archived = sparse_queryset(self.archived_queryset(), self.archived_serializer(), ['created_at'])
+        entries = []
+        for queryset, serialize in ((live, self.get_serializer), (archived, self.archived_serializer)):
+            orders = list(queryset.filter(user=request.user).order_by('-created_at', '-id')[:limit])
+            entries += zip([(order.created_at, order.id) for order in orders], serialize(orders, many=True).data)
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        return Response([data for _, data in entries[:limit]])
+
+# Payment history: the user's own transactions (staff see all); ?store= reads that store's database
+class TransactionViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = TransactionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        store = self.request.query_params.get('store')
+        queryset = Transaction.objects.using(shard_for_store(store)) if store else Transaction.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset.order_by('-timestamp', '-id')
+
+# Kitchen queue for one store, read from that store's database only
+class StoreOrdersView(generics.ListAPIView):
+    serializer_class = OrderSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        queryset = Order.objects.for_store(self.kwargs['store']).prefetch_related('items').order_by('created_at')
+        return queryset.filter(status=self.request.query_params.get('status', 'Pending'))
+
+# Staff sales report: every order database is queried in parallel and the results merged
+class StoreReportView(APIView):
+    permission_classes = [IsAdminUser]
 
-class OrderItemViewSet(viewsets.ModelViewSet):
+    def get(self, request, *args, **kwargs):
+        def shard_totals(alias):
+            return list(
+                Order.objects.using(alias).values('store', 'status')
+                .annotate(orders=Count('id'), revenue=Sum('total_price'))
+            )
+
+        report = {}
+        for rows in fan_out(shard_totals):
+            for row in rows:
+                store = report.setdefault(row['store'], {'orders': 0, 'revenue': Decimal('0.00'), 'by_status': {}})
+                store['orders'] += row['orders']
+                store['revenue'] += row['revenue'] or 0
+                store['by_status'][row['status']] = store['by_status'].get(row['status'], 0) + row['orders']
+        for store in report.values():
+            store['revenue'] = f"{store['revenue']:.2f}"
+        return Response(report)
+
+# Incremental read of the order event log: pass the returned cursor back as ?after=
+class OrderEventLogView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = min(int(request.query_params.get('limit', 500)), 1000)
+        except ValueError:
+            return Response({'error': 'after and limit must be integers'}, status=400)
+        events = OrderEvent.objects.filter(id__gt=after).order_by('id')
+        if request.query_params.get('store'):
+            events = events.filter(store=request.query_params['store'])
+        # Ids are handed out before commit, so a just-written event can still be followed by
+        # a lower id that becomes visible later: stop at the first event inside the lag window
+        # and let the next read pick it up, rather than moving the cursor past the gap
+        settled = timezone.now() - timedelta(seconds=settings.ORDER_EVENT_LOG_LAG_SECONDS)
+        events = list(takewhile(lambda event: event.logged_at <= settled, events[:max(limit, 1)]))
+        return Response({
+            'events': OrderEventSerializer(events, many=True).data,
+            'cursor': events[-1].id if events else after,
+        })
+
+class OrderItemViewSet(StoreLookupMixin, viewsets.ModelViewSet):
     queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'order-writes'
 
     def perform_create(self, serializer):
         # Ensure that the order item is linked to an order that belongs to the current user
@@ -78,29 +276,395 @@ class OrderItemViewSet(viewsets.ModelViewSet):
 # Payment view
 class StripeChargeView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'payments'
 
     def post(self, request, *args, **kwargs):
         serializer = TransactionSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             amount = int(serializer.validated_data['amount'] * 100)  # Convert dollars to cents
             description = serializer.validated_data.get('description', 'No description provided')
+            stripe = get_stripe()
+
+            # Paying for an open order: its lines must hold stock again if their reservation lapsed
+            order = None
+            if request.data.get('order') is not None:
+                order_id = request.data['order']
+                orders = []
+                if not isinstance(order_id, bool) and str(order_id).isdigit():
+                    orders = Order.objects.filter(user=request.user, status='Pending').locate(order_id)
+                if len(orders) != 1:
+                    return Response({'error': 'Unknown order'}, status=400)
+                order = orders[0]
+                # The order is charged its own total, so its transaction reconciles with it
+                if serializer.validated_data['amount'] != order.total_price:
+                    return Response({'error': 'Amount does not match the order total'}, status=400)
 
             try:
-                payment_intent = stripe.PaymentIntent.create(
-                    amount=amount,
-                    currency='usd',
-                    description=description,
-                    payment_method=request.data['token'],  # obtained with Stripe.js
-                    confirm=True,
-                    return_url=request.data['return_url']
-                )
-                
-                # Check if payment_intent status is 'succeeded' or 'requires_capture'
-                if payment_intent.status in ['succeeded', 'requires_capture']:
-                    transaction = serializer.save(user=request.user, stripe_charge_id=payment_intent.id, paid=True)
-                    return Response(TransactionSerializer(transaction).data, status=201)
-                else:
-                    return Response({'error': 'Payment failed'}, status=400)
+                with db_transaction.atomic(), db_transaction.atomic(using=order._state.db if order else 'default'):
+                    if order is not None:
+                        reserve_order(order)
+                    payment_intent = stripe.PaymentIntent.create(
+                        amount=amount,
+                        currency='usd',
+                        description=description,
+                        payment_method=request.data['token'],  # obtained with Stripe.js
+                        confirm=True,
+                        return_url=request.data['return_url']
+                    )
+
+                    # Check if payment_intent status is 'succeeded' or 'requires_capture'
+                    if payment_intent.status in ['succeeded', 'requires_capture']:
+                        transaction = serializer.save(user=request.user, order=order, stripe_charge_id=payment_intent.id, paid=True)
+                        if order is not None:
+                            record(order, 'paid', transaction=transaction.id, amount=str(transaction.amount))
+                        receipts.queue_receipt(transaction)
+                        return Response(TransactionSerializer(transaction).data, status=201)
+                    else:
+                        # Raising inside the atomic block gives back any stock re-reserved above
+                        raise PaymentDeclined()
+            except OutOfStock as e:
+                return Response({'error': str(e)}, status=409)
+            except PaymentDeclined:
+                return Response({'error': 'Payment failed'}, status=400)
             except stripe.error.StripeError as e:
                 return Response({'error': str(e)}, status=400)
         return Response(serializer.errors, status=400)
+
+
+# Everything the app needs on launch in one round trip: the cached catalog, live
+# sold-out ids and the user's open order. Clients that send their ?catalog_version=
+# get the catalog only when it has changed.
+class BootstrapView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        version = catalog.catalog_version()
+        sold_out = catalog.sold_out()
+        data = {'catalog_version': version}
+        if request.query_params.get('catalog_version') != str(version):
+            data.update(catalog.catalog_payload(version, sold_out))
+        data['sold_out'] = sold_out
+
+        store = request.query_params.get('store')
+        orders = Order.objects.for_store(store) if store else Order.objects.all()
+        order = orders.filter(user=request.user, status='Pending').order_by('-created_at') \
+            .prefetch_related('items__toppings').first()
+        data['order'] = order and {
+            'id': order.id,
+            **OrderSerializer(order).data,
+            'lines': [{'id': line.id, **OrderItemSerializer(line).data} for line in order.items.all()],
+        }
+        return Response(data)
+
+# Staff prep forecast per menu item size and topping for the coming hours, from the demand
+# counted by `manage.py update_demand` (run it on a schedule; a GET never counts)
+class DemandForecastView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        from .forecasting import forecast  # NumPy loads on first use, not at worker start
+        try:
+            horizon = min(max(int(request.query_params.get('horizon', 24)), 1), 168)
+        except ValueError:
+            return Response({'error': 'horizon must be an integer'}, status=400)
+
+        now = time.time()
+        first_hour = int(now // 3600) * 3600
+        data = {'hours': [datetime.fromtimestamp(first_hour + 3600 * i, tz=dt_timezone.utc) for i in range(horizon)]}
+        for kind, model, key in (('item', MenuItem, 'items'), ('topping', Topping, 'toppings')):
+            predicted = forecast(kind, horizon, now)
+            names = model.objects.in_bulk({ref_id for ref_id, _ in predicted})
+            rows = [
+                {'id': ref_id, 'name': names[ref_id].name, 'forecast': [round(value, 2) for value in values.tolist()],
+                 'total': round(float(values.sum()), 2)}
+                | ({'size': size or None} if kind == 'item' else {})
+                for (ref_id, size), values in predicted.items() if ref_id in names
+            ]
+            data[key] = sorted(rows, key=lambda row: row['total'], reverse=True)
+        return Response(data)
+
+# Delivery fee and ETA for an address (defaults to the user's profile address)
+class DeliveryQuoteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        address = request.query_params.get('address')
+        if not address:
+            profile = UserProfile.objects.filter(user=request.user).first()
+            address = profile.address if profile else ''
+        if not address.strip():
+            return Response({'error': 'No address given and none on the profile'}, status=400)
+
+        point = delivery.geocode(address)
+        if point is None:
+            return Response({'error': 'Address could not be located'}, status=404)
+        zone = delivery.get_zone_index().find(*point)
+        if zone is None:
+            return Response({'error': 'Address is outside the delivery area'}, status=404)
+        return Response({'address': address, 'zone': zone.name, 'fee': f'{zone.fee:.2f}', 'eta_minutes': zone.eta_minutes})
+
+# Receipts are rendered by the background pool after payment; this only serves the cached file
+class ReceiptView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk, ext, *args, **kwargs):
+        if ext not in receipts.CONTENT_TYPES:
+            raise Http404
+        if ext == 'pdf' and not receipts.pdf_available():
+            return Response({'error': 'PDF receipts are not available'}, status=404)
+        using = shard_for_store(request.query_params.get('store', settings.DEFAULT_STORE))
+        payments = Transaction.objects.using(using)
+        if not request.user.is_staff:
+            payments = payments.filter(user=request.user)
+        if not payments.filter(id=pk).exists():
+            raise Http404
+
+        try:
+            receipt = open(receipts.receipt_path(pk, using, ext), 'rb')
+        except FileNotFoundError:
+            # Not rendered in this format yet (or the cache was cleared): make sure it is queued
+            receipts.submit_receipt(pk, using)
+            response = Response({'status': 'pending'}, status=202)
+            response['Retry-After'] = '1'
+            return response
+        return FileResponse(receipt, content_type=receipts.CONTENT_TYPES[ext], filename=f'receipt-{pk}.{ext}')
+
+class PaymentDeclined(Exception):
+    pass
+
+# One-call checkout: order, lines and payment in a single request and DB transaction
+class CheckoutView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'payments'
+
+    def post(self, request, *args, **kwargs):
+        serializer = CheckoutSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        data = serializer.validated_data
+        stripe = get_stripe()
+        store = data.get('store', settings.DEFAULT_STORE)
+
+        try:
+            # Stock lives on the default database and the order on its store's; both roll back together
+            with db_transaction.atomic(), db_transaction.atomic(using=shard_for_store(store)):
+                order = self.create_order(request.user, data['items'], store)
+                payment_params = {
+                    'amount': int(order.total_price * 100),  # Convert dollars to cents
+                    'currency': 'usd',
+                    'description': data.get('description') or f'Order #{order.id}',
+                    'payment_method': data['token'],
+                    'confirm': True,
+                }
+                if data.get('return_url'):
+                    payment_params['return_url'] = data['return_url']
+                payment_intent = stripe.PaymentIntent.create(**payment_params)
+                if payment_intent.status not in ['succeeded', 'requires_capture']:
+                    # Raising inside the atomic block rolls back the order and its lines
+                    raise PaymentDeclined()
+                transaction = Transaction.objects.create(
+                    user=request.user,
+                    order=order,
+                    amount=order.total_price,
+                    stripe_charge_id=payment_intent.id,
+                    description=data.get('description', ''),
+                    paid=True,
+                )
+                record(order, 'paid', transaction=transaction.id, amount=str(transaction.amount))
+                receipts.queue_receipt(transaction)
+        except OutOfStock as e:
+            return Response({'error': str(e)}, status=400)
+        except PaymentDeclined:
+            return Response({'error': 'Payment failed'}, status=400)
+        except stripe.error.StripeError as e:
+            return Response({'error': str(e)}, status=400)
+
+        return Response({
+            'order_id': order.id,
+            'order': OrderSerializer(order).data,
+            'transaction': TransactionSerializer(transaction).data,
+        }, status=201)
+
+    def create_order(self, user, lines, store):
+        # Lines are bulk inserted, so the per-item total signals don't fire; the total is priced once here
+        order = Order.objects.create(user=user, store=store)
+        for line in lines:
+            reserve(line['item'], line['quantity'], line.get('toppings', []))
+        items = OrderItem.objects.using(order._state.db).bulk_create([
+            OrderItem(order=order, item=line['item'], size=line['size'], quantity=line['quantity'], reserved=True)
+            for line in lines
+        ])
+        OrderItem.toppings.through.objects.using(order._state.db).bulk_create([
+            OrderItem.toppings.through(orderitem_id=item.id, topping_id=topping.id)
+            for item, line in zip(items, lines)
+            for topping in line.get('toppings', [])
+        ])
+        for item in items:
+            record(order, 'item_added', line=item.id, item=item.item_id, size=item.size, quantity=item.quantity)
+        order.total_price = sum(
+            OrderItem.price_line(line['item'], line['size'], line['quantity'], line.get('toppings', []))
+            for line in lines
+        )
+        order.save()
+        return order
+
+
+# Stripe webhook: verify, store in the inbox and acknowledge; `process_stripe_events` applies them
+class StripeWebhookView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request, *args, **kwargs):
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            # Fail closed: without the signing secret no event can be trusted
+            return Response({'error': 'Webhook endpoint is not configured'}, status=503)
+        stripe = get_stripe()
+        payload = request.body
+        try:
+            stripe.WebhookSignature.verify_header(
+                payload.decode('utf-8'), request.META.get('HTTP_STRIPE_SIGNATURE'), settings.STRIPE_WEBHOOK_SECRET
+            )
+            event = json.loads(payload)
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response({'error': 'Invalid payload or signature'}, status=400)
+
+        # Redelivered events hit the unique event_id and are dropped
+        StripeEvent.objects.bulk_create(
+            [StripeEvent(event_id=event['id'], type=event['type'], payload=event)],
+            ignore_conflicts=True,
+        )
+        return Response({'received': True})
+
+
+### Async read endpoints
+# Native async views for the hot read paths. Under ASGI these run on the event
+# loop and only hop to a thread for the actual database I/O, so an idle
+# connection no longer holds a worker thread. Responses match the DRF views, except
+# that async_orders shows users other than staff only their own orders.
+
+def _json_response(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+def async_read_view(view):
+    """Authenticate with a JWT and map errors the way DRF would, for GET-only async views."""
+    authenticator = AsyncJWTAuthentication()
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return _json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        try:
+            result = await authenticator.aauthenticate(request)
+            if result is None:
+                response = _json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+                response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+                return response
+            request.user = result[0]
+            return _json_response(await view(request, *args, **kwargs))
+        except Http404:
+            return _json_response({'detail': 'No matching object found.'}, status=404)
+        except APIException as exc:
+            response = _json_response(exc.detail, status=exc.status_code)
+            if exc.status_code == 401:
+                response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            return response
+    return wrapper
+
+async def _aget_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+@async_read_view
+async def async_menu_items(request, pk=None):
+    if pk is not None:
+        return MenuItemSerializer(await _aget_or_404(MenuItem.objects.all(), pk=pk)).data
+    return MenuItemSerializer([item async for item in MenuItem.objects.all()], many=True).data
+
+@async_read_view
+async def async_toppings(request, pk=None):
+    if pk is not None:
+        return ToppingSerializer(await _aget_or_404(Topping.objects.all(), pk=pk)).data
+    return ToppingSerializer([topping async for topping in Topping.objects.all()], many=True).data
+
+@async_read_view
+async def async_orders(request, pk=None):
+    queryset = Order.objects.prefetch_related('items')
+    if not request.user.is_staff:
+        # Same visibility rule as OrderItemViewSet: users only see their own orders
+        queryset = queryset.filter(user=request.user)
+    if pk is not None:
+        return OrderSerializer(await _aget_or_404(queryset, pk=pk)).data
+    return OrderSerializer([order async for order in queryset], many=True).data
+
+
+### Async registration and login
+# Same contracts as UserCreate and TokenObtainPairView, but password hashing runs in
+# the bounded pool in api.hashers rather than on a request worker. When that pool is
+# saturated the request is shed with a 503 instead of queueing behind it.
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+def async_auth_view(throttle_scope):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return _json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+            # Same buckets as the sync endpoints (callers are anonymous here, so by IP);
+            # off the event loop, as taking a token may wait on the SQLite lock
+            wait = await sync_to_async(take_token, thread_sensitive=False)(throttle_scope, ip_ident(request))
+            if wait:
+                response = _json_response({'detail': f'Request was throttled. Expected available in {math.ceil(wait)} seconds.'}, status=429)
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+            data = _request_data(request)
+            if not isinstance(data, dict):
+                return _json_response({'detail': 'JSON parse error'}, status=400)
+            try:
+                return await view(request, data, *args, **kwargs)
+            except HashingBusy:
+                response = _json_response({'detail': 'Too many sign-ins right now, please retry.'}, status=503)
+                response['Retry-After'] = '1'
+                return response
+        # Token-authenticated API: there is no session cookie to protect
+        return csrf_exempt(wrapper)
+    return decorator
+
+@async_auth_view('register')
+async def async_register(request, data):
+    serializer = UserSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return _json_response(serializer.errors, status=400)
+    validated = serializer.validated_data
+    user = await User.objects.acreate(
+        username=User.normalize_username(validated['username']),
+        email=User.objects.normalize_email(validated.get('email', '')),
+        password=await amake_password(validated['password']),
+    )
+    return _json_response(UserSerializer(user).data, status=201)
+
+@async_auth_view('login')
+async def async_token_obtain(request, data):
+    username, password = data.get(User.USERNAME_FIELD), data.get('password')
+    missing = {field: ['This field is required.'] for field, value in ((User.USERNAME_FIELD, username), ('password', password)) if not value}
+    if missing:
+        return _json_response(missing, status=400)
+
+    user = await User.objects.filter(**{User.USERNAME_FIELD: username}).afirst()
+    if user is None:
+        # Hash anyway, so response time doesn't reveal which usernames exist
+        await amake_password(password)
+    elif await acheck_user_password(user, password) and user.is_active:
+        refresh = RefreshToken.for_user(user)
+        return _json_response({'refresh': str(refresh), 'access': str(refresh.access_token)})
+    return _json_response({'detail': 'No active account found with the given credentials'}, status=401)
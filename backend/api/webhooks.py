@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .events import record
+from .models import StripeEvent, Transaction
+from .routers import order_databases
+
+# Event type -> the Transaction.paid value it implies
+PAID_STATE_BY_EVENT = {
+    'payment_intent.succeeded': True,
+    'payment_intent.amount_capturable_updated': True,  # Authorised, awaiting delayed capture
+    'payment_intent.payment_failed': False,
+    'payment_intent.canceled': False,
+    'charge.refunded': False,
+}
+
+
+def payment_intent_id(event):
+    obj = event['data']['object']
+    if obj.get('object') == 'charge':
+        if event['type'] == 'charge.refunded' and not obj.get('refunded'):
+            return None  # Partial refund; the payment still stands
+        return obj.get('payment_intent')
+    return obj.get('id')
+
+
+def process_stripe_events(batch_size=500):
+    """
+    Apply one batch of unprocessed inbox events to Transaction.paid and return
+    how many events were consumed.
+
+    Within a batch the newest event per payment intent wins. Each transaction
+    remembers the event its state came from, so an older event that arrives in
+    a later batch is skipped rather than overwriting newer state.
+    """
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        newest_by_intent = {}
+        for event in sorted(events, key=lambda e: (e.payload.get('created', 0), e.id)):
+            paid = PAID_STATE_BY_EVENT.get(event.type)
+            intent_id = payment_intent_id(event.payload) if paid is not None else None
+            if intent_id:
+                newest_by_intent[intent_id] = (event, paid)
+
+        if newest_by_intent:
+            # A transaction lives on its store's database, which the event doesn't name
+            for alias in order_databases():
+                with transaction.atomic(using=alias):
+                    payments = (
+                        Transaction.objects.using(alias).select_for_update(of=('self',))
+                        .filter(stripe_charge_id__in=newest_by_intent).select_related('order')
+                    )
+                    applied = []
+                    for payment in payments:
+                        event, paid = newest_by_intent[payment.stripe_charge_id]
+                        created = event.payload.get('created', 0)
+                        if payment.stripe_event_created is not None and created < payment.stripe_event_created:
+                            continue
+                        if paid and not payment.paid and payment.order is not None:
+                            record(payment.order, 'paid', transaction=payment.id, amount=str(payment.amount))
+                        payment.paid = paid
+                        payment.stripe_event_created = created
+                        payment.stripe_event_id = event.event_id
+                        applied.append(payment)
+                    Transaction.objects.using(alias).bulk_update(
+                        applied, ['paid', 'stripe_event_created', 'stripe_event_id'], batch_size=500
+                    )
+
+        StripeEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=timezone.now())
+    return len(events)
@@ -40,6 +40,16 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    # orjson-backed JSON, same output as DRF's (falls back to the stock classes without orjson)
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "api.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 SIMPLE_JWT = {
@@ -63,6 +73,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.LoadSheddingMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +83,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "corsheaders.middleware.CorsMiddleware",
+    'api.middleware.ReplicaPinningMiddleware',
+    'api.middleware.OrderEventBatchMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -104,10 +118,76 @@ DATABASES = {
     }
 }
 
+# Optional read replica for menu browsing and order history.
+# Set REPLICA_DATABASE_NAME to the replica's database file to enable it.
+REPLICA_DATABASE_ALIAS = 'replica'
+if os.environ.get('REPLICA_DATABASE_NAME'):
+    DATABASES[REPLICA_DATABASE_ALIAS] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['REPLICA_DATABASE_NAME'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.routers.StoreShardRouter', 'api.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = 5  # Reads stay on the primary this long after a client writes (a signed cookie carries the pin)
+REPLICA_MAX_LAG_SECONDS = 10  # Fall back to the primary when the replica is further behind
+REPLICA_LAG_CHECK_INTERVAL = 5  # Seconds between replica lag checks
+
+# Store -> database alias holding that store's orders, order items and transactions.
+# Extra aliases must also be defined in DATABASES; unlisted stores use 'default'.
+STORE_DATABASES = {
+    'main': 'default',
+}
+DEFAULT_STORE = 'main'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
+# Password hashing policy. PASSWORD_HASHER picks the hasher for new passwords; the
+# others stay listed so existing hashes verify and are upgraded on the next login.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')  # pbkdf2, scrypt or argon2 (needs argon2-cffi)
+PASSWORD_HASHER_PARAMS = {
+    'pbkdf2': {'iterations': 1_000_000},
+    'scrypt': {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1},
+    'argon2': {'time_cost': 2, 'memory_cost': 102400, 'parallelism': 8},
+}
+_POLICY_HASHERS = {
+    'pbkdf2': 'api.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'api.hashers.ScryptPasswordHasher',
+    'argon2': 'api.hashers.Argon2PasswordHasher',
+}
+PASSWORD_HASHERS = [_POLICY_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _POLICY_HASHERS.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Threads hashing passwords for the async register/login views (None: one per CPU),
+# and how many more requests may wait for one before the rest get a 503
+PASSWORD_HASHING_WORKERS = None
+PASSWORD_HASHING_QUEUE = 64
+
+# Token-bucket throttles per scope: `rate` refills each user's (or anonymous IP's) bucket, up to `burst`.
+# Buckets live in a SQLite file so all worker processes on the host share them.
+THROTTLE_DB = os.environ.get('THROTTLE_DB', os.path.join(BASE_DIR, 'throttle.sqlite3'))
+TOKEN_BUCKETS = {
+    'register': {'rate': '5/hour', 'burst': 5},
+    'login': {'rate': '10/min', 'burst': 20},
+    'payments': {'rate': '10/min', 'burst': 10},
+    'order-writes': {'rate': '60/min', 'burst': 120},
+}
+
+# Load shedding (off unless set): 503 once a process has this many requests in flight,
+# or once a request has queued upstream this long according to X-Request-Start
+LOAD_SHED_MAX_IN_FLIGHT = int(os.environ['LOAD_SHED_MAX_IN_FLIGHT']) if os.environ.get('LOAD_SHED_MAX_IN_FLIGHT') else None
+LOAD_SHED_MAX_QUEUE_MS = int(os.environ['LOAD_SHED_MAX_QUEUE_MS']) if os.environ.get('LOAD_SHED_MAX_QUEUE_MS') else None
+LOAD_SHED_RETRY_AFTER = 1
+
+# Response compression: bodies smaller than this go out as they are (headers would eat the saving).
+# Brotli needs the optional brotli package; its quality 4-5 is about gzip's speed at a better ratio.
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -149,8 +229,44 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOWS_CREDENTIALS = True
 
+# Stock held by a Pending order is returned after it has been idle this long (`manage.py expire_reservations`)
+STOCK_RESERVATION_TTL_MINUTES = 30
+
+# Completed orders older than this move to the archive tables (`manage.py archive_orders`), this many per transaction
+ORDER_ARCHIVE_AFTER_DAYS = 90
+ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# The order event log holds back events written less than this long ago, so a reader's cursor
+# never moves past an event that commits after a later id (keep it above the slowest insert)
+ORDER_EVENT_LOG_LAG_SECONDS = 2
+
+# Fail `manage.py coldstart` when a fresh worker takes longer than this to serve its first request
+COLD_START_BUDGET_MS = 1500
+
 STRIPE_SECRET_KEY = ''
 STRIPE_PUBLISHABLE_KEY = ''
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')  # Signing secret of the webhook endpoint
+# Without it the webhook endpoint can't verify anything and answers 503 (`manage.py check --deploy` warns)
+
+# The serialized catalog is cached per catalog version (bumped on every menu or topping edit)
+CATALOG_CACHE_SECONDS = 60 * 60
+
+# Demand forecast: seasonality from this many weeks of history, level from the most recent window
+FORECAST_HISTORY_WEEKS = 8
+FORECAST_WINDOW_WEEKS = 2
+FORECAST_BATCH_SIZE = 20000  # Order lines read per step when counting new demand
+FORECAST_LAG_SECONDS = 60  # Lines of orders changed more recently wait for the next count (their transaction may be open)
+
+# Delivery zones (GeoJSON polygons with name, fee and eta_minutes) and the address lookup table
+DELIVERY_ZONES_FILE = os.path.join(BASE_DIR, 'delivery', 'zones.geojson')
+DELIVERY_GRID_CELL_DEGREES = 0.01  # Roughly 1 km; smaller cells mean fewer polygon tests per lookup
+DELIVERY_GEOCODER = 'api.delivery.LookupTableGeocoder'
+GEOCODER_LOOKUP_FILE = os.path.join(BASE_DIR, 'delivery', 'addresses.csv')
+GEOCODER_MISS_TTL_SECONDS = 24 * 3600  # Addresses the geocoder didn't know are looked up again after this
+
+# Rendered receipts, keyed by database alias and transaction id (not served as media: they are private)
+RECEIPTS_DIR = os.path.join(BASE_DIR, 'receipts')
+RECEIPT_WORKERS = 2
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
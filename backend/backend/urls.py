@@ -2,14 +2,17 @@ from django.contrib import admin
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include
-from api.views import UserCreate
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from api.views import UserCreate, ThrottledTokenObtainPairView, async_register, async_token_obtain
+from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/register/', UserCreate.as_view(), name='register'),
-    path('api/token/', TokenObtainPairView.as_view(), name='get_token'),
+    path('api/token/', ThrottledTokenObtainPairView.as_view(), name='get_token'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='refresh'),
+    # Same as the two above, with password hashing off the request worker (for ASGI deployments)
+    path('api/async/user/register/', async_register, name='async-register'),
+    path('api/async/token/', async_token_obtain, name='async-get-token'),
     path('api-auth/', include('rest_framework.urls')),
     path('api/', include('api.urls'))
 ]